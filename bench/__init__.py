@@ -0,0 +1,5 @@
+# Benchmarks - Project Heimon
+#
+# Offline microbenchmarks for the hot paths (parsing, state machine). Run the
+# individual modules from the project root, e.g.:
+#   python -m bench.parsers
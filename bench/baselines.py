@@ -0,0 +1,66 @@
+# Baselines Benchmark - Project Heimon
+#
+# Measures how long recomputing every baseline and scoring a cycle's results
+# takes in heimon.baselines (with NumPy if it is installed).
+#
+# Usage: python -m bench.baselines [num_heimdalls]
+
+import sys
+import random
+
+from time import perf_counter
+from heimon import baselines
+from heimon.baselines import AnomalyDetector
+from heimon.results import *
+
+
+def build_result(rng, heimdall_id):
+    result = ProbeResult('Bench')
+    result.usercount = int(rng.gauss(1200, 30))
+    result.usercount_max = 3000
+    result.which_delay = abs(rng.gauss(0.2, 0.03))
+    result.heimdall = HeimdallInfo(4001, heimdall_id, 3, 1000, 1, 777, 9)
+    result.horton = HortonInfo('10.0.0.1', 7000, rng.choice((2, 3)), 3000, 1, 777, 'v42')
+    result.tribble = TribbleInfo(9, 1, 40, 1, 777, 10, 20, 'Lazy', 't7')
+    return result
+
+
+def best_time(func, count, repeat=5):
+    best = None
+    for i in range(repeat):
+        ts_start = perf_counter()
+        for j in range(count):
+            func()
+        elapsed = perf_counter() - ts_start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count
+
+
+def run(num_heimdalls=100, count=1000):
+    rng = random.Random(1)
+    detector = AnomalyDetector()
+    cycle = [build_result(rng, h_id) for h_id in range(1, num_heimdalls + 1)]
+    for i in range(50):
+        detector.check_results(cycle, 1e9 + i)
+
+    recompute = best_time(lambda: detector.baselines.recompute(12), count)
+    check = best_time(lambda: detector.check_results(cycle, 1e9), max(1, count // 10))
+    return {
+        'numpy': 1 if baselines.numpy is not None else 0,
+        'num_baselines': len(detector.baselines),
+        'recompute_usecs': recompute * 1e6,
+        'recomputes_per_sec': 1.0 / recompute,
+        'cycle_check_usecs': check * 1e6,
+        'results_per_sec': len(cycle) / check,
+    }
+
+
+def main(argv):
+    num_heimdalls = int(argv[1]) if len(argv) > 1 else 100
+    for (key, value) in run(num_heimdalls).items():
+        print("%-36s %12.1f" % (key, value))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,50 @@
+# Benchmark Corpus - Project Heimon
+#
+# Generates realistic, deterministic server traffic for the benchmarks: mostly
+# chat, map and avatar data with the occasional `which response mixed in.
+
+import random
+
+WHICH_PREFIX = "(<img src='fsh://system.fsh:86' /> You are connected to "
+
+
+def which_lines(heimdall_id=1, global_id=12345, tribble_id=9):
+    """Return the three `which response lines (heimdall, horton, tribble)"""
+    return [
+        bytes(WHICH_PREFIX + "Heimdall [4001:%d] (QTEMP 3). There are 212 players on this Heimdall, of which you are player index 17 with globalid %d, and you are on map %d" % (heimdall_id, global_id, tribble_id), 'utf-8'),
+        bytes(WHICH_PREFIX + "Horton [10.0.0.12:7000] (QTEMP 2). There are 1310 players in this horton, of which you are the player index 88 with global id %d. It's a beautiful day in Gosford Park. Horton is running version: v31" % global_id, 'utf-8'),
+        bytes(WHICH_PREFIX + "tribble [%d] (QTEMP <b>1</b>). There are 43 players on this tribble, of which you are player index 5 with global id %d. You are exactly at (104,220). This tribble feels like Sleepy and is running version: t12" % (tribble_id, global_id), 'utf-8'),
+    ]
+
+
+def noise_line(rng):
+    """Return a single non-`which line of the kind the server sends all the time"""
+    kind = rng.random()
+    if kind < 0.35:
+        # chat (also starts with a parenthesis, like `which responses)
+        return bytes("(<name shortname='furre%d'>Furre%d</name>: %s" % (
+            rng.randrange(1000), rng.randrange(1000),
+            " ".join(rng.choice(["hi", "hello", "lag?", "brb", "*hugs*", "anyone", "here", "lol"])
+                     for i in range(rng.randrange(2, 12)))), 'utf-8')
+    elif kind < 0.45:
+        # system message (same image prefix, different text)
+        return bytes("(<img src='fsh://system.fsh:86' /> Your dreams are pleasant and you rest well.", 'utf-8')
+    elif kind < 0.75:
+        # avatar movement/appearance
+        return b"/" + bytes(rng.choice(b"!#$%&") for i in range(rng.randrange(8, 40)))
+    elif kind < 0.95:
+        # map/object data
+        return b">" + bytes(rng.randrange(35, 126) for i in range(rng.randrange(20, 120)))
+    else:
+        return b"~"
+
+
+def mixed_traffic(num_lines=20000, which_every=200, seed=1):
+    """Return a list of lines with a full `which response every which_every lines"""
+    rng = random.Random(seed)
+    lines = []
+    while len(lines) < num_lines:
+        for i in range(which_every - 3):
+            lines.append(noise_line(rng))
+        lines.extend(which_lines(rng.randrange(1, 7), rng.randrange(10000, 99999)))
+    return lines[:num_lines]
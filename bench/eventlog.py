@@ -0,0 +1,97 @@
+# Event Log Benchmark - Project Heimon
+#
+# Measures heimon.eventlog on a synthetic history (months of alert events
+# across a handful of heimdalls and tests): how fast events are appended and
+# how long time-range and key queries take against the index, compared to
+# reading every record (i.e., what grepping the text log amounts to).
+#
+# Usage: python -m bench.eventlog [num_events]
+
+import sys
+import random
+import shutil
+import tempfile
+
+from time import perf_counter
+from heimon.alerts import AlertKey
+from heimon.eventlog import Event, EventLog, EventLogReader
+
+TESTS = ('TestNoError', 'TestAllComponentsPresent', 'TestGlobalIdInSync', 'TestNoAnomalies',
+         'TestNoHeimdallsAreMissing')
+DAY = 86400.0
+
+
+def build_events(num_events, num_days=90, seed=1):
+    rng = random.Random(seed)
+    ts = 1.46e9
+    step = num_days * DAY / num_events
+    for i in range(num_events):
+        ts += rng.expovariate(1.0 / step)
+        key = AlertKey(rng.choice(TESTS), rng.randint(1, 6), rng.choice((None, 'horton', 'tribble')))
+        kind = rng.choice(('raised', 'repeated', 'resolved'))
+        yield Event(ts, kind, key, "Something went wrong on heimdall %d" % key.heimdall, {'count': i % 17})
+
+
+def time_query(func, repeat=5):
+    """Best time (secs) of running a query to completion and the number of events it returned"""
+    best = None
+    for i in range(repeat):
+        ts_start = perf_counter()
+        num_events = sum(1 for event in func())
+        elapsed = perf_counter() - ts_start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, num_events)
+
+
+def run(num_events=500000):
+    directory = tempfile.mkdtemp(prefix='heimon-bench-')
+    try:
+        events = list(build_events(num_events))
+        ts_start = perf_counter()
+        event_log = EventLog(directory, segment_bytes=4 * 1024 * 1024)
+        for event in events:
+            event_log.append(event)
+        event_log.close()
+        append = perf_counter() - ts_start
+
+        ts_start = perf_counter()
+        reader = EventLogReader(directory)
+        open_secs = perf_counter() - ts_start
+
+        # "what alerted for heimdall 4 on day 50" and "everything in one hour of day 70"
+        day_from = events[0].ts + 50 * DAY
+        (key_secs, num_key) = time_query(lambda: reader.query(day_from, day_from + DAY, heimdall=4))
+        hour_from = events[0].ts + 70 * DAY
+        (range_secs, num_range) = time_query(lambda: reader.query(hour_from, hour_from + 3600))
+        (scan_secs, num_scan) = time_query(
+            lambda: (e for e in reader.query() if day_from <= e.ts <= day_from + DAY and e.key.heimdall == 4),
+            repeat=1)
+        assert num_scan == num_key
+        segments = len(reader.segments())
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+    return {
+        'num_events': num_events,
+        'num_segments': segments,
+        'events_per_sec': num_events / append,
+        'open_msecs': open_secs * 1000,
+        'key_query_msecs': key_secs * 1000,
+        'key_query_events': num_key,
+        'key_queries_per_sec': 1.0 / key_secs,
+        'range_query_msecs': range_secs * 1000,
+        'range_query_events': num_range,
+        'full_scan_msecs': scan_secs * 1000,
+    }
+
+
+def main(argv):
+    num_events = int(argv[1]) if len(argv) > 1 else 500000
+    for (key, value) in run(num_events).items():
+        print("%-36s %12.1f" % (key, value))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
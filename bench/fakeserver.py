@@ -0,0 +1,232 @@
+# Fake Server - Project Heimon
+#
+# A local stand-in for a Furcadia game server speaking just as much of the
+# protocol as HeimdallTest needs: the "#current max" user count line,
+# Dragonroar, login confirmation or rejection (]#) and the three `which
+# response lines. Logins land on the configured heimdalls round-robin. Lets
+# the probe code be load tested and benchmarked end to end without any
+# network access.
+#
+# Faults can be injected on a script (see Fault), each active for a window of
+# the server's clock (secs since it started) and on one or all heimdalls.
+# Everything is deterministic: the same script and the same sequence of
+# connections always get the same responses.
+#
+# Usage: python -m bench.fakeserver [port] [script file]
+
+import sys
+import socket
+import asyncio
+import multiprocessing
+
+from time import monotonic, time
+from bench.corpus import which_lines
+
+
+class Fault(object):
+    """
+    A fault active from `start` for `duration` secs on `heimdall` (None: all
+    of them). Kinds:
+      silent          - connections landing on the heimdall get no response at all
+      missing_horton  - `which responses lack the horton line
+      missing_tribble - `which responses lack the tribble line
+      lag             - `which responses are held back `param` secs (default 1)
+      fragment        - everything is written in `param`-byte pieces (default 7)
+      desync          - horton/tribble report a global ID other than the heimdall's
+      reject          - logins are rejected (]#)
+    """
+    KINDS = ('silent', 'missing_horton', 'missing_tribble', 'lag', 'fragment', 'desync', 'reject')
+    DEFAULT_PARAMS = {'lag': 1.0, 'fragment': 7}
+
+    def __init__(self, kind, start, duration, heimdall=None, param=None):
+        if kind not in self.KINDS:
+            raise ValueError("unknown fault: %s" % kind)
+        self.kind = kind
+        self.start = start
+        self.duration = duration
+        self.heimdall = heimdall
+        self.param = self.DEFAULT_PARAMS.get(kind) if param is None else param
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def applies(self, ts, heimdall_id):
+        return self.start <= ts < self.end and (self.heimdall is None or self.heimdall == heimdall_id)
+
+    def __repr__(self):
+        where = "all heimdalls" if self.heimdall is None else "heimdall %d" % self.heimdall
+        return "%s on %s at %g-%g secs" % (self.kind, where, self.start, self.end)
+
+
+def parse_script(text):
+    """
+    Parse a fault script: one fault per line - "start duration kind [heimdall|*]
+    [param]" - with # starting a comment
+    """
+    faults = []
+    for line in text.splitlines():
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        heimdall = int(words[3]) if len(words) > 3 and words[3] != '*' else None
+        param = float(words[4]) if len(words) > 4 else None
+        faults.append(Fault(words[2], float(words[0]), float(words[1]), heimdall, param))
+    return faults
+
+
+class FakeServer(object):
+    """asyncio server answering every connection like a game server would (faults aside)"""
+    def __init__(self, heimdall_ids=range(1, 7), usercount=(1200, 3000), faults=()):
+        self.heimdall_ids = list(heimdall_ids)
+        self.usercount = usercount
+        self.faults = list(faults)
+        self.address = None
+        self.ts_started = None     # wall clock time the server's clock started at
+        self.num_connections = 0
+        self.num_logins = 0
+        self.num_whichs = 0
+        self.__ts_origin = None
+        self.__server = None
+
+    def now(self):
+        """Secs on the server's clock (the one fault scripts refer to)"""
+        return monotonic() - self.__ts_origin
+
+    def active(self, kind, heimdall_id):
+        """The fault of a kind active on a heimdall right now (or None)"""
+        ts = self.now()
+        for fault in self.faults:
+            if fault.kind == kind and fault.applies(ts, heimdall_id):
+                return fault
+        return None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening (port 0: any free port); returns the (host, port) listened on"""
+        self.__server = await asyncio.start_server(self.__handle, host, port, backlog=4096)
+        self.address = self.__server.sockets[0].getsockname()[:2]
+        self.__ts_origin = monotonic()
+        self.ts_started = time()
+        return self.address
+
+    def close(self):
+        if self.__server:
+            self.__server.close()
+            self.__server = None
+
+    async def serve_forever(self):
+        await self.__server.serve_forever()
+
+    async def __handle(self, reader, writer):
+        session_id = self.num_connections
+        self.num_connections += 1
+        heimdall_id = self.heimdall_ids[session_id % len(self.heimdall_ids)]
+        try:
+            if self.active('silent', heimdall_id):
+                # swallow everything without ever answering
+                while await reader.read(4096):
+                    pass
+                return
+
+            await self.__write(writer, heimdall_id, b"#%d %d\nDragonroar\n" % self.usercount)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                line = line.rstrip(b"\r\n")
+                if line.startswith(b"connect "):
+                    if self.active('reject', heimdall_id):
+                        await self.__write(writer, heimdall_id, b"]#1 0 Your login was refused.\n")
+                        break
+                    self.num_logins += 1
+                    await self.__write(writer, heimdall_id, b"&&&&&&&&&&&&&\n")
+                elif line == b"which":
+                    self.num_whichs += 1
+                    await self.__which(writer, heimdall_id, session_id)
+                elif line == b"quit":
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def __which(self, writer, heimdall_id, session_id):
+        global_id = 100000 + session_id
+        lines = which_lines(heimdall_id, global_id)
+        if self.active('desync', heimdall_id):
+            lines = lines[:1] + which_lines(heimdall_id, global_id + 1)[1:]
+        if self.active('missing_tribble', heimdall_id):
+            lines = lines[:2]
+        if self.active('missing_horton', heimdall_id):
+            lines = lines[:1] + lines[2:]
+
+        lag = self.active('lag', heimdall_id)
+        if lag:
+            await asyncio.sleep(lag.param)
+        await self.__write(writer, heimdall_id, b"\n".join(lines) + b"\n")
+
+    async def __write(self, writer, heimdall_id, data):
+        fragment = self.active('fragment', heimdall_id)
+        if fragment is None:
+            writer.write(data)
+            await writer.drain()
+            return
+
+        # separate (small) TCP segments, a moment apart
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        size = max(1, int(fragment.param))
+        for pos in range(0, len(data), size):
+            writer.write(data[pos:pos + size])
+            await writer.drain()
+            await asyncio.sleep(0.001)
+
+
+def serve(port, ready_queue=None, **settings):
+    """
+    Run a FakeServer until killed (e.g., in a child process); puts its address
+    and the wall clock time its clock started at on ready_queue
+    """
+    async def run():
+        server = FakeServer(**settings)
+        address = await server.start(port=port)
+        if ready_queue is not None:
+            ready_queue.put((address, server.ts_started))
+        else:
+            print("Fake server listening on %s:%d" % address)
+            for fault in server.faults:
+                print("  fault: %r" % fault)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_process(**settings):
+    """
+    Start a FakeServer in a child process (on any free port); returns
+    (process, address, wall clock time its clock started at)
+    """
+    ready_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(0, ready_queue), kwargs=settings,
+                                      name="heimon-fake-server", daemon=True)
+    process.start()
+    (address, ts_started) = ready_queue.get(timeout=10)
+    return (process, tuple(address), ts_started)
+
+
+def main(argv):
+    faults = []
+    if len(argv) > 2:
+        with open(argv[2], encoding='utf-8') as fd:
+            faults = parse_script(fd.read())
+    serve(int(argv[1]) if len(argv) > 1 else 6500, faults=faults)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,212 @@
+# Fault Detection Benchmark - Project Heimon
+#
+# Runs the whole monitor (monitor.main: probe engine, HeimdallTest, all the
+# result tests, the alert engine) against the fake server (see
+# bench/fakeserver.py) playing a fault script, and measures how long it took
+# from the start of each fault until the monitor raised an alert pointing at
+# it - read back from the monitor's own event log. Alerts raised while no
+# fault was going on are counted as false alarms. The same script with the
+# same settings gives comparable figures, so scheduler and engine changes can
+# be benchmarked end to end.
+#
+# Usage: python -m bench.faults [--script file] [--scale X] [--engine E]
+#                               [--set G_NAME=value ...] [-o results.json]
+
+import os
+import sys
+import ast
+import json
+import shutil
+import signal
+import argparse
+import tempfile
+import multiprocessing
+
+from time import sleep, time
+from bench import fakeserver
+from bench.fakeserver import parse_script
+from heimon.eventlog import EventLogReader
+
+# start duration kind heimdall [param] (see bench.fakeserver.Fault)
+DEFAULT_SCRIPT = """
+10  6  desync          2
+20  6  missing_horton  3
+30  6  lag             4  0.5
+40  8  silent          5
+52  5  reject          *
+61  5  fragment        *  7
+"""
+
+# how long after a fault ended its after-effects may still raise alerts
+GRACE_SECS = 8.0
+
+# monitor.py settings for the run (on top of which --set applies)
+MONITOR_SETTINGS = {
+    'G_TARGETS': None,
+    'G_PROBE_ENGINE': "asyncio",
+    'G_PROBE_CONCURRENCY': 4,
+    'G_PROBE_SCHEDULER': "fixed",
+    'G_CHECK_INTERVAL': 0.1,
+    'G_TIMEOUT_SECS': 1.0,
+    'G_HEIMDALL_ALERT_SECS': 3,
+    'G_ANOMALY_MIN_SAMPLES': 10,
+    'G_CHARACTER_COOLDOWN': 0.0,
+    'G_CHARACTER_BACKOFF': 1.0,
+    'G_CHARACTER_MAX_BACKOFF': 2.0,
+    'G_MAX_LOGINS_PER_SEC': 50.0,
+    'G_LOGIN_BURST': 10,
+    'G_ALERTS_LOGFILE': None,
+    'G_CAPTURE_FILE': None,
+    'G_METRICS_ADDRESS': None,
+    'G_PROFILE_SIGNAL': None,
+    'G_PROFILE_CONTROL_ADDRESS': None,
+}
+
+
+def heimdall_matches(fault, key):
+    return fault.heimdall is None or key.heimdall == fault.heimdall
+
+
+# fault kind -> whether an alert key points at a fault of that kind (None: should go unnoticed)
+DETECTED_BY = {
+    'silent': lambda fault, key: key.test == 'TestNoHeimdallsAreMissing' and heimdall_matches(fault, key),
+    'missing_horton': lambda fault, key: key.test == 'TestAllComponentsPresent' and key.component == 'horton'
+                                         and heimdall_matches(fault, key),
+    'missing_tribble': lambda fault, key: key.test == 'TestAllComponentsPresent' and key.component == 'tribble'
+                                          and heimdall_matches(fault, key),
+    'lag': lambda fault, key: (key.test in ('TestWhichDelayAboveThreshold', 'WhichSession')
+                               or (key.test == 'TestNoAnomalies' and key.component == 'which_delay'))
+                              and heimdall_matches(fault, key),
+    'desync': lambda fault, key: key.test == 'TestGlobalIdInSync' and heimdall_matches(fault, key),
+    'reject': lambda fault, key: key.test == 'TestNoError' and key.component == 'AuthState',
+    'fragment': None,
+}
+
+
+def write_characters(directory, count=20):
+    for i in range(count):
+        with open(os.path.join(directory, "probe%02d.ini" % i), 'w', encoding='utf-8') as fd:
+            fd.write("V3.0 character\nName=Probe%02d\nPassword=secret%02d\n" % (i, i))
+
+
+def run_monitor(settings, args=()):
+    """Child process body: configure monitor.py and run it (with args) until interrupted"""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+    import monitor
+    for (name, value) in settings.items():
+        setattr(monitor, name, value)
+    try:
+        monitor.main(['monitor.py'] + list(args))
+    except KeyboardInterrupt:
+        pass
+
+
+def detect(faults, events, ts_started):
+    """
+    Match the raised alert events against the faults; returns
+    ([(fault, secs to detect or None, the detecting event or None), ...], false alarm events)
+    """
+    detections = []
+    for fault in faults:
+        (ts_from, predicate) = (ts_started + fault.start, DETECTED_BY[fault.kind])
+        match = None
+        if predicate is not None:
+            for event in events:
+                if event.ts >= ts_from and event.key is not None and predicate(fault, event.key):
+                    match = event
+                    break
+        detections.append((fault, None if match is None else match.ts - ts_from, match))
+
+    false_alarms = [event for event in events
+                    if not any(ts_started + fault.start <= event.ts <= ts_started + fault.end + GRACE_SECS
+                               for fault in faults)]
+    return (detections, false_alarms)
+
+
+def run(script=DEFAULT_SCRIPT, scale=1.0, settings=None, heimdall_ids=range(1, 7)):
+    faults = parse_script(script)
+    for fault in faults:
+        (fault.start, fault.duration) = (fault.start * scale, fault.duration * scale)
+    duration = max(fault.end for fault in faults) + GRACE_SECS
+
+    workdir = tempfile.mkdtemp(prefix='heimon-faults-')
+    creds_path = os.path.join(workdir, 'ini')
+    os.mkdir(creds_path)
+    write_characters(creds_path)
+
+    (server, address, ts_started) = fakeserver.start_process(heimdall_ids=heimdall_ids, faults=faults)
+    monitor_settings = dict(MONITOR_SETTINGS, G_ADDRESS=address, G_CREDS_PATH=creds_path,
+                            G_HEIMDALL_IDS=list(heimdall_ids), G_EVENT_LOG_DIR=os.path.join(workdir, 'events'))
+    monitor_settings.update(settings or {})
+    monitor = multiprocessing.Process(target=run_monitor, args=(monitor_settings,), name="heimon-monitor")
+    monitor.start()
+    try:
+        sleep(max(0.0, ts_started + duration - time()))
+    finally:
+        os.kill(monitor.pid, signal.SIGINT)
+        monitor.join(15)
+        if monitor.is_alive():
+            monitor.terminate()
+        server.terminate()
+        server.join()
+
+    try:
+        reader = EventLogReader(monitor_settings['G_EVENT_LOG_DIR'])
+        events = list(reader.query(kinds=['raised', 'repeated']))
+        reader.close()
+    finally:
+        shutil.rmtree(workdir)
+    return detect(faults, events, ts_started)
+
+
+def parse_setting(text):
+    (name, value) = text.split('=', 1)
+    return (name.strip(), ast.literal_eval(value.strip()))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Measure how fast the monitor detects scripted faults")
+    parser.add_argument('--script', help="fault script file (default: the built-in script)")
+    parser.add_argument('--scale', type=float, default=1.0, help="stretch (>1) or compress (<1) the script")
+    parser.add_argument('--engine', help="probe engine (blocking, asyncio or selectors)")
+    parser.add_argument('--set', action='append', default=[], type=parse_setting,
+                        help="override a monitor.py setting, e.g., --set G_PROBE_CONCURRENCY=8")
+    parser.add_argument('-o', '--output', help="save the results to this JSON file")
+    args = parser.parse_args(argv[1:])
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, encoding='utf-8') as fd:
+            script = fd.read()
+    settings = dict(args.set)
+    if args.engine:
+        settings['G_PROBE_ENGINE'] = args.engine
+
+    (detections, false_alarms) = run(script, args.scale, settings)
+    results = {'faults': [], 'false_alarms': len(false_alarms)}
+    for (fault, secs, event) in detections:
+        if DETECTED_BY[fault.kind] is None:
+            outcome = "unnoticed (as it should be)" if secs is None else "noticed?!"
+        elif secs is None:
+            outcome = "MISSED"
+        else:
+            outcome = "detected in %6.2f secs by %s" % (secs, "/".join(str(k) for k in event.key if k is not None))
+        print("%-44s %s" % (fault, outcome))
+        results['faults'].append({'fault': repr(fault), 'detect_secs': secs})
+
+    print("False alarms: %d" % len(false_alarms))
+    for event in false_alarms[:10]:
+        print("  %s" % event.message)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fd:
+            json.dump(results, fd, indent=2)
+        print("Results saved to %s" % args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
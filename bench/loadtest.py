@@ -0,0 +1,197 @@
+# Load Test - Project Heimon
+#
+# Opens many concurrent logged-in sessions - the very same HeimdallTest states
+# the monitor uses (WhichSession, re-issuing `which every so often) - at a
+# given ramp rate, holds them for a while and then logs them out. Reports the
+# sustained login rate, connection/auth failure rates, per-phase latency
+# percentiles and what it all cost the client (CPU time per login, peak
+# memory), so the monitor's own footprint can be sized and the point where
+# the probe code becomes the bottleneck found.
+#
+# Runs against a fake server in a child process unless --address is given
+# (see bench/fakeserver.py), so the figures are the client's alone.
+#
+# Usage: python -m bench.loadtest [-n sessions] [-r logins/sec] [--hold secs]
+#                                 [--which-interval secs] [--address host:port]
+
+import os
+import sys
+import asyncio
+import argparse
+import resource
+
+from contextlib import redirect_stdout
+from time import perf_counter, process_time
+from heimon.aio import WhichSession
+from heimon.latency import LatencyHistogram, phase_latencies
+from bench import fakeserver
+
+# login phases (see heimon.latency.PHASES) plus `which round-trips while held
+PHASES = ('connect', 'dragonroar', 'auth', 'which')
+PERCENTILES = (50, 95, 99)
+
+
+class LoadSession(WhichSession):
+    """WhichSession letting the load test know once it is logged in"""
+    def __init__(self, load_test, addr, creds, interval, stall_secs):
+        WhichSession.__init__(self, addr, creds, load_test.on_sample, load_test.on_stall, interval, stall_secs)
+        self.load_test = load_test
+        self.is_logged_in = False
+        self.is_logging_out = False
+
+    def make_which_state(self):
+        self.is_logged_in = True
+        self.load_test.on_login(self)
+        return WhichSession.make_which_state(self)
+
+
+class LoadTest(object):
+    """
+    Launches `num_sessions` LoadSessions at `ramp` logins/sec (0: all at
+    once), holds each one for `hold` secs and logs it out
+    """
+    def __init__(self, addr, num_sessions, ramp=100.0, hold=10.0, which_interval=2.0, stall_secs=5.0):
+        self.addr = addr
+        self.num_sessions = num_sessions
+        self.ramp = ramp
+        self.hold = hold
+        self.which_interval = which_interval
+        self.stall_secs = stall_secs
+        self.histograms = dict((phase, LatencyHistogram()) for phase in PHASES)
+        self.num_logins = 0
+        self.num_connect_failures = 0
+        self.num_auth_failures = 0
+        self.num_dropped = 0      # logged in, but disconnected before being logged out
+        self.num_stalls = 0
+        self.num_active = 0
+        self.peak_active = 0
+        self.ts_start = None
+        self.ts_last_login = None
+
+    def on_login(self, session):
+        self.num_logins += 1
+        self.num_active += 1
+        self.peak_active = max(self.peak_active, self.num_active)
+        self.ts_last_login = perf_counter()
+
+    def on_sample(self, session, delay):
+        self.histograms['which'].observe(delay)
+
+    def on_stall(self, session, elapsed, num_lines):
+        self.num_stalls += 1
+
+    async def run(self):
+        self.ts_start = perf_counter()
+        sessions = []
+        for i in range(self.num_sessions):
+            if self.ramp > 0:
+                await asyncio.sleep(max(0.0, self.ts_start + i / self.ramp - perf_counter()))
+            sessions.append(asyncio.ensure_future(self.__session(i)))
+        await asyncio.gather(*sessions)
+
+    async def __session(self, i):
+        session = LoadSession(self, self.addr, {'name': "Load%d" % i, 'password': "load"},
+                              self.which_interval, self.stall_secs)
+        probe = asyncio.ensure_future(session.run())
+        await asyncio.wait([probe], timeout=self.hold)
+        if not probe.done():
+            session.is_logging_out = True
+            if session.is_connected():
+                session.shutdown()
+            try:
+                await asyncio.wait_for(asyncio.shield(probe), session.IO_TIMEOUT_SECS)
+            except asyncio.TimeoutError:
+                session.close()
+                await probe
+        result = probe.result()
+
+        if session.is_logged_in:
+            self.num_active -= 1
+            if not session.is_logging_out:
+                self.num_dropped += 1
+        elif 'connect' not in result.timing:
+            self.num_connect_failures += 1
+        else:
+            self.num_auth_failures += 1
+
+        for (phase, secs) in phase_latencies(result.timing).items():
+            if phase in self.histograms and phase != 'which':
+                self.histograms[phase].observe(secs)
+
+    def report(self, elapsed, cpu_secs):
+        login_secs = (self.ts_last_login - self.ts_start) if self.ts_last_login else 0.0
+        stats = {
+            'sessions': self.num_sessions,
+            'peak_sessions': self.peak_active,
+            'logins': self.num_logins,
+            'logins_per_sec': self.num_logins / login_secs if login_secs > 0 else 0.0,
+            'connect_failure_pct': 100.0 * self.num_connect_failures / self.num_sessions,
+            'auth_failure_pct': 100.0 * self.num_auth_failures / self.num_sessions,
+            'dropped_pct': 100.0 * self.num_dropped / self.num_sessions,
+            'which_stalls': self.num_stalls,
+            'which_samples': self.histograms['which'].count,
+            'cpu_msecs_per_login': 1000.0 * cpu_secs / self.num_logins if self.num_logins else 0.0,
+            'cpu_utilization_pct': 100.0 * cpu_secs / elapsed,
+            'peak_rss_mbytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        }
+        for phase in PHASES:
+            for pct in PERCENTILES:
+                value = self.histograms[phase].percentile(pct)
+                stats['%s_p%d_msecs' % (phase, pct)] = 1000.0 * value if value is not None else 0.0
+        return stats
+
+
+def raise_fd_limit(num_sessions):
+    """Allow enough open sockets for every session (as far as the hard limit goes)"""
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = num_sessions + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard),
+                                                    hard))
+
+
+def run(num_sessions=200, ramp=0.0, hold=1.0, which_interval=0.5, address=None):
+    raise_fd_limit(num_sessions)
+    process = None
+    if address is None:
+        (process, address, ts_started) = fakeserver.start_process()
+
+    load_test = LoadTest(address, num_sessions, ramp, hold, which_interval)
+    try:
+        ts_start = perf_counter()
+        cpu_start = process_time()
+        with open(os.devnull, 'w') as devnull:
+            with redirect_stdout(devnull):
+                asyncio.run(load_test.run())
+        elapsed = perf_counter() - ts_start
+        cpu_secs = process_time() - cpu_start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+
+    return load_test.report(elapsed, cpu_secs)
+
+
+def parse_address(text):
+    (host, port) = text.rsplit(':', 1)
+    return (host, int(port))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load test the Heimon probe code")
+    parser.add_argument('-n', '--sessions', type=int, default=1000, help="sessions to open")
+    parser.add_argument('-r', '--ramp', type=float, default=200.0, help="logins/sec while ramping up (0: all at once)")
+    parser.add_argument('--hold', type=float, default=10.0, help="secs to keep each session logged in")
+    parser.add_argument('--which-interval', type=float, default=2.0, help="secs between `which on each session")
+    parser.add_argument('--address', type=parse_address, help="server to load (default: a local fake server)")
+    args = parser.parse_args(argv[1:])
+
+    stats = run(args.sessions, args.ramp, args.hold, args.which_interval, args.address)
+    for (key, value) in stats.items():
+        print("%-36s %12.1f" % (key, value))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
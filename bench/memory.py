@@ -0,0 +1,87 @@
+# Result Memory Benchmark - Project Heimon
+#
+# Measures how much memory each retained heimdall check result costs: the
+# slotted ProbeResult records against the nested dicts results used to be.
+#
+# Usage: python -m bench.memory [num_results]
+
+import sys
+import tracemalloc
+
+from heimon.results import *
+
+
+def legacy_result(i):
+    """A complete result laid out the way HeimdallTest used to build it"""
+    return {
+        'usercount': {'current': 1200 + i, 'max': 3000},
+        'which': {
+            'delay': 0.25 + i * 1e-6,
+            'heimdall': {
+                'type': 'heimdall', 'id': i % 7, 'port': 4001, 'qtemp': 3, 'num_players': 1000 + i,
+                'my': {'player_index': i, 'global_id': 100000 + i, 'tribble_id': 9},
+            },
+            'horton': {
+                'type': 'horton', 'address': ('10.0.0.1', 7000), 'qtemp': 2, 'version': 'v42',
+                'num_players': 3000 + i,
+                'my': {'player_index': i, 'global_id': 100000 + i},
+            },
+            'tribble': {
+                'type': 'tribble', 'id': 9, 'qtemp': 1, 'version': 't7', 'map': 'Lazy', 'num_players': 40 + i,
+                'my': {'player_index': i, 'global_id': 100000 + i, 'coords': (10 + i, 20)},
+            },
+        },
+        'is_error': False,
+        'error_msg': "(no error)",
+        'error_state': None,
+        'timing': dict((event, 0.01 * n + i * 1e-6) for (n, event) in enumerate(TIMING_EVENTS)),
+    }
+
+
+def compact_result(i):
+    """The same result as a ProbeResult"""
+    result = ProbeResult('Bench')
+    result.usercount = 1200 + i
+    result.usercount_max = 3000
+    result.which_delay = 0.25 + i * 1e-6
+    result.heimdall = HeimdallInfo(4001, i % 7, 3, 1000 + i, i, 100000 + i, 9)
+    result.horton = HortonInfo('10.0.0.1', 7000, 2, 3000 + i, i, 100000 + i, 'v42')
+    result.tribble = TribbleInfo(9, 1, 40 + i, i, 100000 + i, 10 + i, 20, 'Lazy', 't7')
+    for (n, event) in enumerate(TIMING_EVENTS):
+        result.timing[event] = 0.01 * n + i * 1e-6
+    return result
+
+
+def bytes_per_result(build_func, num_results):
+    """Average memory allocated per result while num_results of them are kept alive"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [build_func(i) for i in range(num_results)]
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # the list holding them is not part of the results
+    allocated -= sys.getsizeof(results)
+    return allocated / len(results)
+
+
+def run(num_results=10000):
+    legacy = bytes_per_result(legacy_result, num_results)
+    compact = bytes_per_result(compact_result, num_results)
+    return {
+        'num_results': num_results,
+        'legacy_bytes_per_result': legacy,
+        'bytes_per_result': compact,
+        'reduction_pct': (1.0 - compact / legacy) * 100.0,
+    }
+
+
+def main(argv):
+    num_results = int(argv[1]) if len(argv) > 1 else 10000
+    for (key, value) in run(num_results).items():
+        print("%-36s %12.1f" % (key, value))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,32 @@
+# In-Memory Socket - Project Heimon
+#
+# A stand-in for a connected socket that serves a prepared server stream in
+# fixed-size segments, so HeimdallTest can be benchmarked without a network.
+
+
+class MemorySocket(object):
+    """Socket look-alike that plays back `stream` in `segment_size` chunks"""
+    def __init__(self, stream, segment_size=1460):
+        self.__stream = memoryview(stream)
+        self.__segment_size = segment_size
+        self.__pos = 0
+        self.sent = []
+
+    def settimeout(self, timeout):
+        pass
+
+    def connect(self, addr):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def recv_into(self, buffer):
+        num_bytes = min(len(buffer), self.__segment_size, len(self.__stream) - self.__pos)
+        buffer[:num_bytes] = self.__stream[self.__pos:self.__pos + num_bytes]
+        self.__pos += num_bytes
+        return num_bytes
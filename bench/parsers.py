@@ -0,0 +1,77 @@
+# Parser Benchmark - Project Heimon
+#
+# Compares WhichStringParser throughput (lines/sec) against the original
+# per-line implementation on a realistic mixed-traffic corpus.
+#
+# Usage: python -m bench.parsers [num_lines]
+
+import sys
+
+from time import perf_counter
+from heimon.parsers import *
+from bench.corpus import mixed_traffic
+
+
+def legacy_parse(line, callback=lambda data: None):
+    """WhichStringParser.parse as it originally was (kept for comparison)"""
+    handlers = {
+        RE_HEIMDALL: WhichStringParser.parse_heimdall,
+        RE_HORTON: WhichStringParser.parse_horton,
+        RE_TRIBBLE: WhichStringParser.parse_tribble,
+    }
+
+    for expression in handlers.keys():
+        parse_func = handlers[expression]
+        if WhichStringParser.try_handle(line, expression, lambda data: callback(parse_func(data))):
+            return True
+    return False
+
+
+def collect(parse_func, lines):
+    results = []
+    for line in lines:
+        parse_func(line, results.append)
+    return results
+
+
+def measure(func, lines, repeat=5):
+    """Return the best lines/sec figure out of `repeat` runs"""
+    best = None
+    for i in range(repeat):
+        ts_start = perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = perf_counter() - ts_start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def run(num_lines=20000):
+    lines = mixed_traffic(num_lines)
+
+    # both implementations must agree before comparing their speed
+    expected = collect(legacy_parse, lines)
+    if collect(WhichStringParser.parse, lines) != expected:
+        raise AssertionError("WhichStringParser.parse disagrees with the legacy parser!")
+
+    return {
+        'num_lines': len(lines),
+        'num_which_lines': len(expected),
+        'legacy_lines_per_sec': measure(legacy_parse, lines),
+        'parse_lines_per_sec': measure(WhichStringParser.parse, lines),
+        'classify_lines_per_sec': measure(WhichStringParser.classify, lines),
+    }
+
+
+def main(argv):
+    num_lines = int(argv[1]) if len(argv) > 1 else 20000
+    stats = run(num_lines)
+    print("corpus: %d lines (%d `which lines)" % (stats['num_lines'], stats['num_which_lines']))
+    for key in ['legacy_lines_per_sec', 'parse_lines_per_sec', 'classify_lines_per_sec']:
+        speedup = stats[key] / stats['legacy_lines_per_sec']
+        print("%-24s %12.0f lines/sec  (x%.1f)" % (key, stats[key], speedup))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
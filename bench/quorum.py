@@ -0,0 +1,147 @@
+# Quorum Benchmark - Project Heimon
+#
+# Runs several monitor nodes and an aggregator (see heimon/aggregation.py) as
+# local processes, each node probing its own fake server - its own "network
+# path". Faults on a single node's path should never reach the aggregator's
+# alerts, while faults every node sees (i.e., the server's own) should; reports
+# the latter's time-to-detect, anything the aggregator raised besides them and
+# how many alerts the nodes raised on their own.
+#
+# Usage: python -m bench.quorum [-n nodes] [-q quorum] [--scale X] [--set G_NAME=value ...]
+
+import os
+import sys
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import multiprocessing
+
+from time import sleep, time
+from bench import fakeserver
+from bench.fakeserver import parse_script
+from bench.faults import MONITOR_SETTINGS, GRACE_SECS, write_characters, run_monitor, detect, parse_setting
+from heimon.eventlog import EventLogReader
+
+# start duration kind heimdall [param] (see bench.fakeserver.Fault)
+# on every node's path (the server itself) - the aggregator should alert
+SHARED_SCRIPT = """
+30  6  desync  3
+42  8  silent  6
+"""
+
+# on a single node's path each (round-robin) - the aggregator should stay quiet
+LOCAL_SCRIPTS = (
+    "10  8  silent  5",
+    "10  8  lag     4  0.5",
+    "10  8  desync  2",
+)
+
+HEIMDALL_IDS = range(1, 7)
+
+
+def free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def scale_faults(faults, scale):
+    for fault in faults:
+        (fault.start, fault.duration) = (fault.start * scale, fault.duration * scale)
+    return faults
+
+
+def read_raised(directory):
+    if not os.path.isdir(directory):
+        return []
+    reader = EventLogReader(directory)
+    events = list(reader.query(kinds=['raised', 'repeated']))
+    reader.close()
+    return events
+
+
+def run(num_nodes=3, quorum=2, scale=1.0, settings=None):
+    shared_faults = scale_faults(parse_script(SHARED_SCRIPT), scale)
+    duration = max(fault.end for fault in shared_faults) + GRACE_SECS
+
+    workdir = tempfile.mkdtemp(prefix='heimon-quorum-')
+    creds_path = os.path.join(workdir, 'ini')
+    os.mkdir(creds_path)
+    write_characters(creds_path)
+    aggregator_address = ('127.0.0.1', free_udp_port())
+
+    (servers, monitors) = ([], [])
+    try:
+        for i in range(num_nodes):
+            faults = parse_script(SHARED_SCRIPT + LOCAL_SCRIPTS[i % len(LOCAL_SCRIPTS)])
+            servers.append(fakeserver.start_process(heimdall_ids=HEIMDALL_IDS, faults=scale_faults(faults, scale)))
+        ts_started = min(ts for (server, address, ts) in servers)
+
+        aggregator_settings = dict(MONITOR_SETTINGS, G_HEIMDALL_IDS=list(HEIMDALL_IDS),
+                                   G_AGGREGATOR_ADDRESS=aggregator_address, G_AGGREGATOR_QUORUM=quorum,
+                                   G_NODE_TIMEOUT_SECS=5.0, G_EVENT_LOG_DIR=os.path.join(workdir, 'aggregator'))
+        aggregator_settings.update(settings or {})
+        monitors.append(multiprocessing.Process(target=run_monitor, args=(aggregator_settings, ['--aggregator']),
+                                                name="heimon-aggregator"))
+        for (i, (server, address, ts)) in enumerate(servers):
+            node_settings = dict(MONITOR_SETTINGS, G_ADDRESS=address, G_CREDS_PATH=creds_path,
+                                 G_HEIMDALL_IDS=list(HEIMDALL_IDS), G_EVENT_LOG_DIR=os.path.join(workdir, 'node%d' % i),
+                                 G_AGGREGATOR_ADDRESS=aggregator_address, G_NODE_NAME="node%d" % i,
+                                 G_NODE_HEARTBEAT_SECS=1.0)
+            node_settings.update(settings or {})
+            monitors.append(multiprocessing.Process(target=run_monitor, args=(node_settings,), name="heimon-node%d" % i))
+
+        for monitor in monitors:
+            monitor.start()
+        sleep(max(0.0, ts_started + duration - time()))
+    finally:
+        for monitor in monitors:
+            if monitor.pid is not None:
+                os.kill(monitor.pid, signal.SIGINT)
+        for monitor in monitors:
+            monitor.join(15)
+            if monitor.is_alive():
+                monitor.terminate()
+        for (server, address, ts) in servers:
+            server.terminate()
+            server.join()
+
+    try:
+        events = read_raised(os.path.join(workdir, 'aggregator'))
+        node_alerts = [len(read_raised(os.path.join(workdir, 'node%d' % i))) for i in range(num_nodes)]
+    finally:
+        shutil.rmtree(workdir)
+    return detect(shared_faults, events, ts_started) + (node_alerts,)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Check that only faults a quorum of nodes sees get alerted")
+    parser.add_argument('-n', '--nodes', type=int, default=3, help="monitor nodes to run")
+    parser.add_argument('-q', '--quorum', type=int, default=2, help="nodes that have to agree on an alert")
+    parser.add_argument('--scale', type=float, default=1.0, help="stretch (>1) or compress (<1) the scripts")
+    parser.add_argument('--set', action='append', default=[], type=parse_setting,
+                        help="override a monitor.py setting (nodes and aggregator alike)")
+    args = parser.parse_args(argv[1:])
+
+    (detections, false_alarms, node_alerts) = run(args.nodes, args.quorum, args.scale, dict(args.set))
+    for (fault, secs, event) in detections:
+        if secs is None:
+            outcome = "MISSED"
+        else:
+            outcome = "detected in %6.2f secs by %s" % (secs, "/".join(str(k) for k in event.key if k is not None))
+        print("%-44s %s" % (fault, outcome))
+
+    print("Alerts raised by the nodes on their own: %s" % ", ".join(
+        "node%d: %d" % (i, count) for (i, count) in enumerate(node_alerts)))
+    print("Other alerts raised by the aggregator: %d" % len(false_alarms))
+    for event in false_alarms[:10]:
+        print("  %s" % event.message)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
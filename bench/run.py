@@ -0,0 +1,97 @@
+# Benchmark Suite - Project Heimon
+#
+# Runs every benchmark, saves the results as JSON and (optionally) compares
+# them against a previously saved baseline, flagging regressions.
+#
+# Usage: python -m bench.run [-o results.json] [-b baseline.json] [-t 10]
+
+import sys
+import json
+import argparse
+import platform
+
+from time import asctime
+from bench import parsers, states, transcript, memory, baselines, eventlog, loadtest
+
+
+# all benchmarks in the suite: name -> run() function returning a dict
+BENCHMARKS = {
+    'parsers': parsers.run,
+    'states': states.run,
+    'transcript': transcript.run,
+    'memory': memory.run,
+    'baselines': baselines.run,
+    'eventlog': eventlog.run,
+    'loadtest': loadtest.run,
+}
+
+
+def run_all():
+    results = {
+        'time': asctime(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': {}
+    }
+    for (name, func) in BENCHMARKS.items():
+        print("Running %s..." % name)
+        results['benchmarks'][name] = func()
+    return results
+
+
+def compare(results, baseline, threshold_pct):
+    """
+    Compare all throughput figures (*_per_sec - higher is better) against the
+    baseline; returns a list of (name, old, new, change_pct) regressions.
+    """
+    regressions = []
+    for (bench_name, stats) in results['benchmarks'].items():
+        old_stats = baseline['benchmarks'].get(bench_name, {})
+        for (key, new) in sorted(stats.items()):
+            if not key.endswith('_per_sec') or key not in old_stats:
+                continue
+
+            old = old_stats[key]
+            change_pct = (new - old) / old * 100.0
+            name = "%s.%s" % (bench_name, key)
+            flag = ""
+            if change_pct < -threshold_pct:
+                regressions.append((name, old, new, change_pct))
+                flag = "  <-- REGRESSION"
+            print("%-52s %12.0f -> %12.0f (%+6.1f%%)%s" % (name, old, new, change_pct, flag))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run the Heimon benchmark suite")
+    parser.add_argument('-o', '--output', help="save results to this JSON file")
+    parser.add_argument('-b', '--baseline', help="compare against this JSON file")
+    parser.add_argument('-t', '--threshold', type=float, default=10.0,
+                        help="slowdown (in percent) considered a regression")
+    args = parser.parse_args(argv[1:])
+
+    results = run_all()
+    for (bench_name, stats) in results['benchmarks'].items():
+        for (key, value) in sorted(stats.items()):
+            print("%-52s %12.0f" % ("%s.%s" % (bench_name, key), value))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+        print("Results saved to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fd:
+            baseline = json.load(fd)
+
+        print("Comparing against %s (%s)..." % (args.baseline, baseline.get('time', '?')))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("%d REGRESSION(S) ABOVE %.1f%%" % (len(regressions), args.threshold))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
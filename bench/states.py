@@ -0,0 +1,94 @@
+# State Machine Benchmark - Project Heimon
+#
+# Measures the per-line cost of each State.process on ordinary server traffic
+# and the cost of handling a full `which response in WhichTestState.
+#
+# Usage: python -m bench.states
+
+import os
+import sys
+import random
+
+from contextlib import redirect_stdout
+from time import perf_counter
+from heimon.states import *
+from bench.corpus import noise_line, which_lines
+from bench.parsers import measure
+
+
+class StubTest(object):
+    """Absorbs everything a state reports back to its HeimdallTest"""
+    def send(self, data):
+        pass
+
+    def change_state(self, handler):
+        pass
+
+    def make_which_state(self):
+        return WhichTestState(self)
+
+    def handle_usercount(self, current, max_count):
+        pass
+
+    def handle_error(self, msg):
+        pass
+
+    def handle_which_result(self, result):
+        pass
+
+    def handle_which_delay(self, delay):
+        pass
+
+
+def noise_corpus(num_lines, seed=1):
+    rng = random.Random(seed)
+    return [noise_line(rng) for i in range(num_lines)]
+
+
+def measure_which_response(repeat=5, num_responses=2000):
+    """Return `which responses/sec processed by fresh WhichTestState instances"""
+    test = StubTest()
+    response = which_lines()
+    best = None
+    for i in range(repeat):
+        ts_start = perf_counter()
+        for j in range(num_responses):
+            state = WhichTestState(test)
+            state.enter()
+            for line in response:
+                state.process(line)
+        elapsed = perf_counter() - ts_start
+        best = elapsed if best is None else min(best, elapsed)
+    return num_responses / best
+
+
+def run(num_lines=20000):
+    test = StubTest()
+    lines = noise_corpus(num_lines)
+    creds = {'name': 'Bench Mark', 'password': 'secret'}
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        states = {
+            'DragonroarState': DragonroarState(test, creds),
+            'AuthState': AuthState(test, creds),
+            'WhichTestState': WhichTestState(test),
+            'ClosingState': ClosingState(test),
+        }
+
+        stats = {}
+        for (name, state) in states.items():
+            state.enter()
+            stats['%s_lines_per_sec' % name] = measure(state.process, lines)
+        stats['WhichTestState_responses_per_sec'] = measure_which_response()
+
+    return stats
+
+
+def main(argv):
+    for (key, value) in run().items():
+        print("%-36s %12.0f" % (key, value))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,68 @@
+# Transcript Benchmark - Project Heimon
+#
+# Runs complete login-to-close server transcripts through HeimdallTest over an
+# in-memory socket, i.e., framing + all states + parsing end to end.
+#
+# Usage: python -m bench.transcript
+
+import os
+import sys
+import random
+
+from contextlib import redirect_stdout
+from time import perf_counter
+from heimon import HeimdallTest
+from bench.corpus import noise_line, which_lines
+from bench.memsocket import MemorySocket
+
+
+def build_transcript(num_noise_lines=200, seed=1):
+    """Return everything a server would send during a single heimdall check"""
+    rng = random.Random(seed)
+    noise = lambda count: [noise_line(rng) for i in range(count)]
+    lines = [b'#212 1024'] + noise(10) + [b'Dragonroar'] \
+        + [b'&&&&&&&&&&&&&'] + noise(num_noise_lines // 2) \
+        + which_lines(heimdall_id=3) + noise(num_noise_lines // 2)
+    return b'\n'.join(lines) + b'\n'
+
+
+def run_transcript(transcript, segment_size):
+    heimtest = HeimdallTest(('127.0.0.1', 0), {'name': 'Bench', 'password': 'secret'},
+                            sock=MemorySocket(transcript, segment_size))
+    heimtest.connect()
+    while heimtest.is_connected():
+        heimtest.process_next()
+    return heimtest.result
+
+
+def run(num_transcripts=1000, segment_size=1460, repeat=5):
+    transcript = build_transcript()
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        result = run_transcript(transcript, segment_size)
+        if result.tribble is None or result.heimdall_id != 3:
+            raise AssertionError("transcript was not processed correctly: %s" % result)
+
+        best = None
+        for i in range(repeat):
+            ts_start = perf_counter()
+            for j in range(num_transcripts):
+                run_transcript(transcript, segment_size)
+            elapsed = perf_counter() - ts_start
+            best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        'transcript_bytes': len(transcript),
+        'transcripts_per_sec': num_transcripts / best,
+        'transcript_mbytes_per_sec': num_transcripts * len(transcript) / best / 1e6,
+    }
+
+
+def main(argv):
+    for (key, value) in run().items():
+        print("%-36s %12.2f" % (key, value))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
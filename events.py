@@ -0,0 +1,94 @@
+# Events Component - Project Heimon
+#
+# Queries the indexed alert event log (see G_EVENT_LOG_DIR in monitor.py) by
+# time range, heimdall, test and kind, e.g., what alerted for heimdall 4 last
+# Tuesday:
+#
+#   python events.py events --heimdall 4 --from "2016-04-05" --to "2016-04-06"
+#
+# Usage: python events.py <directory> [--from T] [--to T] [--heimdall ID]
+#                         [--test NAME] [--kind KIND] [--target NAME]
+#                         [--limit N] [--segments]
+#
+# Times are "YYYY-MM-DD[ HH:MM[:SS]]" (local time), UNIX timestamps or
+# relative to now ("-30m", "-6h", "-7d").
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import sys
+import argparse
+
+from time import time, mktime, strptime, strftime, localtime, perf_counter
+from heimon.eventlog import EventLogReader, EVENT_KINDS
+
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+RELATIVE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time(text):
+    """Parse a time given on the command line into a UNIX timestamp"""
+    text = text.strip()
+    if text[:1] == '-' and text[-1:] in RELATIVE_UNITS:
+        return time() - float(text[1:-1]) * RELATIVE_UNITS[text[-1]]
+
+    for fmt in TIME_FORMATS:
+        try:
+            return mktime(strptime(text, fmt))
+        except ValueError:
+            pass
+    return float(text)
+
+
+def format_event(event):
+    (test, heimdall, component) = event.key
+    where = test
+    if heimdall is not None:
+        where += " heimdall=%s" % heimdall
+    if component is not None:
+        where += " component=%s" % component
+
+    line = "%s  %-8s  %s  %s" % (strftime("%Y-%m-%d %H:%M:%S", localtime(event.ts)), event.kind, where,
+                                 event.message)
+    if event.fields:
+        line += "  " + " ".join("%s=%s" % item for item in sorted(event.fields.items()))
+    return line
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Query the Heimon alert event log")
+    parser.add_argument('directory', help="event log directory written by monitor.py")
+    parser.add_argument('--from', dest='ts_from', type=parse_time, help="only events at or after this time")
+    parser.add_argument('--to', dest='ts_to', type=parse_time, help="only events at or before this time")
+    parser.add_argument('--heimdall', help="only events about this heimdall")
+    parser.add_argument('--test', help="only events raised by this test (e.g., TestGlobalIdInSync)")
+    parser.add_argument('--kind', action='append', choices=EVENT_KINDS, help="only events of this kind")
+    parser.add_argument('--target', help="only events of this fleet target")
+    parser.add_argument('--limit', type=int, default=0, help="show at most N events")
+    parser.add_argument('--segments', action='store_true', help="list the segments instead")
+    args = parser.parse_args(argv[1:])
+
+    reader = EventLogReader(args.directory)
+    if args.segments:
+        for (filename, num_records, ts_min, ts_max) in reader.segments():
+            span = "-" if num_records == 0 else "%s - %s" % (
+                strftime("%Y-%m-%d %H:%M:%S", localtime(ts_min)), strftime("%Y-%m-%d %H:%M:%S", localtime(ts_max)))
+            print("%s  %8d events  %s" % (filename, num_records, span))
+        return 0
+
+    ts_start = perf_counter()
+    num_shown = 0
+    for event in reader.query(args.ts_from, args.ts_to, args.heimdall, args.test, args.kind):
+        if args.target is not None and event.fields.get('target') != args.target:
+            continue
+        print(format_event(event))
+        num_shown += 1
+        if num_shown == args.limit:
+            break
+
+    sys.stderr.write("%d event(s) in %.1f msecs\n" % (num_shown, (perf_counter() - ts_start) * 1000))
+    reader.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
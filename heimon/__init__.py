@@ -1,3 +1,3 @@
 from heimon.core import HeimdallTest
 
-__all__ = ["parsers", "states", "core.py"]
\ No newline at end of file
+__all__ = ["parsers", "states", "core.py", "aio", "mux", "capture", "timeseries", "metrics", "latency", "alerts", "tracker", "scheduler", "fleet", "creds", "results", "baselines", "profiling", "eventlog", "aggregation"]
\ No newline at end of file
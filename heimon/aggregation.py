@@ -0,0 +1,301 @@
+# Aggregation Component - Project Heimon
+#
+# Lets several monitors (nodes) - each probing the server over its own network
+# path - report to a single aggregator, so that a hiccup on one node's link
+# does not page anyone. Nodes stream compact probe results and their alert
+# events (raised/resolved, see AlertEngine) over UDP, along with a heartbeat
+# listing their open incidents every few secs (which also repairs anything
+# lost on the way). The aggregator keeps a merged tracker of when any node
+# last saw each heimdall and raises every other alert condition only once a
+# quorum of the live nodes has it open.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import os
+import json
+import socket
+import struct
+
+from collections import namedtuple
+from time import monotonic, time
+from heimon.alerts import AlertKey
+from heimon.eventlog import EVENT_KINDS
+
+# message types
+RESULT = 1
+EVENT = 2
+HEARTBEAT = 3
+
+# type, timestamp (sender's clock) and node name length - then the name and the body
+MESSAGE_HEADER = struct.Struct('<BdB')
+
+# heimdall ID (-1: none), `which delay (-1: none), user count (-1: none), error flag
+RESULT_BODY = struct.Struct('<ifi?')
+
+# tests the aggregator judges on its merged tracker rather than by vote
+MERGED_TESTS = ('TestNoHeimdallsAreMissing', 'TestNoLongerMissingHeimdalls')
+
+# alert conditions about the nodes themselves
+AGGREGATOR_TEST = 'Aggregator'
+
+# body: (heimdall ID, which delay, user count, is error) for RESULT,
+# (kind, key, message) for EVENT and {key: message} for HEARTBEAT
+Message = namedtuple('Message', ['type', 'ts', 'node', 'body'])
+
+
+def default_node_name():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+def encode_message(type, node, body, ts=None):
+    name = node.encode('utf-8')[:255]
+    return MESSAGE_HEADER.pack(type, time() if ts is None else ts, len(name)) + name + body
+
+
+def encode_result(node, result, ts=None):
+    return encode_message(RESULT, node, RESULT_BODY.pack(
+        -1 if result.heimdall is None else result.heimdall.id,
+        result.which_delay,
+        -1 if result.usercount is None else result.usercount,
+        result.is_error), ts)
+
+
+def encode_event(node, kind, key, message, ts=None):
+    body = json.dumps([kind, key.test, key.heimdall, key.component, message], separators=(',', ':'))
+    return encode_message(EVENT, node, body.encode('utf-8'), ts)
+
+
+def encode_heartbeat(node, incidents, ts=None):
+    """incidents: the node's open alert incidents (see AlertEngine.incidents)"""
+    body = json.dumps([list(incident.key) + [incident.message] for incident in incidents], separators=(',', ':'))
+    return encode_message(HEARTBEAT, node, body.encode('utf-8'), ts)
+
+
+def decode_key(test, heimdall, component, message):
+    """Build the AlertKey of a decoded event/incident (ValueError if any part is off)"""
+    if not isinstance(test, str) or not isinstance(message, str):
+        raise ValueError("bad test/message: %r/%r" % (test, message))
+    if heimdall is not None and (not isinstance(heimdall, int) or isinstance(heimdall, bool)):
+        raise ValueError("bad heimdall: %r" % (heimdall,))
+    if component is not None and not isinstance(component, (str, int)):
+        raise ValueError("bad component: %r" % (component,))
+    return AlertKey(test, heimdall, component)
+
+
+def decode_message(data):
+    """Decode a datagram into a Message (ValueError/TypeError/struct.error if malformed)"""
+    (type, ts, name_length) = MESSAGE_HEADER.unpack_from(data)
+    start = MESSAGE_HEADER.size + name_length
+    node = data[MESSAGE_HEADER.size:start].decode('utf-8')
+    if type == RESULT:
+        (heimdall_id, which_delay, usercount, is_error) = RESULT_BODY.unpack_from(data, start)
+        body = (None if heimdall_id < 0 else heimdall_id, which_delay, None if usercount < 0 else usercount,
+                is_error)
+    elif type == EVENT:
+        (kind, test, heimdall, component, message) = json.loads(data[start:].decode('utf-8'))
+        if kind not in EVENT_KINDS:
+            raise ValueError("unknown event kind: %r" % (kind,))
+        body = (kind, decode_key(test, heimdall, component, message), message)
+    elif type == HEARTBEAT:
+        body = dict((decode_key(test, heimdall, component, message), message)
+                    for (test, heimdall, component, message) in json.loads(data[start:].decode('utf-8')))
+    else:
+        raise ValueError("unknown message type: %d" % type)
+    return Message(type, ts, node, body)
+
+
+class NodeReporter(object):
+    """
+    Sends a node's results, alert events and heartbeats to the aggregator -
+    fire and forget, so a missing aggregator never holds up the probes
+    """
+    def __init__(self, address, node, heartbeat_secs=5.0):
+        self.address = tuple(address)
+        self.node = node
+        self.heartbeat_secs = heartbeat_secs
+        self.num_sent = 0
+        self.num_send_errors = 0
+        self.__ts_last_heartbeat = None
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send_result(self, result):
+        self.__send(encode_result(self.node, result))
+
+    def send_event(self, kind, key, message, ts=None):
+        self.__send(encode_event(self.node, kind, key, message, ts))
+
+    def heartbeat(self, incidents, force=False):
+        """Send the open incidents if a heartbeat is due (or forced)"""
+        ts = monotonic()
+        if force or self.__ts_last_heartbeat is None or ts - self.__ts_last_heartbeat >= self.heartbeat_secs:
+            self.__ts_last_heartbeat = ts
+            self.__send(encode_heartbeat(self.node, incidents))
+
+    def close(self):
+        self.__sock.close()
+
+    def __send(self, data):
+        try:
+            self.__sock.sendto(data, self.address)
+            self.num_sent += 1
+        except OSError:
+            self.num_send_errors += 1
+
+
+class NodeState(object):
+    """What the aggregator knows about a node"""
+    __slots__ = ('name', 'ts_last_heard', 'ts_last_state', 'is_live', 'num_results', 'num_errors', 'incidents')
+
+    def __init__(self, name, ts):
+        self.name = name
+        self.ts_last_heard = ts    # aggregator's clock
+        self.ts_last_state = 0.0   # node's clock, of the latest event/heartbeat applied
+        self.is_live = True
+        self.num_results = 0
+        self.num_errors = 0
+        self.incidents = {}        # AlertKey -> message
+
+
+class Aggregator(object):
+    """
+    Merges what the nodes report: results update a shared HeimdallTracklist (a
+    heimdall goes missing only when no node has seen it) and every other alert
+    condition is raised through alert_engine once at least `quorum` live nodes
+    have it open - and resolved once fewer do. A node not heard from for
+    `node_timeout` secs stops counting (and is alerted about).
+    """
+    def __init__(self, tracker, alert_engine, quorum=2, node_timeout=30.0, log_func=None):
+        self.tracker = tracker
+        self.alert_engine = alert_engine
+        self.quorum = quorum
+        self.node_timeout = node_timeout
+        self.num_malformed = 0
+        self.__log_func = log_func
+        self.__nodes = {}
+        self.__ts_started = time()
+        self.__running = False
+
+    def nodes(self):
+        return list(self.__nodes.values())
+
+    def live_nodes(self):
+        return [node for node in self.__nodes.values() if node.is_live]
+
+    def votes(self, key):
+        """Names of the live nodes having an alert condition open"""
+        return sorted(node.name for node in self.__nodes.values() if node.is_live and key in node.incidents)
+
+    def handle(self, message, ts=None):
+        ts = time() if ts is None else ts
+        node = self.__nodes.get(message.node)
+        if node is None:
+            node = self.__nodes[message.node] = NodeState(message.node, ts)
+            self.__log("Node %s joined (%d node(s) reporting)" % (node.name, len(self.live_nodes())))
+        elif not node.is_live:
+            node.is_live = True
+            self.alert_engine.resolve(AlertKey(AGGREGATOR_TEST, None, node.name), ts)
+        node.ts_last_heard = ts
+
+        if message.type == RESULT:
+            (heimdall_id, which_delay, usercount, is_error) = message.body
+            node.num_results += 1
+            node.num_errors += is_error
+            if heimdall_id is not None:
+                self.tracker.update_heimdall(heimdall_id, ts)
+                self.alert_engine.resolve(AlertKey(MERGED_TESTS[0], heimdall_id, None), ts)
+            return
+
+        # UDP may reorder: never let an older state override a newer one
+        if message.ts < node.ts_last_state:
+            return
+        node.ts_last_state = message.ts
+
+        if message.type == EVENT:
+            (kind, key, text) = message.body
+            if kind == 'resolved':
+                node.incidents.pop(key, None)
+            else:
+                node.incidents[key] = text
+            changed = [key]
+        else:
+            changed = set(node.incidents) | set(message.body)
+            node.incidents = dict(message.body)
+
+        for key in changed:
+            self.__evaluate(key, ts)
+
+    def check(self, ts=None):
+        """Count out the nodes gone quiet and look for heimdalls no node has seen"""
+        ts = time() if ts is None else ts
+        for node in self.__nodes.values():
+            if node.is_live and ts - node.ts_last_heard >= self.node_timeout:
+                node.is_live = False
+                self.alert_engine.alert(AlertKey(AGGREGATOR_TEST, None, node.name),
+                                        "Node %s has not reported for %.0f secs" % (
+                                            node.name, ts - node.ts_last_heard), ts)
+                for key in node.incidents:
+                    self.__evaluate(key, ts)
+
+        num_live = len(self.live_nodes())
+        quorum_key = AlertKey(AGGREGATOR_TEST, None, 'quorum')
+        if num_live < self.quorum and ts - self.__ts_started >= self.node_timeout:
+            self.alert_engine.alert(quorum_key, "Only %d node(s) reporting - no quorum of %d possible" % (
+                num_live, self.quorum), ts)
+        else:
+            self.alert_engine.resolve(quorum_key, ts)
+
+        if num_live == 0:
+            return  # nobody to have seen anything
+        self.tracker.update_last_check()
+        for h_data in self.tracker.find_missing(ts):
+            h_id = h_data['id']
+            data = (h_id, num_live, ts - max(h_data['ts_added'], h_data['ts_last_seen']))
+            self.alert_engine.alert(AlertKey(MERGED_TESTS[0], h_id, None),
+                                    "Heimdall %s has not been seen by any of %d node(s) for %.2f secs" % data, ts)
+
+    def stop(self):
+        self.__running = False
+
+    def run(self, address, check_interval=1.0):
+        """Receive node reports at address (UDP) until stopped"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(tuple(address))
+        sock.settimeout(check_interval)
+        ts_next_check = monotonic() + check_interval
+        self.__running = True
+        try:
+            while self.__running:
+                try:
+                    data = sock.recv(65535)
+                except socket.timeout:
+                    data = None
+
+                if data is not None:
+                    try:
+                        message = decode_message(data)
+                    except (ValueError, TypeError, struct.error):
+                        self.num_malformed += 1
+                    else:
+                        self.handle(message)
+
+                if monotonic() >= ts_next_check:
+                    self.check()
+                    ts_next_check = monotonic() + check_interval
+        finally:
+            sock.close()
+
+    def __evaluate(self, key, ts):
+        if key.test in MERGED_TESTS or key.test == AGGREGATOR_TEST:
+            return
+
+        voters = self.votes(key)
+        if len(voters) >= self.quorum:
+            message = self.__nodes[voters[0]].incidents[key]
+            self.alert_engine.alert(key, "%s [%d/%d nodes: %s]" % (
+                message, len(voters), len(self.live_nodes()), ", ".join(voters)), ts)
+        else:
+            self.alert_engine.resolve(key, ts)
+
+    def __log(self, message):
+        if self.__log_func:
+            self.__log_func(message)
@@ -0,0 +1,253 @@
+# Asyncio Component - Project Heimon
+#
+# Houses the asyncio counterpart of HeimdallTest along with a driver that keeps
+# several of them in flight at once, so that one stalled probe does not hold
+# up checking the rest of the heimdalls.
+#
+# WhichSession/SessionPool keep a few logged-in connections open and sample
+# the `which round-trip continuously over them, which is much cheaper than a
+# full login per sample and notices a lag spike within a second or so.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import asyncio
+
+from time import perf_counter
+from heimon.core import HeimdallTestBase
+from heimon.profiling import COUNTERS
+from heimon.states import WhichLoopState
+
+
+class AsyncHeimdallTest(HeimdallTestBase):
+    """asyncio-based heimdall check (same states as HeimdallTest)"""
+    def __init__(self, addr, creds):
+        HeimdallTestBase.__init__(self, addr, creds)
+        self.__reader = None
+        self.__writer = None
+
+    async def connect(self):
+        self.mark_connecting()
+        connection = asyncio.open_connection(self._addr[0], self._addr[1])
+        (self.__reader, self.__writer) = await asyncio.wait_for(connection, self.IO_TIMEOUT_SECS)
+        self.start()
+
+    def close(self):
+        """Close this connection (without sending `quit first)"""
+        if self.__writer:
+            self.__writer.close()
+            self.__writer = None
+            self.__reader = None
+
+        HeimdallTestBase.close(self)
+
+    async def process_next(self):
+        """Process more data from this test/connection"""
+        try:
+            buffer = await asyncio.wait_for(self.__reader.read(self.BUFFER_SIZE), self.idle_timeout())
+        except asyncio.TimeoutError:
+            buffer = None
+
+        # time what the monitor spends on it - not the wait for it
+        ts_start = perf_counter()
+        if buffer is None:
+            self.process_idle()
+        else:
+            self.process_data(buffer)
+        COUNTERS.add('HeimdallTest.process_next', perf_counter() - ts_start)
+
+    async def run(self):
+        """Connect, process everything until closed and return the result"""
+        try:
+            await asyncio.wait_for(self.__run(), self.PROBE_TIMEOUT_SECS)
+        except asyncio.TimeoutError:
+            self.handle_error("Probe timed out after %d secs" % self.PROBE_TIMEOUT_SECS)
+        except OSError as e:
+            self.handle_error("Connection failed: %s" % e)
+        return self.result
+
+    async def __run(self):
+        await self.connect()
+        while self.is_connected():
+            await self.process_next()
+
+    def send(self, data):
+        self.__writer.write(bytes(data, 'utf-8'))
+
+
+class ProbeDriver(object):
+    """
+    Keeps up to `concurrency` AsyncHeimdallTest probes in flight against the
+    given address. Each finished probe's result is handed to result_func and
+    the slot is refilled after `interval` seconds - or, if delay_func is
+    given, after however many seconds delay_func() says (e.g., a scheduler's
+    reserve()) right before each probe. While creds_func() has no character to
+    offer (returns None), the slot retries every CREDS_RETRY_SECS.
+
+    If concurrency_func is given, only the first concurrency_func() slots (of
+    `concurrency`) launch probes; the others check again every SLOT_CHECK_SECS.
+    """
+    CREDS_RETRY_SECS = 1.0
+    SLOT_CHECK_SECS = 1.0
+
+    def __init__(self, addr, creds_func, result_func, concurrency=1, interval=0.0, delay_func=None,
+                 concurrency_func=None):
+        self.__addr = addr
+        self.__creds_func = creds_func
+        self.__result_func = result_func
+        self.__concurrency = concurrency
+        self.__concurrency_func = concurrency_func
+        self.__interval = interval
+        self.__delay_func = delay_func
+        self.__num_started = 0
+        self.__max_probes = None
+        self.__running = False
+
+    def stop(self):
+        """Stop launching new probes (the ones in flight are allowed to finish)"""
+        self.__running = False
+
+    def num_started(self):
+        return self.__num_started
+
+    async def run(self, max_probes=None):
+        """Run probes until stopped (or until max_probes were started)"""
+        self.__running = True
+        self.__max_probes = max_probes
+        workers = [self.__worker(slot) for slot in range(self.__concurrency)]
+        await asyncio.gather(*workers)
+
+    def __should_continue(self):
+        if self.__max_probes is not None and self.__num_started >= self.__max_probes:
+            return False
+        return self.__running
+
+    async def __worker(self, slot):
+        while self.__should_continue():
+            if self.__concurrency_func and slot >= self.__concurrency_func():
+                await asyncio.sleep(self.SLOT_CHECK_SECS)
+                continue
+
+            if self.__delay_func:
+                await asyncio.sleep(self.__delay_func())
+                if not self.__should_continue():
+                    break
+
+            creds = self.__creds_func()
+            while creds is None and self.__should_continue():
+                await asyncio.sleep(self.CREDS_RETRY_SECS)
+                creds = self.__creds_func()
+            if creds is None:
+                break
+
+            self.__num_started += 1
+            probe = AsyncHeimdallTest(self.__addr, creds)
+            self.__result_func(await probe.run())
+
+            if self.__should_continue() and not self.__delay_func:
+                await asyncio.sleep(self.__interval)
+
+
+class WhichSession(AsyncHeimdallTest):
+    """
+    Persistent heimdall check: logs in once and then keeps re-issuing `which
+    every `interval` secs (see WhichLoopState) until the connection drops.
+    sample_func(session, delay) gets every completed round-trip (with
+    session.result holding its `which components) and
+    stall_func(session, elapsed, num_lines) every `which that stalled.
+    """
+    PROBE_TIMEOUT_SECS = None  # never gives up on its own
+
+    def __init__(self, addr, creds, sample_func, stall_func=None, interval=1.0, stall_secs=5.0):
+        AsyncHeimdallTest.__init__(self, addr, creds)
+        self.__sample_func = sample_func
+        self.__stall_func = stall_func
+        self.__interval = interval
+        self.__stall_secs = stall_secs
+        self.num_samples = 0
+        self.num_stalls = 0
+        self.heimdall_id = None  # the heimdall this session landed on (once known)
+
+    def make_which_state(self):
+        return WhichLoopState(self, self.__interval, self.__stall_secs)
+
+    def handle_which_result(self, component):
+        AsyncHeimdallTest.handle_which_result(self, component)
+        if component.type == 'heimdall':
+            self.heimdall_id = component.id
+
+    def handle_which_sample(self, delay):
+        AsyncHeimdallTest.handle_which_sample(self, delay)
+        self.num_samples += 1
+        self.__sample_func(self, delay)
+        self.result.clear_which()
+
+    def handle_which_stall(self, elapsed, num_lines):
+        self.num_stalls += 1
+        if self.__stall_func:
+            self.__stall_func(self, elapsed, num_lines)
+        self.result.clear_which()
+
+
+class SessionPool(object):
+    """
+    Keeps `size` WhichSessions logged in against the given address, replacing
+    each one that closes (after `reconnect_delay` secs, plus however many
+    delay_func() says right before each login, if given). done_func(result)
+    gets the final result of every session that ended.
+    """
+    CREDS_RETRY_SECS = 1.0
+
+    def __init__(self, addr, creds_func, sample_func, stall_func=None, done_func=None,
+                 size=1, interval=1.0, stall_secs=5.0, reconnect_delay=10.0, delay_func=None):
+        self.__addr = addr
+        self.__creds_func = creds_func
+        self.__sample_func = sample_func
+        self.__stall_func = stall_func
+        self.__done_func = done_func
+        self.__size = size
+        self.__interval = interval
+        self.__stall_secs = stall_secs
+        self.__reconnect_delay = reconnect_delay
+        self.__delay_func = delay_func
+        self.__sessions = set()
+        self.__running = False
+        self.num_started = 0
+
+    def sessions(self):
+        return list(self.__sessions)
+
+    def stop(self):
+        """Close all sessions and stop replacing them"""
+        self.__running = False
+        for session in list(self.__sessions):
+            session.close()
+
+    async def run(self):
+        self.__running = True
+        await asyncio.gather(*[self.__worker() for i in range(self.__size)])
+
+    async def __worker(self):
+        while self.__running:
+            if self.__delay_func:
+                await asyncio.sleep(self.__delay_func())
+                if not self.__running:
+                    break
+
+            creds = self.__creds_func()
+            if creds is None:
+                await asyncio.sleep(self.CREDS_RETRY_SECS)
+                continue
+
+            self.num_started += 1
+            session = WhichSession(self.__addr, creds, self.__sample_func, self.__stall_func,
+                                   self.__interval, self.__stall_secs)
+            self.__sessions.add(session)
+            try:
+                result = await session.run()
+            finally:
+                self.__sessions.discard(session)
+
+            if self.__done_func:
+                self.__done_func(result)
+            if self.__running:
+                await asyncio.sleep(self.__reconnect_delay)
@@ -0,0 +1,256 @@
+# Alerts Component - Project Heimon
+#
+# AlertEngine coalesces repeating alert conditions (identified by a structured
+# key) into incidents with first/last-seen times and a count, and announces
+# when they are resolved. Every announcement can also be recorded as a
+# structured event (see heimon.eventlog).
+#
+# AlertSink delivers alerts to their destinations (log file, STDERR, e-mail,
+# ...) from background threads, so that a burst of alerts or a slow destination
+# never holds up the probes. Each destination has its own bounded queue; when it
+# is full, alerts for that destination are dropped and counted instead.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import os
+import sys
+import threading
+
+from collections import namedtuple
+from queue import Queue, Empty, Full
+from time import monotonic, time, strftime, localtime
+
+
+# identifies an alert condition: which test raised it, on which heimdall and
+# (optionally) about which component/failure
+AlertKey = namedtuple('AlertKey', ['test', 'heimdall', 'component'])
+
+
+class Incident(object):
+    """An ongoing alert condition"""
+    __slots__ = ('key', 'message', 'ts_first_seen', 'ts_last_seen', 'ts_last_announced', 'count', 'count_unannounced')
+
+    def __init__(self, key, message, ts):
+        self.key = key
+        self.message = message
+        self.ts_first_seen = ts
+        self.ts_last_seen = ts
+        self.ts_last_announced = ts
+        self.count = 1
+        self.count_unannounced = 0
+
+
+def format_ts(ts):
+    return strftime("%H:%M:%S", localtime(ts))
+
+
+class AlertEngine(object):
+    """
+    Turns repeated alert conditions into incidents: the first occurrence of a
+    key is announced right away, further occurrences within `window` secs of
+    the last announcement are only counted (and summarized once the window is
+    over) and resolve() announces the end of the incident.
+
+    event_func(kind, key, message, ts, fields), if given, is called along with
+    every announcement ('raised', 'repeated' or 'resolved').
+    """
+    def __init__(self, alert_func, window=300, event_func=None):
+        self.__alert_func = alert_func
+        self.__window = window
+        self.__event_func = event_func
+        self.__incidents = {}
+
+    def incidents(self):
+        return list(self.__incidents.values())
+
+    def get(self, key):
+        return self.__incidents.get(key, None)
+
+    def alert(self, key, message, ts=None):
+        ts = time() if ts is None else ts
+        incident = self.__incidents.get(key)
+        if incident is None:
+            self.__incidents[key] = Incident(key, message, ts)
+            self.__alert_func(message)
+            if self.__event_func:
+                self.__event_func('raised', key, message, ts, {})
+            return
+
+        incident.count += 1
+        incident.count_unannounced += 1
+        incident.ts_last_seen = ts
+        incident.message = message
+        if ts - incident.ts_last_announced >= self.__window:
+            self.__alert_func("%s (x%d since %s, x%d in total)" % (
+                message, incident.count_unannounced, format_ts(incident.ts_last_announced), incident.count))
+            if self.__event_func:
+                self.__event_func('repeated', key, message, ts, {
+                    'count': incident.count, 'count_since_announced': incident.count_unannounced,
+                    'ts_first_seen': incident.ts_first_seen})
+            incident.ts_last_announced = ts
+            incident.count_unannounced = 0
+
+    def resolve(self, key, ts=None):
+        incident = self.__incidents.pop(key, None)
+        if incident is None:
+            return
+
+        ts = time() if ts is None else ts
+        self.__alert_func("RESOLVED: %s (x%d, %s - %s, lasted %.0f secs)" % (
+            incident.message, incident.count, format_ts(incident.ts_first_seen),
+            format_ts(incident.ts_last_seen), ts - incident.ts_first_seen))
+        if self.__event_func:
+            self.__event_func('resolved', key, incident.message, ts, {
+                'count': incident.count, 'ts_first_seen': incident.ts_first_seen,
+                'ts_last_seen': incident.ts_last_seen})
+
+    def resolve_matching(self, test, heimdall=None, ts=None):
+        """Resolve all incidents raised by a test (optionally only for one heimdall)"""
+        for key in list(self.__incidents.keys()):
+            if key.test == test and (heimdall is None or key.heimdall == heimdall):
+                self.resolve(key, ts)
+
+
+class Destination(object):
+    """Generic alert destination; write() always gets a batch (list) of alerts"""
+    def write(self, alerts):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileDestination(Destination):
+    """Appends alerts to a file kept open, fsync()ing it every fsync_interval secs"""
+    def __init__(self, filename, fsync_interval=5.0):
+        self.__fd = open(filename, 'a', encoding='utf-8')
+        self.__fsync_interval = fsync_interval
+        self.__ts_last_sync = monotonic()
+        self.__is_dirty = False
+
+    def write(self, alerts):
+        self.__fd.write("\n".join(alerts + ['']))
+        self.__is_dirty = True
+
+    def flush(self):
+        self.__fd.flush()
+        if self.__is_dirty and monotonic() - self.__ts_last_sync >= self.__fsync_interval:
+            os.fsync(self.__fd.fileno())
+            self.__ts_last_sync = monotonic()
+            self.__is_dirty = False
+
+    def close(self):
+        self.__fd.flush()
+        os.fsync(self.__fd.fileno())
+        self.__fd.close()
+
+
+class StreamDestination(Destination):
+    """Writes alerts to a stream (STDERR by default), optionally ringing a bell on STDOUT"""
+    def __init__(self, stream=None, bell=True):
+        self.__stream = stream or sys.stderr
+        self.__bell = bell
+
+    def write(self, alerts):
+        self.__stream.write("\n".join(alerts + ['']))
+        if self.__bell:
+            sys.stdout.write("\x07")
+
+    def flush(self):
+        self.__stream.flush()
+        if self.__bell:
+            sys.stdout.flush()
+
+
+class CallbackDestination(Destination):
+    """Hands every batch of alerts to func(alerts) (e.g., an e-mail sender)"""
+    def __init__(self, func):
+        self.__func = func
+
+    def write(self, alerts):
+        self.__func(alerts)
+
+
+class AlertWorker(object):
+    """Background thread draining a bounded queue into a single destination"""
+    STOP = object()
+
+    def __init__(self, destination, maxsize=1000, max_batch=100, flush_interval=1.0):
+        self.destination = destination
+        self.num_dropped = 0
+        self.num_written = 0
+        self.num_errors = 0
+        self.__queue = Queue(maxsize)
+        self.__max_batch = max_batch
+        self.__flush_interval = flush_interval
+        self.__stopping = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="alerts-%s" % destination.__class__.__name__,
+                                         daemon=True)
+        self.__thread.start()
+
+    def put(self, alert):
+        try:
+            self.__queue.put_nowait(alert)
+        except Full:
+            self.num_dropped += 1
+
+    def stop(self, timeout=None):
+        """Write everything still queued, close the destination and stop"""
+        # the flag alone does it once the queue runs dry; STOP just wakes the
+        # thread up early (if there is room for it in time)
+        self.__stopping.set()
+        ts_deadline = None if timeout is None else monotonic() + timeout
+        try:
+            self.__queue.put(self.STOP, timeout=timeout)
+        except Full:
+            pass
+        self.__thread.join(None if ts_deadline is None else max(0.0, ts_deadline - monotonic()))
+
+    def __run(self):
+        is_running = True
+        while is_running:
+            try:
+                batch = [self.__queue.get(timeout=self.__flush_interval)]
+            except Empty:
+                batch = []
+
+            while batch and len(batch) < self.__max_batch:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except Empty:
+                    break
+
+            if self.STOP in batch or (self.__stopping.is_set() and self.__queue.empty()):
+                is_running = False
+                batch = [alert for alert in batch if alert is not self.STOP]
+
+            try:
+                if batch:
+                    self.destination.write(batch)
+                    self.num_written += len(batch)
+                self.destination.flush()
+            except Exception as ex:
+                self.num_errors += 1
+                sys.stderr.write("%s/BUG: failed delivering %d alert(s) -> %s\n" % (self.__class__, len(batch), ex))
+
+        self.destination.close()
+
+
+class AlertSink(object):
+    """Fans alerts out to all of its destinations without ever blocking the caller"""
+    def __init__(self, destinations, maxsize=1000):
+        self.__workers = [AlertWorker(destination, maxsize) for destination in destinations]
+
+    def put(self, alert):
+        for worker in self.__workers:
+            worker.put(alert)
+
+    def num_dropped(self):
+        return sum(worker.num_dropped for worker in self.__workers)
+
+    def close(self, timeout=5.0):
+        for worker in self.__workers:
+            worker.stop(timeout)
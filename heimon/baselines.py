@@ -0,0 +1,244 @@
+# Baselines Component - Project Heimon
+#
+# Learns what "normal" looks like for every monitored figure (user count,
+# current/max user ratio, `which delay and each component's qtemp, per
+# heimdall where it applies) and flags results that deviate from it, instead
+# of comparing them against fixed thresholds.
+#
+# Every figure keeps an EWMA mean/variance overall and per hour of the day
+# (seasonality). A batch of results is scored against all baselines at once,
+# vectorized with NumPy when it is available (pure Python otherwise - same
+# results, just slower).
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+from collections import namedtuple
+from time import time, localtime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# the outcome of scoring one figure of a result against its baseline
+Score = namedtuple('Score', ['heimdall', 'metric', 'value', 'expected', 'z', 'is_anomaly'])
+
+
+class Baselines(object):
+    """
+    EWMA mean/variance per key, overall and per seasonal bucket. Keys are
+    added on first use; everything is stored in flat arrays (one slot per key,
+    or per key and bucket) so that whole batches are updated in a single pass.
+    """
+    def __init__(self, alpha=0.02, seasonal_alpha=0.1, num_buckets=24, seasonal_min_samples=20):
+        self.alpha = alpha
+        self.seasonal_alpha = seasonal_alpha
+        self.num_buckets = num_buckets
+        self.seasonal_min_samples = seasonal_min_samples
+        self.keys = []
+        self.__index = {}
+        self.__size = 0
+        self.__capacity = 0
+        self.__mean = self.__var = self.__count = self.__floor = None
+        self.__s_mean = self.__s_var = self.__s_count = None
+        self.__grow(64)
+
+    def __len__(self):
+        return self.__size
+
+    def index(self, key, min_std=0.0):
+        """Index of a key (added along with the smallest std to assume for it, if new)"""
+        idx = self.__index.get(key)
+        if idx is None:
+            if self.__size == self.__capacity:
+                self.__grow(self.__capacity * 2)
+            idx = self.__index[key] = self.__size
+            self.__size += 1
+            self.keys.append(key)
+            self.__floor[idx] = min_std
+        return idx
+
+    def __grow(self, capacity):
+        extra = capacity - self.__capacity
+        extra_seasonal = extra * self.num_buckets
+        if numpy is not None:
+            grow = lambda arr, n: numpy.zeros(n) if arr is None else numpy.concatenate((arr, numpy.zeros(n)))
+        else:
+            grow = lambda arr, n: [0.0] * n if arr is None else arr + [0.0] * n
+
+        self.__mean = grow(self.__mean, extra)
+        self.__var = grow(self.__var, extra)
+        self.__count = grow(self.__count, extra)
+        self.__floor = grow(self.__floor, extra)
+        self.__s_mean = grow(self.__s_mean, extra_seasonal)
+        self.__s_var = grow(self.__s_var, extra_seasonal)
+        self.__s_count = grow(self.__s_count, extra_seasonal)
+        self.__capacity = capacity
+
+    def recompute(self, bucket):
+        """
+        Expected value, std and sample count of every key for a seasonal bucket:
+        the bucket's own baseline once it has enough samples, the overall one
+        until then. Returns (means, stds, counts) indexed by key index.
+        """
+        n = self.__size
+        flat = slice(bucket, n * self.num_buckets, self.num_buckets)
+        if numpy is not None:
+            s_count = self.__s_count[flat]
+            is_seasonal = s_count >= self.seasonal_min_samples
+            means = numpy.where(is_seasonal, self.__s_mean[flat], self.__mean[:n])
+            variances = numpy.where(is_seasonal, self.__s_var[flat], self.__var[:n])
+            stds = numpy.maximum(numpy.sqrt(variances), self.__floor[:n])
+            return (means, stds, self.__count[:n])
+
+        means = []
+        stds = []
+        for (idx, s_idx) in enumerate(range(bucket, n * self.num_buckets, self.num_buckets)):
+            if self.__s_count[s_idx] >= self.seasonal_min_samples:
+                (mean, var) = (self.__s_mean[s_idx], self.__s_var[s_idx])
+            else:
+                (mean, var) = (self.__mean[idx], self.__var[idx])
+            means.append(mean)
+            stds.append(max(var ** 0.5, self.__floor[idx]))
+        return (means, stds, self.__count[:n])
+
+    def update(self, indices, bucket, values):
+        """Fold a batch of (key index, value) samples from one seasonal bucket into the baselines"""
+        if numpy is None:
+            for (idx, value) in zip(indices, values):
+                self.__update_one(self.__mean, self.__var, self.__count, idx, value, self.alpha)
+                self.__update_one(self.__s_mean, self.__s_var, self.__s_count, idx * self.num_buckets + bucket,
+                                  value, self.seasonal_alpha)
+            return
+
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        values = numpy.asarray(values, dtype=float)
+        (keys, positions, counts) = numpy.unique(indices, return_index=True, return_counts=True)
+
+        # keys with a single sample in the batch are folded in all at once...
+        single = positions[counts == 1]
+        (idx, batch) = (indices[single], values[single])
+        self.__update_many(self.__mean, self.__var, self.__count, idx, batch, self.alpha)
+        self.__update_many(self.__s_mean, self.__s_var, self.__s_count, idx * self.num_buckets + bucket,
+                           batch, self.seasonal_alpha)
+
+        # ...while repeated ones (e.g., overall figures) are folded in order
+        repeated = set(keys[counts > 1].tolist())
+        if repeated:
+            for (idx, value) in zip(indices.tolist(), values.tolist()):
+                if idx in repeated:
+                    self.__update_one(self.__mean, self.__var, self.__count, idx, value, self.alpha)
+                    self.__update_one(self.__s_mean, self.__s_var, self.__s_count, idx * self.num_buckets + bucket,
+                                      value, self.seasonal_alpha)
+
+    @staticmethod
+    def __update_one(mean, var, count, idx, value, alpha):
+        # exact running mean while there are few samples, EWMA afterwards
+        alpha = max(alpha, 1.0 / (count[idx] + 1.0))
+        diff = value - mean[idx]
+        increment = alpha * diff
+        mean[idx] += increment
+        var[idx] = (1.0 - alpha) * (var[idx] + diff * increment)
+        count[idx] += 1
+
+    @staticmethod
+    def __update_many(mean, var, count, idx, values, alpha):
+        alpha = numpy.maximum(alpha, 1.0 / (count[idx] + 1.0))
+        diff = values - mean[idx]
+        increment = alpha * diff
+        mean[idx] += increment
+        var[idx] = (1.0 - alpha) * (var[idx] + diff * increment)
+        count[idx] += 1
+
+
+class AnomalyDetector(object):
+    """
+    Scores the figures of every result against their baselines and then
+    learns from them. A figure is anomalous once its baseline has at least
+    `min_samples` samples and it deviates `z_threshold` standard deviations
+    or more in the direction that means trouble. Samples are clamped to that
+    range before being learned from, so an outage does not become the new
+    normal right away (a lasting change still does, gradually).
+    """
+    # metric -> (direction: -1 = too low is bad, 1 = too high is bad; smallest std to assume)
+    METRICS = {
+        'usercount': (-1, 5.0),
+        'usercount_ratio': (-1, 0.01),
+        'which_delay': (1, 0.05),
+        'heimdall.qtemp': (1, 1.0),
+        'horton.qtemp': (1, 1.0),
+        'tribble.qtemp': (1, 1.0),
+    }
+
+    def __init__(self, z_threshold=4.0, min_samples=30, alpha=0.02, seasonal_alpha=0.1,
+                 seasonal_min_samples=20):
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.baselines = Baselines(alpha, seasonal_alpha, 24, seasonal_min_samples)
+
+    @staticmethod
+    def samples(result):
+        """[((heimdall_id, metric), value), ...] of all figures in a result worth a baseline"""
+        if result.is_error:
+            return []
+
+        samples = []
+        if result.usercount is not None:
+            samples.append(((None, 'usercount'), result.usercount))
+            if result.usercount_max:
+                samples.append(((None, 'usercount_ratio'), float(result.usercount) / result.usercount_max))
+
+        if result.heimdall is not None:
+            h_id = result.heimdall.id
+            if result.which_delay >= 0:
+                samples.append(((h_id, 'which_delay'), result.which_delay))
+            for component in result.components():
+                samples.append(((h_id, component.type + '.qtemp'), component.qtemp))
+        return samples
+
+    def check_result(self, result, ts=None):
+        return self.check_results([result], ts)[0]
+
+    def check_results(self, results, ts=None):
+        """Score a batch of results (all taken around `ts`); returns a list of Scores per result"""
+        ts = time() if ts is None else ts
+        bucket = localtime(ts).tm_hour
+
+        per_result = [self.samples(result) for result in results]
+        keys = [key for samples in per_result for (key, value) in samples]
+        values = [value for samples in per_result for (key, value) in samples]
+        indices = [self.baselines.index(key, self.METRICS[key[1]][1]) for key in keys]
+        if not indices:
+            return [[] for result in results]
+
+        (means, stds, counts) = self.baselines.recompute(bucket)
+        if numpy is not None:
+            idx = numpy.asarray(indices, dtype=numpy.intp)
+            directions = numpy.array([self.METRICS[key[1]][0] for key in keys], dtype=float)
+            (means, stds, counts) = (means[idx], stds[idx], counts[idx])
+            values_arr = numpy.asarray(values, dtype=float)
+            zs = (values_arr - means) / numpy.where(stds > 0, stds, 1.0)
+            is_anomaly = (counts >= self.min_samples) & (zs * directions >= self.z_threshold)
+            learned = numpy.clip(values_arr, means - self.z_threshold * stds, means + self.z_threshold * stds)
+            learned = numpy.where(counts >= self.min_samples, learned, values_arr)
+            (means, zs, is_anomaly) = (means.tolist(), zs.tolist(), is_anomaly.tolist())
+        else:
+            (means, stds, counts) = ([means[i] for i in indices], [stds[i] for i in indices],
+                                     [counts[i] for i in indices])
+            zs = [(value - mean) / (std if std > 0 else 1.0) for (value, mean, std) in zip(values, means, stds)]
+            is_anomaly = [count >= self.min_samples and z * self.METRICS[key[1]][0] >= self.z_threshold
+                          for (key, count, z) in zip(keys, counts, zs)]
+            learned = [min(max(value, mean - self.z_threshold * std), mean + self.z_threshold * std)
+                       if count >= self.min_samples else value
+                       for (value, mean, std, count) in zip(values, means, stds, counts)]
+
+        self.baselines.update(indices, bucket, learned)
+
+        scores = []
+        pos = 0
+        for samples in per_result:
+            scores.append([Score(key[0], key[1], value, means[pos + i], zs[pos + i], is_anomaly[pos + i])
+                           for (i, (key, value)) in enumerate(samples)])
+            pos += len(samples)
+        return scores
@@ -0,0 +1,145 @@
+# Capture Component - Project Heimon
+#
+# Records the raw server stream of each HeimdallTest (with receive timestamps)
+# into a compact append-only file, and plays such captures back through the
+# very same state machine for reproducing and profiling problems offline.
+#
+# File format: MAGIC followed by records of RECORD_HEADER (kind, session id,
+# timestamp, payload length) + payload. Sessions from concurrent probes may
+# interleave; a zero-length DATA record means the server disconnected.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import struct
+import threading
+
+from time import time, sleep
+from heimon.core import HeimdallTestBase
+
+MAGIC = b'HEIMCAP1'
+RECORD_HEADER = struct.Struct('<BIdI')
+
+KIND_OPEN = 1   # payload: "host:port" the probe connected to
+KIND_DATA = 2   # payload: raw bytes as received
+KIND_CLOSE = 3  # payload: empty
+
+
+class CaptureWriter(object):
+    """Appends probe sessions to a capture file (safe to share between threads)"""
+    def __init__(self, filename):
+        self.__fd = open(filename, 'ab')
+        if self.__fd.tell() == 0:
+            self.__fd.write(MAGIC)
+        self.__next_id = 0
+        self.__lock = threading.Lock()
+
+    def open_session(self, addr):
+        """Start recording a new session and return its ID"""
+        with self.__lock:
+            session_id = self.__next_id
+            self.__next_id += 1
+        self.__write(KIND_OPEN, session_id, bytes("%s:%d" % tuple(addr), 'utf-8'))
+        return session_id
+
+    def write_data(self, session_id, data):
+        self.__write(KIND_DATA, session_id, data)
+
+    def close_session(self, session_id):
+        self.__write(KIND_CLOSE, session_id, b'')
+        with self.__lock:
+            self.__fd.flush()
+
+    def close(self):
+        with self.__lock:
+            if self.__fd:
+                self.__fd.close()
+                self.__fd = None
+
+    def __write(self, kind, session_id, payload):
+        with self.__lock:
+            self.__fd.write(RECORD_HEADER.pack(kind, session_id, time(), len(payload)))
+            self.__fd.write(payload)
+
+
+class CapturedSession(object):
+    """A single recorded probe session: where it went and what it received"""
+    def __init__(self, session_id, addr, ts_opened):
+        self.id = session_id
+        self.addr = addr
+        self.ts_opened = ts_opened
+        self.chunks = []  # [(timestamp, data), ...]
+        self.is_closed = False
+
+
+def read_sessions(filename):
+    """
+    Read a capture file and return all of its sessions in the order they were
+    opened. A truncated trailing record (e.g., the monitor was killed while
+    writing) is ignored.
+    """
+    with open(filename, 'rb') as fd:
+        data = fd.read()
+
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not a heimon capture file" % filename)
+
+    view = memoryview(data)
+    pos = len(MAGIC)
+    sessions = []
+    open_sessions = {}
+    while pos + RECORD_HEADER.size <= len(data):
+        (kind, session_id, ts, length) = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        if pos + length > len(data):
+            break
+
+        payload = view[pos:pos + length]
+        pos += length
+
+        if kind == KIND_OPEN:
+            (host, port) = bytes(payload).decode('utf-8').rsplit(':', 1)
+            session = CapturedSession(session_id, (host, int(port)), ts)
+            open_sessions[session_id] = session
+            sessions.append(session)
+        elif session_id in open_sessions:
+            session = open_sessions[session_id]
+            if kind == KIND_DATA:
+                session.chunks.append((ts, bytes(payload)))
+            elif kind == KIND_CLOSE:
+                session.is_closed = True
+                del open_sessions[session_id]
+
+    return sessions
+
+
+class ReplayTest(HeimdallTestBase):
+    """HeimdallTest look-alike fed from a CapturedSession instead of a socket"""
+    CREDS = {'name': 'replay', 'password': 'replay'}
+
+    def __init__(self, session):
+        HeimdallTestBase.__init__(self, session.addr, self.CREDS)
+        self.__session = session
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def run(self, paced=False):
+        """Feed the whole session through the states and return the result"""
+        self.start()
+        ts_offset = time() - self.__session.ts_opened
+        for (ts, data) in self.__session.chunks:
+            if not self.is_connected():
+                break
+
+            if paced:
+                delay = ts + ts_offset - time()
+                if delay > 0:
+                    sleep(delay)
+            self.process_data(data)
+
+        # the capture ended without the server hanging up on us
+        if self.is_connected():
+            self.close()
+
+        return self.result
@@ -6,79 +6,123 @@
 # Version: 20160408-2240
 # Author:  Artex / IceDragon <artex@furcadia.com>
 
+from os import strerror
+from time import perf_counter
 from socket import *
 from heimon.states import *
-
-
-class HeimdallTest(object):
+from heimon.util import LineFramer
+from heimon.results import ProbeResult
+from heimon.profiling import COUNTERS
+
+
+class HeimdallTestBase(object):
+    """
+    Protocol side of a heimdall check: drives the state machine and gathers
+    the result. Subclasses provide the actual I/O - send(data), which the
+    states call to talk to the server, as well as connecting and close() -
+    and feed whatever they receive into process_data() and process_idle().
+    """
     BUFFER_SIZE = 4096
     IO_TIMEOUT_SECS = 10
 
+    # hard limit on how long a whole probe may take (connect to close) when
+    # driven by one of the concurrent engines
+    PROBE_TIMEOUT_SECS = 30
+
+    # optional heimon.capture.CaptureWriter recording every received byte
+    CAPTURE = None
+
+    @staticmethod
+    def setcapture(writer):
+        HeimdallTestBase.CAPTURE = writer
+
     @staticmethod
     def setbuffersize(size):
-        HeimdallTest.BUFFER_SIZE = size
+        HeimdallTestBase.BUFFER_SIZE = size
 
     @staticmethod
     def settimeout(timeout):
-        HeimdallTest.IO_TIMEOUT_SECS = timeout
+        HeimdallTestBase.IO_TIMEOUT_SECS = timeout
 
     def __init__(self, addr, creds):
-        self.__addr = addr
-        self.__creds = creds
-        self.__socket = socket(AF_INET, SOCK_STREAM)
+        self._addr = addr
+        self._creds = creds
+        self._flag_connected = False
+        self._framer = LineFramer(self.BUFFER_SIZE)
+        self._capture_id = None
+        self._ts_origin = None
         self.__state = NullState(self)
-        self.__flag_connected = False
 
         # this is filled over the lifetime of this test
-        self.result = {
-            'usercount': None,
-            'which': {
-                'delay': -1
-            },
-            'is_error': False,
-            'error_msg': "(no error)"
-        }
-
-    def connect(self):
-        self.__socket.settimeout(self.IO_TIMEOUT_SECS)
-        self.__socket.connect(self.__addr)
-        self.__flag_connected = True
-        self.change_state(DragonroarState(self, self.__creds))
-        self.__creds = None
+        self.result = ProbeResult(creds['name'] if creds else None)
+
+    def mark_connecting(self):
+        """Start the clock for all timing events (right before connecting)"""
+        self._ts_origin = perf_counter()
+
+    def mark(self, event):
+        """Record when an event happened (in secs since connecting began)"""
+        if self._ts_origin is None:
+            self.mark_connecting()
+        self.result.timing[event] = perf_counter() - self._ts_origin
+
+    def start(self):
+        """Begin the conversation once the connection has been established"""
+        self._flag_connected = True
+        if self.CAPTURE:
+            self._capture_id = self.CAPTURE.open_session(self._addr)
+        self.change_state(DragonroarState(self, self._creds))
+        self._creds = None
 
     def is_connected(self):
-        return self.__flag_connected
+        return self._flag_connected
 
     def close(self):
         """Close this connection (without sending `quit first)"""
-        if self.__socket:
-            self.__socket.close()
-            self.__socket = None
-            self.__flag_connected = False
-
+        self._flag_connected = False
+        if self._capture_id is not None:
+            self.CAPTURE.close_session(self._capture_id)
+            self._capture_id = None
         self.change_state(ClosedState(self))
 
-    def process_next(self):
-        """Process more data from this test/connection"""
-        try:
-            buffer = self.recv()
-            is_disconnected = buffer == b''
-
-            for line in buffer.split(b'\n'):
-                self.__state.process(line)
-
-            if is_disconnected:
-                self.handle_disconnected()
-
-        except timeout as e:
-            self.__state.idle()
-
-
-    def send(self, data):
-        self.__socket.send(bytes(data, 'utf-8'))
-
-    def recv(self):
-        return self.__socket.recv(self.BUFFER_SIZE)
+    def process_data(self, buffer):
+        """Pass received data to the current state (b'' means disconnected)"""
+        self.capture(buffer)
+        self._framer.feed(buffer)
+        self.process_received(buffer == b'')
+
+    def process_received(self, is_disconnected):
+        """Pass all complete lines in the receive buffer to the current state"""
+        ts_start = perf_counter()
+        line = self._framer.next_line()
+        while line is not None:
+            self.__state.process(line)
+            line = self._framer.next_line()
+
+        if is_disconnected:
+            # whatever is left was never terminated - process it regardless
+            if len(self._framer) > 0:
+                self.__state.process(self._framer.flush())
+            self.handle_disconnected()
+
+        COUNTERS.add('HeimdallTest.process_received', perf_counter() - ts_start)
+
+    def capture(self, data):
+        """Record received data (if capturing is enabled)"""
+        if self._capture_id is not None:
+            self.CAPTURE.write_data(self._capture_id, data)
+
+    def process_idle(self):
+        """Let the current state know that no data arrived in time"""
+        self.__state.idle()
+
+    def idle_timeout(self):
+        """Secs to wait for data before calling process_idle()"""
+        return self.__state.IDLE_SECS or self.IO_TIMEOUT_SECS
+
+    def make_which_state(self):
+        """Build the state to enter once logged in"""
+        return WhichTestState(self)
 
     def shutdown(self):
         """Shut down this test gracefully"""
@@ -90,26 +134,103 @@ class HeimdallTest(object):
             self.__state.exit()
 
         self.__state = handler
+        if handler.EVENT:
+            self.mark(handler.EVENT)
         self.__state.enter()
 
     def handle_usercount(self, current, max_count):
         """Update usercount based on server input"""
-        self.result['usercount'] = {'current': current, 'max': max_count}
+        self.mark('usercount')
+        self.result.usercount = current
+        self.result.usercount_max = max_count
 
     def handle_error(self, msg):
         """Handle a fatal error"""
-        self.result['is_test_successful'] = False
-        self.result['is_error'] = True
-        self.result['error_msg'] = msg
+        self.result.is_error = True
+        self.result.error_msg = msg
+        self.result.error_state = str(self.__state)
         self.close()
 
-    def handle_which_result(self, result):
+    def handle_rejected(self, msg):
+        """Handle the server refusing our login (]#)"""
+        self.result.is_rejected = True
+        self.handle_error(msg)
+
+    def handle_which_result(self, component):
         """Update `which result of Furcadia's respective network component"""
-        self.result['which'][result['type']] = result
+        self.mark('which.' + component.type)
+        setattr(self.result, component.type, component)
 
     def handle_which_delay(self, delay):
         """Uppdate the time it took for the entire `which request to be processed (in seconds)"""
-        self.result['which']['delay'] = delay
+        self.result.which_delay = delay
+
+    def handle_which_sample(self, delay):
+        """A persistent `which round-trip completed (see WhichLoopState)"""
+        self.handle_which_delay(delay)
+
+    def handle_which_stall(self, elapsed, num_lines):
+        """A persistent `which got no complete response in time (see WhichLoopState)"""
+        pass
 
     def handle_disconnected(self):
         self.close()
+
+
+class HeimdallTest(HeimdallTestBase):
+    """Blocking, socket-based heimdall check"""
+    def __init__(self, addr, creds, sock=None):
+        HeimdallTestBase.__init__(self, addr, creds)
+        self.__socket = sock or socket(AF_INET, SOCK_STREAM)
+
+    def connect(self):
+        self.mark_connecting()
+        self.__socket.settimeout(self.IO_TIMEOUT_SECS)
+        self.__socket.connect(self._addr)
+        self.start()
+
+    def connect_nonblocking(self):
+        """Start connecting without blocking; returns connect_ex() error code"""
+        self.mark_connecting()
+        self.__socket.setblocking(False)
+        return self.__socket.connect_ex(self._addr)
+
+    def finish_connect(self):
+        """Complete a non-blocking connect once the socket became writable"""
+        error = self.__socket.getsockopt(SOL_SOCKET, SO_ERROR)
+        if error:
+            raise OSError(error, strerror(error))
+        self.start()
+
+    def fileno(self):
+        return self.__socket.fileno()
+
+    def close(self):
+        """Close this connection (without sending `quit first)"""
+        if self.__socket:
+            self.__socket.close()
+            self.__socket = None
+
+        HeimdallTestBase.close(self)
+
+    def process_next(self):
+        """Process more data from this test/connection"""
+        ts_start = perf_counter()
+        try:
+            num_bytes = self.recv_into()
+        except timeout as e:
+            self.process_idle()
+        except BlockingIOError:
+            pass  # spurious wakeup on a non-blocking socket
+        else:
+            self.capture(self._framer.last_received(num_bytes))
+            self.process_received(num_bytes == 0)
+
+        COUNTERS.add('HeimdallTest.process_next', perf_counter() - ts_start)
+
+    def send(self, data):
+        self.__socket.send(bytes(data, 'utf-8'))
+
+    def recv_into(self):
+        """Receive more data into the line framer's buffer"""
+        return self._framer.recv_into(self.__socket)
@@ -0,0 +1,147 @@
+# Credentials Component - Project Heimon
+#
+# Leases Furcadia characters to probes: no character is logged in twice at
+# once, each one rests for a cooldown between logins, characters the server
+# rejects are backed off exponentially and the healthiest available character
+# is always picked first. The INI directory is rescanned periodically, so
+# characters can be added, fixed or removed while the monitor runs.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import os
+
+from glob import glob
+from time import monotonic
+from heimon.util import readini
+
+
+def is_usable_character(info):
+    """Whether an INI has a name and a real password (not the sample's placeholder)"""
+    return "name" in info and "password" in info and info["password"] != "Password"
+
+
+class Character(object):
+    """A character in the pool along with its lease and health bookkeeping"""
+    def __init__(self, filename, mtime, info):
+        self.filename = filename
+        self.mtime = mtime
+        self.info = info
+        self.is_leased = False
+        self.is_removed = False
+        self.ts_last_login = None
+        self.ts_available = 0.0   # not to be leased before this time
+        self.num_failures = 0     # consecutive rejections
+        self.health = 1.0         # EWMA of successful logins (1.0 = always fine)
+
+    @property
+    def name(self):
+        return self.info['name']
+
+
+class CredentialPool(object):
+    """
+    Exclusive character leases: lease() hands out the healthiest character
+    that is neither in use, cooling down nor backed off (or None if there is
+    no such character) and release() takes it back along with how its login
+    went.
+    """
+    # how much a single login outcome moves the health score
+    HEALTH_WEIGHT = 0.2
+
+    def __init__(self, ini_path, cooldown=10.0, backoff=30.0, max_backoff=3600.0, rescan_interval=30.0):
+        self.ini_path = ini_path
+        self.cooldown = cooldown
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rescan_interval = rescan_interval
+        self.__characters = {}  # filename -> Character
+        self.__leased = {}      # name -> Character
+        self.__ts_last_scan = None
+        self.rescan()
+
+    def __len__(self):
+        return len(self.__characters)
+
+    def characters(self):
+        return list(self.__characters.values())
+
+    def rescan(self):
+        """Pick up added, changed and removed INI files"""
+        self.__ts_last_scan = monotonic()
+        seen = set()
+        for filename in glob(os.path.join(self.ini_path, '*.ini')):
+            try:
+                mtime = os.stat(filename).st_mtime
+                character = self.__characters.get(filename)
+                if character is not None and character.mtime == mtime:
+                    seen.add(filename)
+                    continue
+
+                info = readini(filename)
+            except (OSError, UnicodeDecodeError):
+                continue
+
+            if not is_usable_character(info):
+                continue
+
+            seen.add(filename)
+            if character is None:
+                self.__characters[filename] = Character(filename, mtime, info)
+            else:
+                # changed (e.g., fixed password) - give it a fresh chance
+                character.mtime = mtime
+                character.info = info
+                character.num_failures = 0
+                character.ts_available = 0.0
+                character.health = max(character.health, 0.5)
+
+        for filename in list(self.__characters.keys()):
+            if filename not in seen:
+                self.__characters.pop(filename).is_removed = True
+
+    def lease(self, now=None):
+        """Lease the best available character (its INI info dict) or return None"""
+        now = monotonic() if now is None else now
+        if now - self.__ts_last_scan >= self.rescan_interval:
+            self.rescan()
+
+        best = None
+        for character in self.__characters.values():
+            if character.is_leased or character.ts_available > now or character.name in self.__leased:
+                continue
+            if best is None or (character.health, -(character.ts_last_login or 0.0)) > \
+                    (best.health, -(best.ts_last_login or 0.0)):
+                best = character
+
+        if best is None:
+            return None
+
+        best.is_leased = True
+        best.ts_last_login = now
+        self.__leased[best.name] = best
+        return best.info
+
+    def next_available_in(self, now=None):
+        """Secs until some character can be leased again (None if the pool is empty)"""
+        now = monotonic() if now is None else now
+        waits = [max(0.0, character.ts_available - now)
+                 for character in self.__characters.values() if not character.is_leased]
+        return min(waits) if waits else None
+
+    def release(self, name, is_rejected=False, now=None):
+        """Take a character back; is_rejected means the server refused its login"""
+        character = self.__leased.pop(name, None)
+        if character is None:
+            return
+
+        now = monotonic() if now is None else now
+        character.is_leased = False
+        if is_rejected:
+            character.num_failures += 1
+            character.health *= 1.0 - self.HEALTH_WEIGHT
+            backoff = min(self.max_backoff, self.backoff * 2 ** (character.num_failures - 1))
+            character.ts_available = now + backoff
+        else:
+            character.num_failures = 0
+            character.health += self.HEALTH_WEIGHT * (1.0 - character.health)
+            character.ts_available = max(now, character.ts_last_login + self.cooldown)
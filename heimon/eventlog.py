@@ -0,0 +1,344 @@
+# Event Log Component - Project Heimon
+#
+# Append-only, structured log of alert events (raised, repeated, resolved,
+# ...) that can be queried by time range, heimdall and test without reading
+# it all - unlike the plain text alerts log.
+#
+# Events are written to segment files (NNNNNNNN.seg) as length-prefixed
+# records: RECORD_HEADER (payload length, timestamp, kind) followed by a JSON
+# payload [test, heimdall, component, message, fields]. Once a segment is
+# sealed (it grew past its size limit or the log was closed), an index is
+# written next to it (NNNNNNNN.idx): the segment's time range, a sparse time
+# index (the timestamp and offset of every INDEX_EVERY-th record) and posting
+# lists (record offsets) per heimdall and per test. Readers memory-map the
+# segments and only decode the records the index points them at; a segment
+# without an index (the one being written, or after a crash) is scanned once.
+#
+# Timestamps are assumed to be (mostly) increasing within a segment, which
+# holds for anything appended as it happens.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import os
+import json
+import mmap
+import struct
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from glob import glob
+from time import monotonic
+from heimon.alerts import AlertKey, Destination
+
+RECORD_HEADER = struct.Struct('<IdB')
+
+INDEX_MAGIC = b'HEIMIDX1'
+INDEX_HEADER = struct.Struct('<ddIII')   # ts_min, ts_max, num_records, num_sparse, num_postings
+POSTING_HEADER = struct.Struct('<BHI')   # field, name length, number of offsets
+
+# kinds of events (stored as their position in this tuple)
+EVENT_KINDS = ('raised', 'repeated', 'resolved')
+KIND_CODES = dict((kind, code) for (code, kind) in enumerate(EVENT_KINDS))
+
+# fields posting lists are kept for (stored as their position in this tuple)
+POSTING_FIELDS = ('heimdall', 'test')
+
+# a single logged event (see heimon.alerts.AlertEngine); key is an AlertKey
+Event = namedtuple('Event', ['ts', 'kind', 'key', 'message', 'fields'])
+
+
+def encode_event(event):
+    (test, heimdall, component) = event.key if event.key is not None else (None, None, None)
+    payload = bytes(json.dumps([test, heimdall, component, event.message, event.fields or {}],
+                               separators=(',', ':')), 'utf-8')
+    return RECORD_HEADER.pack(len(payload), event.ts, KIND_CODES[event.kind]) + payload
+
+
+def decode_event(buffer, offset):
+    """Decode the record at offset; returns (event, offset of the next record)"""
+    (length, ts, kind) = RECORD_HEADER.unpack_from(buffer, offset)
+    start = offset + RECORD_HEADER.size
+    (test, heimdall, component, message, fields) = json.loads(bytes(buffer[start:start + length]))
+    key = None if test is None else AlertKey(test, heimdall, component)
+    return (Event(ts, EVENT_KINDS[kind], key, message, fields), start + length)
+
+
+def posting_names(event):
+    """The (field, name) posting lists an event belongs to"""
+    if event.key is None:
+        return []
+    return [(0, str(event.key.heimdall)), (1, str(event.key.test))]
+
+
+class SegmentIndex(object):
+    """Time range, sparse time index and posting lists of a single segment"""
+    def __init__(self, index_every=64):
+        self.index_every = index_every
+        self.ts_min = float('inf')
+        self.ts_max = float('-inf')
+        self.num_records = 0
+        self.sparse_ts = array('d')
+        self.sparse_offsets = array('Q')
+        self.postings = {}  # (field, name) -> array of offsets
+
+    def add(self, offset, event):
+        if self.num_records % self.index_every == 0:
+            self.sparse_ts.append(event.ts)
+            self.sparse_offsets.append(offset)
+        self.num_records += 1
+        self.ts_min = min(self.ts_min, event.ts)
+        self.ts_max = max(self.ts_max, event.ts)
+        for name in posting_names(event):
+            offsets = self.postings.get(name)
+            if offsets is None:
+                offsets = self.postings[name] = array('Q')
+            offsets.append(offset)
+
+    def overlaps(self, ts_from, ts_to):
+        return self.num_records > 0 and self.ts_max >= ts_from and self.ts_min <= ts_to
+
+    def offset_range(self, ts_from, ts_to, end):
+        """[start, stop) of the segment that can hold records between ts_from and ts_to"""
+        if not self.sparse_ts:
+            return (0, end)
+        # one sparse entry of slack on either side absorbs timestamps slightly out of order
+        i = max(0, bisect_left(self.sparse_ts, ts_from) - 1)
+        j = bisect_right(self.sparse_ts, ts_to) + 1
+        return (self.sparse_offsets[i], self.sparse_offsets[j] if j < len(self.sparse_offsets) else end)
+
+    def to_bytes(self):
+        parts = [INDEX_MAGIC,
+                 INDEX_HEADER.pack(self.ts_min, self.ts_max, self.num_records, len(self.sparse_ts),
+                                   len(self.postings)),
+                 self.sparse_ts.tobytes(), self.sparse_offsets.tobytes()]
+        for ((field, name), offsets) in sorted(self.postings.items()):
+            name = bytes(name, 'utf-8')
+            parts.append(POSTING_HEADER.pack(field, len(name), len(offsets)) + name + offsets.tobytes())
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(data):
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("not a heimon event log index")
+
+        index = SegmentIndex()
+        pos = len(INDEX_MAGIC)
+        (index.ts_min, index.ts_max, index.num_records, num_sparse, num_postings) = \
+            INDEX_HEADER.unpack_from(data, pos)
+        pos += INDEX_HEADER.size
+        index.sparse_ts.frombytes(data[pos:pos + num_sparse * 8])
+        pos += num_sparse * 8
+        index.sparse_offsets.frombytes(data[pos:pos + num_sparse * 8])
+        pos += num_sparse * 8
+        for i in range(num_postings):
+            (field, name_len, count) = POSTING_HEADER.unpack_from(data, pos)
+            pos += POSTING_HEADER.size
+            name = str(data[pos:pos + name_len], 'utf-8')
+            pos += name_len
+            offsets = index.postings[(field, name)] = array('Q')
+            offsets.frombytes(data[pos:pos + count * 8])
+            pos += count * 8
+        return index
+
+
+def scan_segment(buffer, index_every=64):
+    """Build the index of a segment by reading it; returns (index, end of the last complete record)"""
+    index = SegmentIndex(index_every)
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(buffer):
+        (length, ts, kind) = RECORD_HEADER.unpack_from(buffer, offset)
+        if offset + RECORD_HEADER.size + length > len(buffer):
+            break  # truncated (e.g., the monitor was killed while writing)
+        (event, next_offset) = decode_event(buffer, offset)
+        index.add(offset, event)
+        offset = next_offset
+    return (index, offset)
+
+
+def segment_files(directory):
+    return sorted(glob(os.path.join(directory, '[0-9]' * 8 + '.seg')))
+
+
+def index_filename(segment_filename):
+    return segment_filename[:-len('.seg')] + '.idx'
+
+
+class EventLog(object):
+    """
+    Appends events to segment files in a directory, starting a new segment
+    every `segment_bytes` bytes (and every time the log is opened). Segments
+    left without an index (e.g., after a crash) are indexed when opening.
+    """
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, index_every=64):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_every = index_every
+        self.__fd = None
+        self.__filename = None
+        self.__index = None
+        self.__size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        segments = segment_files(directory)
+        for filename in segments:
+            if not os.path.exists(index_filename(filename)):
+                self.__seal_unindexed(filename)
+        self.__next_seq = int(os.path.basename(segments[-1])[:8]) + 1 if segments else 0
+        self.__open_segment()
+
+    def append(self, event):
+        record = encode_event(event)
+        if self.__size > 0 and self.__size + len(record) > self.segment_bytes:
+            self.__seal()
+            self.__open_segment()
+
+        self.__fd.write(record)
+        self.__index.add(self.__size, event)
+        self.__size += len(record)
+
+    def flush(self):
+        self.__fd.flush()
+
+    def fileno(self):
+        return self.__fd.fileno()
+
+    def close(self):
+        if self.__fd:
+            self.__seal()
+
+    def __open_segment(self):
+        self.__filename = os.path.join(self.directory, "%08d.seg" % self.__next_seq)
+        self.__next_seq += 1
+        self.__fd = open(self.__filename, 'ab')
+        self.__index = SegmentIndex(self.index_every)
+        self.__size = 0
+
+    def __seal(self):
+        self.__fd.close()
+        self.__fd = None
+        if self.__size == 0:
+            os.remove(self.__filename)  # nothing was logged
+            return
+        self.__write_index(self.__filename, self.__index)
+
+    def __seal_unindexed(self, filename):
+        with open(filename, 'rb') as fd:
+            data = fd.read()
+        (index, end) = scan_segment(data, self.index_every)
+        if end < len(data):
+            # drop the truncated record so that the segment stays readable
+            with open(filename, 'r+b') as fd:
+                fd.truncate(end)
+        self.__write_index(filename, index)
+
+    @staticmethod
+    def __write_index(segment_filename, index):
+        filename = index_filename(segment_filename)
+        with open(filename + '.tmp', 'wb') as fd:
+            fd.write(index.to_bytes())
+        os.replace(filename + '.tmp', filename)
+
+
+class EventLogReader(object):
+    """Answers queries over an event log directory (see query())"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.__segments = []  # [(filename, index, mmap or None), ...]
+        for filename in segment_files(directory):
+            buffer = self.__map(filename)
+            index_name = index_filename(filename)
+            if os.path.exists(index_name):
+                with open(index_name, 'rb') as fd:
+                    index = SegmentIndex.from_bytes(fd.read())
+            else:
+                (index, end) = scan_segment(buffer if buffer is not None else b'')
+            self.__segments.append((filename, index, buffer))
+
+    @staticmethod
+    def __map(filename):
+        with open(filename, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for (filename, index, buffer) in self.__segments:
+            if buffer is not None:
+                buffer.close()
+        self.__segments = []
+
+    def segments(self):
+        """[(filename, number of records, ts_min, ts_max), ...]"""
+        return [(filename, index.num_records, index.ts_min, index.ts_max)
+                for (filename, index, buffer) in self.__segments]
+
+    def query(self, ts_from=None, ts_to=None, heimdall=None, test=None, kinds=None):
+        """Yield the events between ts_from and ts_to (inclusive) matching all the given criteria"""
+        ts_from = float('-inf') if ts_from is None else ts_from
+        ts_to = float('inf') if ts_to is None else ts_to
+        wanted = []
+        if heimdall is not None:
+            wanted.append((0, str(heimdall)))
+        if test is not None:
+            wanted.append((1, str(test)))
+
+        for (filename, index, buffer) in self.__segments:
+            if buffer is None or not index.overlaps(ts_from, ts_to):
+                continue
+
+            (start, stop) = index.offset_range(ts_from, ts_to, len(buffer))
+            if wanted:
+                offsets = self.__intersect([index.postings.get(name, ()) for name in wanted], start, stop)
+            else:
+                offsets = self.__walk(buffer, start, stop)
+
+            for offset in offsets:
+                (event, next_offset) = decode_event(buffer, offset)
+                if ts_from <= event.ts <= ts_to and (kinds is None or event.kind in kinds):
+                    yield event
+
+    @staticmethod
+    def __intersect(postings, start, stop):
+        """Offsets within [start, stop) present in all the (sorted) posting lists"""
+        postings = sorted(postings, key=len)
+        smallest = postings[0]
+        candidates = smallest[bisect_left(smallest, start):bisect_left(smallest, stop)]
+        for offsets in postings[1:]:
+            others = set(offsets[bisect_left(offsets, start):bisect_left(offsets, stop)])
+            candidates = [offset for offset in candidates if offset in others]
+        return candidates
+
+    @staticmethod
+    def __walk(buffer, start, stop):
+        offset = start
+        while offset + RECORD_HEADER.size <= stop:
+            (length, ts, kind) = RECORD_HEADER.unpack_from(buffer, offset)
+            if offset + RECORD_HEADER.size + length > len(buffer):
+                break
+            yield offset
+            offset += RECORD_HEADER.size + length
+
+
+class EventLogDestination(Destination):
+    """Alert destination appending heimon.eventlog.Events to an EventLog"""
+    def __init__(self, event_log, fsync_interval=5.0):
+        self.__log = event_log
+        self.__fsync_interval = fsync_interval
+        self.__ts_last_sync = monotonic()
+        self.__is_dirty = False
+
+    def write(self, events):
+        for event in events:
+            self.__log.append(event)
+        self.__is_dirty = True
+
+    def flush(self):
+        self.__log.flush()
+        if self.__is_dirty and monotonic() - self.__ts_last_sync >= self.__fsync_interval:
+            os.fsync(self.__log.fileno())
+            self.__ts_last_sync = monotonic()
+            self.__is_dirty = False
+
+    def close(self):
+        self.__log.close()
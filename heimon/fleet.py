@@ -0,0 +1,151 @@
+# Fleet Component - Project Heimon
+#
+# Monitors several targets (game server endpoints, test instances, ...) at
+# once by sharding them across worker processes. Each target runs in its own
+# thread within its shard, so a slow or unreachable one cannot starve the
+# others, and everything the targets report (alerts, log lines, results) is
+# sent back to the supervising process and merged into a single stream there.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import multiprocessing
+import signal
+import threading
+
+from queue import Empty
+from time import monotonic
+
+
+class Target(object):
+    """
+    A single monitored endpoint: its name, address, the heimdall IDs expected
+    behind it, where its credentials are and any setting overrides (e.g.,
+    thresholds) in `settings`.
+    """
+    def __init__(self, name, address, heimdall_ids, creds_path, **settings):
+        self.name = name
+        self.address = tuple(address)
+        self.heimdall_ids = list(heimdall_ids)
+        self.creds_path = creds_path
+        self.settings = settings
+
+    def get(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def __repr__(self):
+        return "Target(%s, %s:%d)" % (self.name, self.address[0], self.address[1])
+
+
+def shard_targets(targets, num_shards):
+    """Split the targets round-robin into (at most) num_shards non-empty shards"""
+    num_shards = max(1, min(num_shards, len(targets)))
+    return [targets[i::num_shards] for i in range(num_shards)]
+
+
+def run_shard(shard_id, targets, run_func, queue):
+    """
+    Worker process body: runs run_func(target, emit) for every target in its
+    own thread, where emit(kind, payload) sends an event to the supervisor.
+    """
+    # Ctrl+C is the supervisor's business
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def runner(target):
+        def emit(kind, payload):
+            queue.put((kind, target.name, payload))
+
+        try:
+            run_func(target, emit)
+        except Exception as ex:
+            emit('alert', "fleet/BUG: target %s crashed -> %r" % (target.name, ex))
+        emit('exit', None)
+
+    threads = [threading.Thread(target=runner, args=(target,), name="target-%s" % target.name)
+               for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class FleetSupervisor(object):
+    """
+    Runs all targets sharded across `processes` worker processes and hands
+    every event they emit to event_func(kind, target_name, payload). A shard
+    whose process dies is restarted after `restart_delay` secs.
+
+    run_func(target, emit) must be picklable (i.e., a module-level function).
+    """
+    def __init__(self, targets, run_func, event_func, processes=None, restart_delay=10.0):
+        self.__targets = list(targets)
+        self.__run_func = run_func
+        self.__event_func = event_func
+        self.__shards = shard_targets(self.__targets, processes or multiprocessing.cpu_count())
+        self.__restart_delay = restart_delay
+        self.__queue = multiprocessing.Queue()
+        self.__processes = [None] * len(self.__shards)
+        self.__ts_died = [None] * len(self.__shards)
+        self.__running_targets = set()
+        self.__running = False
+
+    def shards(self):
+        return [[target.name for target in shard] for shard in self.__shards]
+
+    def stop(self):
+        self.__running = False
+
+    def run(self, poll_interval=0.5):
+        """Supervise the shards until stopped (or until every target exited)"""
+        self.__running = True
+        for shard_id in range(len(self.__shards)):
+            self.__start(shard_id)
+
+        ts_next_check = monotonic() + poll_interval
+        try:
+            while self.__running and self.__running_targets:
+                # busy shards keep the queue from ever running dry - check on a schedule
+                if monotonic() >= ts_next_check:
+                    self.__check_shards()
+                    ts_next_check = monotonic() + poll_interval
+
+                try:
+                    (kind, name, payload) = self.__queue.get(timeout=max(0.0, ts_next_check - monotonic()))
+                except Empty:
+                    continue
+
+                if kind == 'exit':
+                    self.__running_targets.discard(name)
+                else:
+                    self.__event_func(kind, name, payload)
+        finally:
+            self.__terminate()
+
+    def __start(self, shard_id):
+        process = multiprocessing.Process(
+            target=run_shard, args=(shard_id, self.__shards[shard_id], self.__run_func, self.__queue),
+            name="heimon-shard-%d" % shard_id, daemon=True)
+        process.start()
+        self.__running_targets.update(target.name for target in self.__shards[shard_id])
+        self.__processes[shard_id] = process
+        self.__ts_died[shard_id] = None
+
+    def __check_shards(self):
+        for (shard_id, process) in enumerate(self.__processes):
+            if process.is_alive() or process.exitcode == 0:
+                continue
+
+            if self.__ts_died[shard_id] is None:
+                self.__ts_died[shard_id] = monotonic()
+                names = ", ".join(target.name for target in self.__shards[shard_id])
+                self.__event_func('alert', None, "fleet: shard %d (%s) died with exit code %s" % (
+                    shard_id, names, process.exitcode))
+            elif monotonic() - self.__ts_died[shard_id] >= self.__restart_delay:
+                self.__start(shard_id)
+
+    def __terminate(self):
+        for process in self.__processes:
+            if process and process.is_alive():
+                process.terminate()
+        for process in self.__processes:
+            if process:
+                process.join(1.0)
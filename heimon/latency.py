@@ -0,0 +1,108 @@
+# Latency Component - Project Heimon
+#
+# Turns the timing events a HeimdallTest records (result.timing) into
+# per-phase latencies and keeps per-heimdall, per-phase histograms with
+# percentiles, so that a network lag spike can be told apart from a slow auth
+# service or a slow horton/tribble.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+from array import array
+from math import log
+
+
+# phase -> (starting event, ending event); None means "connecting began"
+PHASES = [
+    ('connect', None, 'connect'),
+    ('usercount', 'connect', 'usercount'),
+    ('dragonroar', 'connect', 'dragonroar'),
+    ('auth', 'dragonroar', 'auth'),
+    ('which.heimdall', 'auth', 'which.heimdall'),
+    ('which.horton', 'auth', 'which.horton'),
+    ('which.tribble', 'auth', 'which.tribble'),
+    ('which', 'auth', 'which'),
+    ('close', 'which', 'close'),
+    ('total', None, 'close'),
+]
+
+
+def phase_latencies(timing):
+    """Return {phase: secs} for every phase whose both events were recorded"""
+    latencies = {}
+    for (phase, ev_start, ev_end) in PHASES:
+        if ev_end in timing and (ev_start is None or ev_start in timing):
+            latencies[phase] = timing[ev_end] - (0.0 if ev_start is None else timing[ev_start])
+    return latencies
+
+
+class LatencyHistogram(object):
+    """
+    Log-scale histogram (each bucket ~5% wide) from MIN_SECS to MAX_SECS;
+    anything outside is clamped into the first/last bucket.
+    """
+    MIN_SECS = 0.0001
+    MAX_SECS = 120.0
+    GROWTH = 1.05
+
+    NUM_BUCKETS = int(log(MAX_SECS / MIN_SECS) / log(GROWTH)) + 1
+
+    def __init__(self):
+        self.counts = array('I', [0]) * self.NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, secs):
+        if secs <= self.MIN_SECS:
+            idx = 0
+        else:
+            idx = min(int(log(secs / self.MIN_SECS) / log(self.GROWTH)), self.NUM_BUCKETS - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += secs
+        self.max = max(self.max, secs)
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the pct-th percentile"""
+        if not self.count:
+            return None
+
+        rank = pct / 100.0 * self.count
+        cumulative = 0
+        for (idx, count) in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(self.MIN_SECS * self.GROWTH ** (idx + 1), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class LatencyTracker(object):
+    """Per-heimdall, per-phase latency histograms"""
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        self.__histograms = {}  # (heimdall_id, phase) -> LatencyHistogram
+
+    def observe_result(self, result):
+        """Record all phase latencies of a HeimdallTest result"""
+        h_id = result.heimdall_id
+        for (phase, secs) in phase_latencies(result.timing).items():
+            key = (h_id, phase)
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = LatencyHistogram()
+            histogram.observe(secs)
+
+    def get(self, heimdall_id, phase):
+        return self.__histograms.get((heimdall_id, phase), None)
+
+    def summary(self):
+        """Return [(heimdall_id, phase, count, p50, p95, p99), ...]"""
+        rows = []
+        for ((h_id, phase), histogram) in list(self.__histograms.items()):
+            rows.append((h_id, phase, histogram.count) +
+                        tuple(histogram.percentile(pct) for pct in self.PERCENTILES))
+        return rows
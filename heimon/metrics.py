@@ -0,0 +1,263 @@
+# Metrics Component - Project Heimon
+#
+# Minimal Prometheus/OpenMetrics text exposition: counters, gauges and
+# histograms that are updated in place as results come in. Each metric caches
+# its rendered text until it changes again, so a scrape only formats whatever
+# changed since the previous one and never walks any history.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import threading
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from heimon.latency import phase_latencies
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """Generic metric family (a name, help text and a set of label names)"""
+    TYPE = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.__label_strings = {}
+        self.__header = "# HELP %s %s\n# TYPE %s %s\n" % (name, help_text, name, self.TYPE)
+        self.__text = None
+
+    def changed(self):
+        self.__text = None
+
+    def labelstr(self, labels, extra=""):
+        """Render (and remember) the {a="x",...} part for a label value tuple"""
+        key = (labels, extra)
+        text = self.__label_strings.get(key)
+        if text is None:
+            pairs = ['%s="%s"' % (name, escape_label(value)) for (name, value) in zip(self.labelnames, labels)]
+            if extra:
+                pairs.append(extra)
+            text = self.__label_strings[key] = "{%s}" % ",".join(pairs) if pairs else ""
+        return text
+
+    def render(self):
+        with self.lock:
+            if self.__text is None:
+                self.__text = self.__header + "".join(self.samples())
+            return self.__text
+
+    def samples(self):
+        return []
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        Metric.__init__(self, name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+            self.changed()
+
+    def samples(self):
+        return ["%s%s %s\n" % (self.name, self.labelstr(labels), format_value(value))
+                for (labels, value) in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+            self.changed()
+
+
+class CallbackGauge(Metric):
+    """Gauge whose values are computed at scrape time by func() -> [(labels, value), ...]"""
+    TYPE = 'gauge'
+
+    def __init__(self, name, help_text, labelnames, func):
+        Metric.__init__(self, name, help_text, labelnames)
+        self.func = func
+
+    def render(self):
+        self.changed()
+        return Metric.render(self)
+
+    def samples(self):
+        return ["%s%s %s\n" % (self.name, self.labelstr(tuple(labels)), format_value(value))
+                for (labels, value) in self.func()]
+
+
+class CallbackCounter(CallbackGauge):
+    """Counter whose values are read at scrape time by func() -> [(labels, value), ...]"""
+    TYPE = 'counter'
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=(0.1, 0.5, 1, 5, 10)):
+        Metric.__init__(self, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = {}  # labels -> [per-bucket counts (non-cumulative), sum]
+
+    def observe(self, value, labels=()):
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [[0] * len(self.buckets), 0.0]
+            data[0][bisect_left(self.buckets, value)] += 1
+            data[1] += value
+            self.changed()
+
+    def samples(self):
+        lines = []
+        for (labels, (counts, total)) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets, counts):
+                cumulative += count
+                extra = 'le="%s"' % format_value(bound)
+                lines.append("%s_bucket%s %d\n" % (self.name, self.labelstr(labels, extra), cumulative))
+            lines.append("%s_sum%s %s\n" % (self.name, self.labelstr(labels), format_value(total)))
+            lines.append("%s_count%s %d\n" % (self.name, self.labelstr(labels), cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    """All exposed metric families, rendered in registration order"""
+    def __init__(self):
+        self.__metrics = []
+
+    def register(self, metric):
+        self.__metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "".join(metric.render() for metric in self.__metrics)
+
+
+class ProbeMetrics(object):
+    """The standard set of HeimdallTest result metrics"""
+    WHICH_DELAY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+    PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        reg = self.registry.register
+        self.probes = reg(Counter(
+            'heimon_probes_total', "Heimdall checks completed"))
+        self.errors = reg(Counter(
+            'heimon_probe_errors_total', "Heimdall checks that failed, by the state they failed in", ['state']))
+        self.heimdall_probes = reg(Counter(
+            'heimon_heimdall_probes_total', "Heimdall checks that landed on each heimdall", ['heimdall']))
+        self.usercount = reg(Gauge(
+            'heimon_usercount', "Server user count as reported on connect", ['kind']))
+        self.which_delay = reg(Histogram(
+            'heimon_which_delay_seconds', "Time it took to receive the `which response", ['heimdall'],
+            self.WHICH_DELAY_BUCKETS))
+        self.phase_latency = reg(Histogram(
+            'heimon_phase_latency_seconds', "Latency of each heimdall check phase", ['heimdall', 'phase'],
+            self.PHASE_BUCKETS))
+        self.session_rtt = reg(Histogram(
+            'heimon_session_which_rtt_seconds', "`which round-trip time over persistent sessions", ['heimdall'],
+            self.PHASE_BUCKETS))
+        self.session_stalls = reg(Counter(
+            'heimon_session_which_stalls_total', "`which requests that stalled on persistent sessions",
+            ['heimdall']))
+
+    def track_latency(self, tracker):
+        """Expose the p50/p95/p99 figures of a heimon.latency.LatencyTracker"""
+        def quantiles():
+            for (h_id, phase, count, p50, p95, p99) in tracker.summary():
+                heimdall = 'unknown' if h_id is None else str(h_id)
+                for (quantile, value) in (('0.5', p50), ('0.95', p95), ('0.99', p99)):
+                    yield ((heimdall, phase, quantile), value)
+
+        self.registry.register(CallbackGauge(
+            'heimon_phase_latency_quantile_seconds', "Latency percentiles of each heimdall check phase",
+            ['heimdall', 'phase', 'quantile'], quantiles))
+
+    def track_last_seen(self, func):
+        """Expose last-seen ages computed at scrape time from func() -> [(heimdall_id, ts_last_seen), ...]"""
+        self.registry.register(CallbackGauge(
+            'heimon_heimdall_last_seen_age_seconds', "Seconds since each heimdall was last seen", ['heimdall'],
+            lambda: [((str(h_id),), time() - ts) for (h_id, ts) in func()]))
+
+    def track_counters(self, counters):
+        """Expose the call counters of a heimon.profiling.Counters"""
+        self.registry.register(CallbackCounter(
+            'heimon_profile_calls_total', "Calls of each profiled hot spot", ['counter'],
+            lambda: [((name,), calls) for (name, calls, total, slowest) in counters.snapshot()]))
+        self.registry.register(CallbackCounter(
+            'heimon_profile_seconds_total', "Time spent in each profiled hot spot", ['counter'],
+            lambda: [((name,), total) for (name, calls, total, slowest) in counters.snapshot()]))
+
+    def observe_result(self, result):
+        self.probes.inc()
+        if result.usercount is not None:
+            self.usercount.set(result.usercount, ('current',))
+            self.usercount.set(result.usercount_max, ('max',))
+
+        if result.is_error:
+            self.errors.inc((result.error_state,))
+
+        heimdall = 'unknown' if result.heimdall is None else str(result.heimdall.id)
+        if result.heimdall is not None:
+            self.heimdall_probes.inc((heimdall,))
+            self.which_delay.observe(result.which_delay, (heimdall,))
+
+        for (phase, secs) in phase_latencies(result.timing).items():
+            self.phase_latency.observe(secs, (heimdall, phase))
+
+    def observe_session_sample(self, heimdall_id, delay):
+        self.session_rtt.observe(delay, ('unknown' if heimdall_id is None else str(heimdall_id),))
+
+    def observe_session_stall(self, heimdall_id):
+        self.session_stalls.inc(('unknown' if heimdall_id is None else str(heimdall_id),))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = bytes(self.registry.render(), 'utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(registry, address):
+    """Serve GET /metrics from a background thread; returns the server"""
+    handler = type('BoundMetricsRequestHandler', (MetricsRequestHandler,), {'registry': registry})
+    server = ThreadingHTTPServer(address, handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
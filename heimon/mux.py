@@ -0,0 +1,202 @@
+# Multiplexer Component - Project Heimon
+#
+# Houses a selectors-based event loop that drives many non-blocking
+# HeimdallTest instances from a single thread. Idle/timeout handling is done
+# through a timer heap rather than socket timeout exceptions. Nothing may block
+# that thread, so addresses are resolved up front (see resolve_address).
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import socket
+import selectors
+
+from errno import EINPROGRESS, EWOULDBLOCK
+from heapq import heappush, heappop
+from itertools import count
+from time import monotonic, sleep
+
+
+def resolve_address(address):
+    """Resolve a (host, port) address into the (IP, port) probes connect to"""
+    (host, port) = address
+    return socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4][:2]
+
+
+class Timer(object):
+    """A cancellable callback scheduled on the ProbeMultiplexer timer heap"""
+    __slots__ = ('deadline', 'seq', 'func', 'cancelled')
+
+    def __init__(self, deadline, seq, func):
+        self.deadline = deadline
+        self.seq = seq
+        self.func = func
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ProbeMultiplexer(object):
+    """
+    Single-threaded event loop for non-blocking HeimdallTest probes.
+
+    add() starts a probe; once it is closed (successfully or not) its
+    done_func is called with the HeimdallTest instance. Arbitrary callbacks can
+    be scheduled with call_later() (e.g., to launch the next probe). Probes
+    should connect to resolved addresses - a host name would be resolved (and
+    block the loop) on every connect.
+    """
+    def __init__(self, selector=None):
+        self.__selector = selector or selectors.DefaultSelector()
+        self.__timers = []
+        self.__seq = count()
+        self.__probes = {}  # fd -> _Probe
+
+    def __len__(self):
+        return len(self.__probes)
+
+    def call_later(self, delay, func):
+        timer = Timer(monotonic() + delay, next(self.__seq), func)
+        heappush(self.__timers, timer)
+        return timer
+
+    def add(self, heimtest, done_func=lambda heimtest: None):
+        """Start connecting a HeimdallTest and drive it until it closes"""
+        probe = _Probe(heimtest, done_func)
+        try:
+            error = heimtest.connect_nonblocking()
+        except OSError as e:
+            heimtest.handle_error("Connection failed: %s" % e)
+            done_func(heimtest)
+            return
+
+        if error not in (0, EINPROGRESS, EWOULDBLOCK):
+            heimtest.handle_error("Connection failed: [Errno %d]" % error)
+            done_func(heimtest)
+            return
+
+        probe.fd = heimtest.fileno()
+        self.__probes[probe.fd] = probe
+        self.__selector.register(probe.fd, selectors.EVENT_WRITE, probe)
+        probe.deadline_timer = self.call_later(
+            heimtest.PROBE_TIMEOUT_SECS, lambda: self.__on_deadline(probe))
+        self.__reset_idle_timer(probe)
+
+    def run(self):
+        """Run until there are no probes and no timers left"""
+        while self.__probes or self.__timers:
+            self.run_once()
+
+    def run_once(self):
+        """Wait for I/O or the next timer (whichever comes first) and handle it"""
+        timeout = None
+        if self.__timers:
+            timeout = max(0.0, self.__timers[0].deadline - monotonic())
+
+        if self.__probes:
+            for (key, mask) in self.__selector.select(timeout):
+                self.__on_event(key.data, mask)
+        elif timeout:
+            sleep(timeout)
+
+        self.__run_timers()
+
+    def __run_timers(self):
+        now = monotonic()
+        while self.__timers and self.__timers[0].deadline <= now:
+            timer = heappop(self.__timers)
+            if not timer.cancelled:
+                timer.func()
+
+    def __on_event(self, probe, mask):
+        if self.__probes.get(probe.fd) is not probe:
+            return  # stale event for a probe that finished earlier in this batch
+
+        heimtest = probe.heimtest
+        if probe.is_connecting:
+            try:
+                heimtest.finish_connect()
+            except OSError as e:
+                heimtest.handle_error("Connection failed: %s" % e)
+            else:
+                probe.is_connecting = False
+                self.__selector.modify(probe.fd, selectors.EVENT_READ, probe)
+        else:
+            try:
+                heimtest.process_next()
+            except OSError as e:
+                heimtest.handle_error("Connection error: %s" % e)
+
+        self.__reset_idle_timer(probe)
+        self.__maybe_done(probe)
+
+    def __on_idle(self, probe):
+        probe.idle_timer = None
+        if monotonic() < probe.ts_idle:
+            # there was I/O since the timer was set - wait for the rest
+            self.__arm_idle_timer(probe)
+            return
+
+        if probe.is_connecting:
+            probe.heimtest.handle_error("Timed out while connecting")
+        else:
+            probe.heimtest.process_idle()
+
+        self.__reset_idle_timer(probe)
+        self.__maybe_done(probe)
+
+    def __on_deadline(self, probe):
+        probe.deadline_timer = None
+        probe.heimtest.handle_error("Probe timed out after %d secs" % probe.heimtest.PROBE_TIMEOUT_SECS)
+        self.__maybe_done(probe)
+
+    def __reset_idle_timer(self, probe):
+        # only the deadline moves on every I/O event; __on_idle re-arms the
+        # timer lazily (unless the deadline moved closer, e.g., a shorter
+        # idle timeout in the new state)
+        probe.ts_idle = monotonic() + probe.heimtest.idle_timeout()
+        if probe.idle_timer and probe.idle_timer.deadline > probe.ts_idle:
+            probe.idle_timer.cancel()
+            probe.idle_timer = None
+        if probe.idle_timer is None:
+            self.__arm_idle_timer(probe)
+
+    def __arm_idle_timer(self, probe):
+        probe.idle_timer = self.call_later(probe.ts_idle - monotonic(), lambda: self.__on_idle(probe))
+
+    def __maybe_done(self, probe):
+        if probe.is_connecting:
+            # not connected yet - only done if connecting failed
+            is_done = probe.heimtest.result.is_error
+        else:
+            is_done = not probe.heimtest.is_connected()
+
+        if not is_done or self.__probes.get(probe.fd) is not probe:
+            return
+
+        # the socket is closed by now - forget about its fd before anything
+        # (e.g., the next probe) gets the chance to reuse it
+        del self.__probes[probe.fd]
+        self.__selector.unregister(probe.fd)
+        for timer in (probe.idle_timer, probe.deadline_timer):
+            if timer:
+                timer.cancel()
+
+        probe.done_func(probe.heimtest)
+
+
+class _Probe(object):
+    """Book-keeping for a single HeimdallTest owned by ProbeMultiplexer"""
+    __slots__ = ('heimtest', 'done_func', 'fd', 'is_connecting', 'idle_timer', 'ts_idle', 'deadline_timer')
+
+    def __init__(self, heimtest, done_func):
+        self.heimtest = heimtest
+        self.done_func = done_func
+        self.fd = -1
+        self.is_connecting = True
+        self.idle_timer = None
+        self.ts_idle = 0.0
+        self.deadline_timer = None
@@ -2,21 +2,40 @@
 #
 # Furcadia `which string parsing component: helps parsing Furcadia-style `which
 # lines and extracting information from within them as objects
+# (the slotted component records of heimon/results.py)
 #
 # Version: 20160408-2325
 # Author:  Artex / IceDragon <artex@furcadia.com>
 
 import re
 
+from time import perf_counter
+from heimon.results import HeimdallInfo, HortonInfo, TribbleInfo
+from heimon.profiling import COUNTERS
 
-RE_HEIMDALL = re.compile(
-    b"""^\\(<img src='fsh://system.fsh:86' /> You are connected to Heimdall \\[(\d+):(\d+)\\] \\(QTEMP (\d+)\\)\\. There are (\d+) players on this Heimdall, of which you are player index (\d+) with globalid (\d+), and you are on map (\d+)""")
 
-RE_HORTON = re.compile(
-    b"""^\\(<img src='fsh://system.fsh:86' /> You are connected to Horton \\[(.*):(\d+)\\] \\(QTEMP (\d+)\\)\\. There are (\d+) players in this horton, of which you are the player index (\d+) with global id (\d+)\\. It's a beautiful day in Gosford Park. Horton is running version: (\w*)""")
+# every `which line starts with this - anything else is rejected right away
+WHICH_PREFIX = b"(<img src='fsh://system.fsh:86' /> You are connected to "
+WHICH_PREFIX_LEN = len(WHICH_PREFIX)
 
-RE_TRIBBLE = re.compile(
-    b"""^\\(<img src='fsh://system.fsh:86' /> You are connected to tribble \\[(\d+)\\] \\(QTEMP <b>(\d+)</b>\\)\\. There are (\d+) players on this tribble, of which you are player index (\d+) with global id (\d+)\\. You are exactly at \\((\d+),(\d+)\\)\\. This tribble feels like (.*) and is running version: (\w*)""")
+RE_HEIMDALL_TAIL = re.compile(
+    b"""Heimdall \\[(\d+):(\d+)\\] \\(QTEMP (\d+)\\)\\. There are (\d+) players on this Heimdall, of which you are player index (\d+) with globalid (\d+), and you are on map (\d+)""")
+
+RE_HORTON_TAIL = re.compile(
+    b"""Horton \\[(.*):(\d+)\\] \\(QTEMP (\d+)\\)\\. There are (\d+) players in this horton, of which you are the player index (\d+) with global id (\d+)\\. It's a beautiful day in Gosford Park. Horton is running version: (\w*)""")
+
+RE_TRIBBLE_TAIL = re.compile(
+    b"""tribble \\[(\d+)\\] \\(QTEMP <b>(\d+)</b>\\)\\. There are (\d+) players on this tribble, of which you are player index (\d+) with global id (\d+)\\. You are exactly at \\((\d+),(\d+)\\)\\. This tribble feels like (.*) and is running version: (\w*)""")
+
+# full-line expressions (prefix included)
+RE_HEIMDALL = re.compile(b"^" + re.escape(WHICH_PREFIX) + RE_HEIMDALL_TAIL.pattern)
+RE_HORTON = re.compile(b"^" + re.escape(WHICH_PREFIX) + RE_HORTON_TAIL.pattern)
+RE_TRIBBLE = re.compile(b"^" + re.escape(WHICH_PREFIX) + RE_TRIBBLE_TAIL.pattern)
+
+
+def to_value(d):
+    """Convert a matched group: numbers to int, anything else to str"""
+    return int(d) if d.isdigit() else d.decode('utf-8')
 
 
 class WhichStringParser(object):
@@ -27,72 +46,64 @@ class WhichStringParser(object):
 
         # activate success_callback with the extracted expression data
         if is_success and success_callback:
-            success_callback(
-                tuple(map(
-                    lambda d: int(d) if d.isdigit() else d.decode('utf-8'),
-                    result[0])))
+            success_callback(tuple(map(to_value, result[0])))
 
         # return if matched or not
         return is_success
 
     @staticmethod
     def parse_heimdall(data):
-        (port, heimdall_id, qtemp, h_players, h_my_index, global_id, tribble_id) = data
-        return {
-            'type': 'heimdall',
-            'id': heimdall_id,
-            'port': port,
-            'qtemp': qtemp,
-            'num_players': h_players,
-            'my': {
-                'player_index': h_my_index,
-                'global_id': global_id,
-                'tribble_id': tribble_id
-            }
-        }
+        return HeimdallInfo(*data)
 
     @staticmethod
     def parse_horton(data):
-        (h_addr, h_port, qtemp, num_players, my_player_index, my_global_id, version) = data
-        return {
-            'type': 'horton',
-            'address': (h_addr, h_port),
-            'qtemp': qtemp,
-            'version': version,
-            'num_players': num_players,
-            'my': {
-                'player_index': my_player_index,
-                'global_id': my_global_id
-            }
-        }
+        return HortonInfo(*data)
 
     @staticmethod
     def parse_tribble(data):
-        (tribble_id, qtemp, num_players, my_player_index, my_global_id, coord_x, coord_y, map_id, version) = data
-        return {
-            'type': 'tribble',
-            'id': tribble_id,
-            'qtemp': qtemp,
-            'version': version,
-            'map': map_id,
-            'num_players': num_players,
-            'my': {
-                'player_index': my_player_index,
-                'global_id': my_global_id,
-                'coords': (coord_x, coord_y)
-            }
-        }
+        return TribbleInfo(*data)
+
+    @staticmethod
+    def classify(line):
+        """Parse a single line; returns its component record or None if it's not a `which line"""
+        if not line.startswith(WHICH_PREFIX):
+            return None
+
+        # only `which lines are timed - the rest are rejected too cheaply to be worth it
+        ts_start = perf_counter()
+        result = WhichStringParser.__parse_which(line)
+        COUNTERS.add('WhichStringParser.parse', perf_counter() - ts_start)
+        return result
+
+    @staticmethod
+    def __parse_which(line):
+        # the 2nd letter of the component name tells them apart: H(e)imdall, H(o)rton, t(r)ibble
+        handler = COMPONENT_HANDLERS.get(line[WHICH_PREFIX_LEN + 1:WHICH_PREFIX_LEN + 2])
+        if handler is None:
+            return None
+
+        (expression, parse_func) = handler
+        match = expression.match(line, WHICH_PREFIX_LEN)
+        return parse_func(match.groups()) if match else None
 
     @staticmethod
     def parse(line, callback=lambda data: None):
-        handlers = {
-            RE_HEIMDALL: WhichStringParser.parse_heimdall,
-            RE_HORTON: WhichStringParser.parse_horton,
-            RE_TRIBBLE: WhichStringParser.parse_tribble,
-        }
-
-        for expression in handlers.keys():
-            parse_func = handlers[expression]
-            if WhichStringParser.try_handle(line, expression, lambda data: callback(parse_func(data))):
-                return True
-        return False
+        result = WhichStringParser.classify(line)
+        if result is None:
+            return False
+
+        callback(result)
+        return True
+
+
+# discriminating letter -> (expression matched past the prefix, record builder)
+COMPONENT_HANDLERS = {
+    b'e': (RE_HEIMDALL_TAIL,
+           lambda g: HeimdallInfo(*map(int, g))),
+    b'o': (RE_HORTON_TAIL,
+           lambda g: HortonInfo(to_value(g[0]), int(g[1]), int(g[2]), int(g[3]), int(g[4]), int(g[5]),
+                                to_value(g[6]))),
+    b'r': (RE_TRIBBLE_TAIL,
+           lambda g: TribbleInfo(int(g[0]), int(g[1]), int(g[2]), int(g[3]), int(g[4]), int(g[5]), int(g[6]),
+                                 to_value(g[7]), to_value(g[8]))),
+}
@@ -0,0 +1,194 @@
+# Profiling Component - Project Heimon
+#
+# Looks inside a running monitor without stopping it (and losing the tracker
+# state): always-on call counters for the hot spots (reading and processing
+# probe data, `which parsing, each result test) and an on-demand profiler that
+# captures cProfile stats and tracemalloc snapshots for a number of probe
+# cycles and dumps them to disk. The profiler is armed by a signal or over a control socket and
+# costs a single attribute check per cycle while it is not.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import cProfile
+import io
+import os
+import pstats
+import signal
+import socketserver
+import threading
+import tracemalloc
+
+from time import perf_counter, strftime
+
+
+class Counters(object):
+    """
+    Call counters: name -> [calls, total secs, max secs]. Cheap enough to be
+    always on (updates are not locked - a concurrent update may get lost now
+    and then, which is fine for what these are for).
+    """
+    def __init__(self):
+        self.__counters = {}
+
+    def add(self, name, elapsed):
+        counter = self.__counters.get(name)
+        if counter is None:
+            counter = self.__counters.setdefault(name, [0, 0.0, 0.0])
+        counter[0] += 1
+        counter[1] += elapsed
+        if elapsed > counter[2]:
+            counter[2] = elapsed
+
+    def snapshot(self):
+        """[(name, calls, total secs, max secs), ...] sorted by total time"""
+        rows = [(name, calls, total, slowest) for (name, (calls, total, slowest)) in list(self.__counters.items())]
+        return sorted(rows, key=lambda row: -row[2])
+
+    def reset(self):
+        self.__counters = {}
+
+    def report(self):
+        lines = ["%-44s %10s %12s %10s %10s" % ("counter", "calls", "total secs", "avg usecs", "max usecs")]
+        for (name, calls, total, slowest) in self.snapshot():
+            lines.append("%-44s %10d %12.3f %10.1f %10.1f" % (name, calls, total, total / calls * 1e6, slowest * 1e6))
+        return "\n".join(lines)
+
+
+# the process-wide counters the hooks in core/parsers/tests update
+COUNTERS = Counters()
+
+
+class Profiler(object):
+    """
+    Captures cProfile stats and tracemalloc snapshots for `num_cycles` probe
+    cycles once requested. request() may be called from anywhere (a signal
+    handler, another thread); the capture itself starts and stops in cycle(),
+    which the monitor calls after every batch of results, so the profiled
+    thread is always the one driving the probes.
+    """
+    def __init__(self, output_dir, num_cycles=100, log_func=lambda message: None, frames=10):
+        self.output_dir = output_dir
+        self.num_cycles = num_cycles
+        self.log_func = log_func
+        self.frames = frames
+        self.__requested = None     # cycles to capture from the next cycle on (0: stop capturing)
+        self.__profile = None
+        self.__cycles_left = 0
+        self.__ts_started = None
+        self.__started_tracing = False
+
+    def is_active(self):
+        return self.__profile is not None
+
+    def request(self, num_cycles=None):
+        """Capture the next num_cycles (default: self.num_cycles) probe cycles"""
+        self.__requested = num_cycles or self.num_cycles
+
+    def cancel(self):
+        """Stop capturing at the end of the current cycle (dumping what was captured)"""
+        self.__requested = 0
+
+    def toggle(self):
+        if self.is_active():
+            self.cancel()
+        else:
+            self.request()
+
+    def cycle(self, num_cycles=1):
+        """Let the profiler know num_cycles probe cycles have completed"""
+        if self.__requested is None and self.__profile is None:
+            return
+
+        (requested, self.__requested) = (self.__requested, None)
+        if self.__profile is not None:
+            self.__cycles_left -= num_cycles
+            if self.__cycles_left <= 0 or requested == 0:
+                self.__stop()
+            elif requested:
+                self.__cycles_left = requested  # requested again while capturing: extend
+        elif requested:
+            self.__cycles_left = requested
+            self.__start()
+
+    def __start(self):
+        self.__ts_started = perf_counter()
+        self.__started_tracing = not tracemalloc.is_tracing()
+        if self.__started_tracing:
+            tracemalloc.start(self.frames)
+        self.__profile = cProfile.Profile()
+        self.__profile.enable()
+        self.log_func("Profiling the next %d probe cycles..." % self.__cycles_left)
+
+    def __stop(self):
+        self.__profile.disable()
+        (profile, self.__profile) = (self.__profile, None)
+        snapshot = tracemalloc.take_snapshot()
+        if self.__started_tracing:
+            tracemalloc.stop()
+        elapsed = perf_counter() - self.__ts_started
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, "heimon-%s-%d" % (strftime("%Y%m%d-%H%M%S"), os.getpid()))
+        profile.dump_stats(prefix + ".pstats")
+        snapshot.dump(prefix + ".tracemalloc")
+        with open(prefix + ".txt", "w") as fp:
+            fp.write(self.summary(profile, snapshot, elapsed))
+        self.log_func("Profile captured (%.1f secs) -> %s.{pstats,tracemalloc,txt}" % (elapsed, prefix))
+
+    @staticmethod
+    def summary(profile, snapshot, elapsed, limit=25):
+        """Human-readable digest of a capture: top functions, top allocation sites, counters"""
+        out = io.StringIO()
+        out.write("Captured %.1f secs\n\n" % elapsed)
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        out.write("\nTop allocation sites:\n")
+        for stat in snapshot.statistics('lineno')[:limit]:
+            out.write("  %s\n" % stat)
+        out.write("\n%s\n" % COUNTERS.report())
+        return out.getvalue()
+
+
+def install_signal(profiler, signame):
+    """Toggle the profiler whenever the process receives the named signal (e.g., "SIGUSR1")"""
+    signal.signal(getattr(signal, signame), lambda signum, frame: profiler.toggle())
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One command per line: "profile [cycles]", "stop", "counters" and
+    "reset" (the counters)
+    """
+    profiler = None
+
+    def handle(self):
+        for line in self.rfile:
+            words = line.decode('utf-8', 'replace').split()
+            if not words:
+                continue
+
+            (command, args) = (words[0].lower(), words[1:])
+            if command == 'profile':
+                cycles = int(args[0]) if args and args[0].isdigit() else None
+                self.profiler.request(cycles)
+                reply = "OK: profiling %d cycles" % (cycles or self.profiler.num_cycles)
+            elif command == 'stop':
+                self.profiler.cancel()
+                reply = "OK"
+            elif command == 'counters':
+                reply = COUNTERS.report()
+            elif command == 'reset':
+                COUNTERS.reset()
+                reply = "OK"
+            else:
+                reply = "ERROR: unknown command: %s" % command
+            self.wfile.write(bytes(reply + "\n", 'utf-8'))
+
+
+def serve_control(profiler, address):
+    """Accept control commands (see ControlRequestHandler) from a background thread; returns the server"""
+    handler = type('BoundControlRequestHandler', (ControlRequestHandler,), {'profiler': profiler})
+    server = socketserver.ThreadingTCPServer(address, handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="profiling-control", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,178 @@
+# Results Component - Project Heimon
+#
+# Compact records for everything a heimdall check produces: the `which
+# component records the parser builds straight from its matches and the
+# ProbeResult a HeimdallTest fills in. All of them use __slots__, so a result
+# kept around (in history, in flight between processes, ...) costs a fraction
+# of what the equivalent nested dicts did.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+from array import array
+
+
+class Record(object):
+    """Base of all slotted records: compares, hashes and prints field by field"""
+    __slots__ = ()
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self.fields()))
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class HeimdallInfo(Record):
+    """`which info about the heimdall we are connected to"""
+    __slots__ = ('port', 'id', 'qtemp', 'num_players', 'player_index', 'global_id', 'tribble_id')
+    type = 'heimdall'
+
+    def __init__(self, port, id, qtemp, num_players, player_index, global_id, tribble_id):
+        self.port = port
+        self.id = id
+        self.qtemp = qtemp
+        self.num_players = num_players
+        self.player_index = player_index
+        self.global_id = global_id
+        self.tribble_id = tribble_id
+
+
+class HortonInfo(Record):
+    """`which info about the horton we are connected to"""
+    __slots__ = ('host', 'port', 'qtemp', 'num_players', 'player_index', 'global_id', 'version')
+    type = 'horton'
+
+    def __init__(self, host, port, qtemp, num_players, player_index, global_id, version):
+        self.host = host
+        self.port = port
+        self.qtemp = qtemp
+        self.num_players = num_players
+        self.player_index = player_index
+        self.global_id = global_id
+        self.version = version
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+
+class TribbleInfo(Record):
+    """`which info about the tribble we are on"""
+    __slots__ = ('id', 'qtemp', 'num_players', 'player_index', 'global_id', 'x', 'y', 'map', 'version')
+    type = 'tribble'
+
+    def __init__(self, id, qtemp, num_players, player_index, global_id, x, y, map, version):
+        self.id = id
+        self.qtemp = qtemp
+        self.num_players = num_players
+        self.player_index = player_index
+        self.global_id = global_id
+        self.x = x
+        self.y = y
+        self.map = map
+        self.version = version
+
+    @property
+    def coords(self):
+        return (self.x, self.y)
+
+
+# all timing events, in the order Timing stores them
+TIMING_EVENTS = ('connect', 'usercount', 'dragonroar', 'auth',
+                 'which.heimdall', 'which.horton', 'which.tribble', 'which', 'close')
+TIMING_INDEX = dict((event, idx) for (idx, event) in enumerate(TIMING_EVENTS))
+
+NOT_RECORDED = float('nan')
+
+
+class Timing(Record):
+    """
+    When each event of a check happened (secs since connecting began), packed
+    into a single array of doubles (NaN: not recorded). Reads like the
+    {event: secs} dict it replaces: `event in timing`, timing[event] and
+    timing.items().
+    """
+    __slots__ = ('values',)
+    __hash__ = None  # filled in as the check goes - unhashable on purpose
+
+    def __init__(self):
+        self.values = array('d', EMPTY_TIMING)
+
+    def fields(self):
+        return (self.items(),)
+
+    def __contains__(self, event):
+        idx = TIMING_INDEX.get(event)
+        return idx is not None and self.values[idx] == self.values[idx]  # NaN != NaN
+
+    def __getitem__(self, event):
+        value = self.values[TIMING_INDEX[event]]
+        if value != value:
+            raise KeyError(event)
+        return value
+
+    def __setitem__(self, event, value):
+        self.values[TIMING_INDEX[event]] = value
+
+    def get(self, event, default=None):
+        return self[event] if event in self else default
+
+    def items(self):
+        return [(event, value) for (event, value) in zip(TIMING_EVENTS, self.values) if value == value]
+
+
+EMPTY_TIMING = array('d', [NOT_RECORDED] * len(TIMING_EVENTS))
+
+
+class ProbeResult(Record):
+    """Everything a single heimdall check found out"""
+    __slots__ = ('character', 'usercount', 'usercount_max', 'heimdall', 'horton', 'tribble', 'which_delay',
+                 'is_error', 'error_msg', 'error_state', 'is_rejected', 'timing')
+    __hash__ = None  # filled in as the check goes - unhashable on purpose
+
+    def __init__(self, character=None):
+        self.character = character
+        self.usercount = None      # current user count (None until received)
+        self.usercount_max = None
+        self.heimdall = None       # HeimdallInfo (None until received)
+        self.horton = None         # HortonInfo
+        self.tribble = None        # TribbleInfo
+        self.which_delay = -1      # secs it took to receive the whole `which response
+        self.is_error = False
+        self.error_msg = "(no error)"
+        self.error_state = None
+        self.is_rejected = False
+        self.timing = Timing()
+
+    @property
+    def heimdall_id(self):
+        return None if self.heimdall is None else self.heimdall.id
+
+    def components(self):
+        """All `which component records received so far"""
+        return [component for component in (self.heimdall, self.horton, self.tribble) if component is not None]
+
+    def is_which_complete(self):
+        return self.heimdall is not None and self.horton is not None and self.tribble is not None
+
+    def clear_which(self):
+        """Forget the `which response (e.g., before issuing another one)"""
+        self.heimdall = self.horton = self.tribble = None
+        self.which_delay = -1
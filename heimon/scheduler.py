@@ -0,0 +1,259 @@
+# Scheduler Component - Project Heimon
+#
+# Which heimdall a login lands on is outside our control, so making sure each
+# of them gets seen is a coupon-collector problem. CoverageScheduler learns the
+# landing distribution and picks the probe rate needed to see every heimdall
+# within `window` secs with the requested confidence, reporting the detection
+# latency actually achieved along the way.
+#
+# RateController sits between that (or any other base rate) and the probes:
+# it speeds probing up while tests are failing so incidents get confirmed
+# sooner, slows it down when connect/auth errors hint at an overloaded server
+# and lets both decay back to the base rate. A TokenBucket caps logins/sec no
+# matter what, so the monitor itself never becomes a load problem.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+from collections import deque
+from math import ceil
+from time import monotonic
+
+
+def coverage_probability(probabilities, num_probes):
+    """Probability that num_probes probes land on every heimdall at least once"""
+    result = 1.0
+    for p in probabilities:
+        result *= 1.0 - (1.0 - p) ** num_probes
+    return result
+
+
+def probes_for_coverage(probabilities, confidence, max_probes=1000000):
+    """Smallest amount of probes that see every heimdall with the given confidence"""
+    (lo, hi) = (1, 1)
+    while coverage_probability(probabilities, hi) < confidence:
+        if hi >= max_probes:
+            return max_probes
+        (lo, hi) = (hi, min(hi * 2, max_probes))
+
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if coverage_probability(probabilities, mid) < confidence:
+            lo = mid + 1
+        else:
+            hi = mid
+    return hi
+
+
+class CoverageScheduler(object):
+    """
+    Paces probe starts so that every heimdall is observed within `window` secs
+    with probability `confidence`. Probe engines call reserve() before starting
+    a probe (and wait for as long as it says) and observe() with its result.
+    """
+    # landing counts are halved past this total so the distribution can drift
+    MAX_TOTAL_COUNT = 2000
+
+    # how often (in observed results) the rate is recalculated
+    RECALC_EVERY = 10
+
+    # a heimdall unseen for so long that P(unseen | alive) drops below this is
+    # "suspicious" and the rate is boosted to confirm (or clear) it sooner
+    SUSPICION_LEVEL = 0.05
+
+    def __init__(self, heimdall_ids, window=60.0, confidence=0.99,
+                 min_rate=0.05, max_rate=2.0, suspicion_boost=2.0):
+        self.window = window
+        self.confidence = confidence
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.suspicion_boost = suspicion_boost
+
+        self.__counts = dict((h_id, 0.0) for h_id in heimdall_ids)
+        self.__total = 0.0
+        self.__num_probes = 0
+        self.__probe_last_seen = dict((h_id, 0) for h_id in heimdall_ids)
+        self.__completions = deque()
+        self.__duration = None  # EWMA of probe duration (secs)
+        self.__ts_next_start = monotonic()
+        self.__required_probes = None
+        self.__suspicious = []
+        self.__rate = max_rate  # start fast until the distribution is known
+        self.__num_since_recalc = 0
+
+    def rate(self):
+        return self.__rate
+
+    def reserve(self):
+        """Claim the next probe start slot; returns how many secs to wait for it"""
+        now = monotonic()
+        ts_start = max(now, self.__ts_next_start)
+        self.__ts_next_start = ts_start + 1.0 / self.__rate
+        return ts_start - now
+
+    def observe(self, result):
+        """Learn from a finished probe's result"""
+        now = monotonic()
+        self.__num_probes += 1
+        self.__completions.append(now)
+        while self.__completions and self.__completions[0] < now - self.window:
+            self.__completions.popleft()
+
+        if 'close' in result.timing:
+            duration = result.timing['close']
+            self.__duration = duration if self.__duration is None else 0.9 * self.__duration + 0.1 * duration
+
+        if result.heimdall is not None:
+            h_id = result.heimdall.id
+            self.__counts[h_id] = self.__counts.get(h_id, 0.0) + 1.0
+            self.__probe_last_seen[h_id] = self.__num_probes
+            self.__total += 1.0
+            if self.__total > self.MAX_TOTAL_COUNT:
+                for key in self.__counts:
+                    self.__counts[key] /= 2.0
+                self.__total /= 2.0
+
+        self.__num_since_recalc += 1
+        if self.__num_since_recalc >= self.RECALC_EVERY:
+            self.recalculate()
+
+    def probabilities(self):
+        """Estimated landing probability of each heimdall (Laplace-smoothed)"""
+        num = len(self.__counts)
+        return dict((h_id, (count + 1.0) / (self.__total + num))
+                    for (h_id, count) in self.__counts.items())
+
+    def recalculate(self):
+        self.__num_since_recalc = 0
+        probabilities = self.probabilities()
+        if not probabilities:
+            return
+
+        self.__required_probes = probes_for_coverage(probabilities.values(), self.confidence)
+        rate = self.__required_probes / self.window
+
+        # P(not seen in k probes | alive) = (1 - p)^k
+        self.__suspicious = [h_id for (h_id, p) in probabilities.items()
+                             if 1.0 - self.confidence < (1.0 - p) ** self.probes_since_seen(h_id) < self.SUSPICION_LEVEL]
+        if self.__suspicious:
+            rate *= self.suspicion_boost
+
+        self.__rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def probes_since_seen(self, h_id):
+        return self.__num_probes - self.__probe_last_seen.get(h_id, 0)
+
+    def actual_rate(self):
+        """Probes completed per second over the last window"""
+        return len(self.__completions) / self.window
+
+    def detection_latency(self):
+        """
+        Secs it takes (at the actual probe rate) to see every live heimdall with
+        the requested confidence, i.e., how long a silent one can go unnoticed.
+        """
+        rate = self.actual_rate()
+        probabilities = self.probabilities()
+        if rate <= 0 or not probabilities:
+            return None
+        return probes_for_coverage(probabilities.values(), self.confidence) / rate
+
+    def concurrency_needed(self, rate=None):
+        """Probes that have to be in flight at once to sustain `rate` probes/sec (default: rate())"""
+        rate = self.__rate if rate is None else rate
+        return max(1, int(ceil(rate * self.__duration))) if self.__duration else 1
+
+    def report(self):
+        probabilities = self.probabilities()
+        rate = self.actual_rate()
+        duration = self.__duration or 0.0
+        return {
+            'target_window': self.window,
+            'confidence': self.confidence,
+            'rate': self.__rate,
+            'actual_rate': rate,
+            'required_probes': self.__required_probes,
+            'detection_latency': self.detection_latency(),
+            'concurrency_needed': self.concurrency_needed(),
+            'suspicious': list(self.__suspicious),
+            'expected_gap': dict((h_id, 1.0 / (p * rate) if rate > 0 else None)
+                                 for (h_id, p) in probabilities.items()),
+        }
+
+
+class TokenBucket(object):
+    """Allows `rate` events/sec on average with bursts of up to `burst` events"""
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__ts = monotonic()
+
+    def reserve(self, now=None):
+        """Take a token; returns how many secs after `now` it may be used"""
+        now = monotonic() if now is None else now
+        if now > self.__ts:
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__ts) * self.rate)
+            self.__ts = now
+
+        self.__tokens -= 1.0
+        return 0.0 if self.__tokens >= 0 else -self.__tokens / self.rate
+
+
+class RateController(object):
+    """
+    Paces probe starts at base_rate_func() probes/sec scaled by a factor that
+    grows (boost_factor per result) while tests are failing, shrinks
+    (backoff_factor per result) on errors hinting at server overload and
+    decays back to 1.0 with the given half-life. Every start also takes a
+    token from `bucket`, which has the final say.
+    """
+    # states a probe failing in suggests the server is struggling to serve logins
+    OVERLOAD_STATES = ('NullState', 'DragonroarState', 'AuthState')
+
+    def __init__(self, base_rate_func, bucket, boost_factor=2.0, max_boost=4.0,
+                 backoff_factor=0.5, min_factor=0.125, half_life=120.0, backoff_hold=60.0):
+        self.base_rate_func = base_rate_func
+        self.bucket = bucket
+        self.boost_factor = boost_factor
+        self.max_boost = max_boost
+        self.backoff_factor = backoff_factor
+        self.min_factor = min_factor
+        self.half_life = half_life
+        self.backoff_hold = backoff_hold  # no boosting for so long after a backoff
+        self.__factor = 1.0
+        self.__ts_factor = monotonic()
+        self.__ts_backoff = None
+        self.__ts_next_start = monotonic()
+
+    def factor(self, now=None):
+        """Current rate multiplier (decayed up to `now`)"""
+        now = monotonic() if now is None else now
+        elapsed = now - self.__ts_factor
+        if elapsed > 0:
+            self.__factor = 1.0 + (self.__factor - 1.0) * 0.5 ** (elapsed / self.half_life)
+            self.__ts_factor = now
+        return self.__factor
+
+    def rate(self, now=None):
+        return self.base_rate_func() * self.factor(now)
+
+    def is_overload_error(self, result):
+        return result.is_error and not result.is_rejected and result.error_state in self.OVERLOAD_STATES
+
+    def observe(self, result, is_failing, now=None):
+        """Adjust the rate to a finished probe's result (and whether any test is failing)"""
+        now = monotonic() if now is None else now
+        factor = self.factor(now)
+        if self.is_overload_error(result):
+            self.__factor = max(self.min_factor, min(1.0, factor) * self.backoff_factor)
+            self.__ts_backoff = now
+        elif is_failing and (self.__ts_backoff is None or now - self.__ts_backoff >= self.backoff_hold):
+            self.__factor = min(self.max_boost, max(1.0, factor) * self.boost_factor)
+
+    def reserve(self):
+        """Claim the next probe start slot; returns how many secs to wait for it"""
+        now = monotonic()
+        ts_start = max(now, self.__ts_next_start)
+        ts_start += self.bucket.reserve(ts_start)
+        self.__ts_next_start = ts_start + 1.0 / self.rate(now)
+        return ts_start - now
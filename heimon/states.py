@@ -13,6 +13,13 @@ from time import time
 
 class State(object):
     """Generic HeimdallTest state"""
+
+    # timing event the HeimdallTest records upon entering this state
+    EVENT = None
+
+    # how long to wait for data before idle() is called (None: I/O timeout)
+    IDLE_SECS = None
+
     def __init__(self, test):
         self.heimtest = test
 
@@ -49,6 +56,8 @@ class DragonroarState(State):
         Looks for user count info and Dragonroar in order to move on to the
         next (AUTH) stage
     """
+    EVENT = 'connect'
+
     def __init__(self, test, creds):
         State.__init__(self, test)
         self.__creds = creds
@@ -84,6 +93,8 @@ class AuthState(State):
         Sends login request to the server and awaits confirmation/rejection
         before determining further action
     """
+    EVENT = 'dragonroar'
+
     @staticmethod
     def sanitize_creds(creds):
         """
@@ -121,13 +132,15 @@ class AuthState(State):
         # process rejection notice
         if line.startswith(b']#'):
             error_msg = line.split(b' ', 2)[2].decode("utf-8")
-            self.heimtest.handle_error(error_msg)
+            self.heimtest.handle_rejected(error_msg)
 
         elif line == b'&&&&&&&&&&&&&':
-            self.heimtest.change_state(WhichTestState(self.heimtest))
+            self.heimtest.change_state(self.heimtest.make_which_state())
 
 
 class WhichTestState(State):
+    EVENT = 'auth'
+
     MAX_WHICH_LINES = 3
     WHICH_TIMEOUT_SECS = 5
 
@@ -135,7 +148,7 @@ class WhichTestState(State):
         State.__init__(self, test)
         self.__parser = WhichStringParser()
         self.__success_counter = 0
-        self.__which_ts = time()
+        self.__which_ts = None
 
     def __str__(self):
         return WhichTestState.__name__
@@ -143,15 +156,15 @@ class WhichTestState(State):
     def enter(self):
         State.enter(self)
         self.__success_counter = 0
+        self.__which_ts = time()
         self.heimtest.send("which\n")
 
     def process(self, line):
         State.process(self, line)
 
-        def callback(result):
+        result = self.__parser.classify(line)
+        if result is not None:
             self.heimtest.handle_which_result(result)
-
-        if self.__parser.parse(line, callback):
             self.__success_counter += 1
 
         # bail out if we have 3 `which lines parsed
@@ -176,7 +189,69 @@ class WhichTestState(State):
         return is_timeout
 
 
+class WhichLoopState(State):
+    """ Persistent `which State:
+        Keeps re-issuing `which every `interval` secs over the same connection,
+        reporting each round-trip as a sample and every response that takes
+        longer than `stall_secs` as a stall (after which it starts over).
+    """
+    EVENT = 'auth'
+
+    MAX_WHICH_LINES = 3
+
+    def __init__(self, test, interval=1.0, stall_secs=5.0):
+        State.__init__(self, test)
+        self.__parser = WhichStringParser()
+        self.__interval = interval
+        self.__stall_secs = stall_secs
+        self.__success_counter = 0
+        self.__which_ts = None
+        self.__is_pending = False
+        self.IDLE_SECS = min(interval, stall_secs) / 4.0
+
+    def __str__(self):
+        return WhichLoopState.__name__
+
+    def enter(self):
+        State.enter(self)
+        self.__send_which()
+
+    def process(self, line):
+        State.process(self, line)
+
+        result = self.__parser.classify(line)
+        if result is not None and self.__is_pending:
+            self.heimtest.handle_which_result(result)
+            self.__success_counter += 1
+            if self.__success_counter >= self.MAX_WHICH_LINES:
+                self.__is_pending = False
+                self.heimtest.handle_which_sample(time() - self.__which_ts)
+
+        self.__tick()
+
+    def idle(self):
+        # called several times per interval - no need to announce it
+        self.__tick()
+
+    def __tick(self):
+        elapsed = time() - self.__which_ts
+        if self.__is_pending and elapsed > self.__stall_secs:
+            self.__is_pending = False
+            self.heimtest.handle_which_stall(elapsed, self.__success_counter)
+            self.__send_which()
+        elif not self.__is_pending and elapsed >= self.__interval:
+            self.__send_which()
+
+    def __send_which(self):
+        self.__success_counter = 0
+        self.__is_pending = True
+        self.__which_ts = time()
+        self.heimtest.send("which\n")
+
+
 class ClosingState(State):
+    EVENT = 'which'
+
     def __init__(self, test):
         State.__init__(self, test)
 
@@ -189,5 +264,7 @@ class ClosingState(State):
 
 
 class ClosedState(NullState):
+    EVENT = 'close'
+
     def __str__(self):
         return ClosedState.__name__
@@ -3,39 +3,154 @@
 # Contains all the available tests that can be performed every cycle against
 # the incoming results from HeimdallTest class and in general
 #
+# Each test declares the result fields it needs (REQUIRES) and the tests that
+# have to pass before it makes sense (DEPENDS). TestRunner compiles them into
+# an evaluation plan once and then runs every test whose inputs are there.
+#
 # Version: 20160409-0000
 # Author:  Artex / IceDragon <artex@furcadia.com>
 
-from time import time
+from time import time, perf_counter
+from heimon.alerts import AlertEngine, AlertKey
+from heimon.profiling import COUNTERS
+
+
+# outcome of each test in an evaluation
+PASSED = True
+FAILED = False
+SKIPPED = None
 
 
 class TestRunner(object):
-    """Responsible for building and running all the tests against a given result"""
-    def __init__(self, test_classes, alert_func, log_func):
+    """
+    Responsible for building and running all the tests against given results.
+
+    The tests are compiled into a plan once: ordered so that every test comes
+    after the ones it DEPENDS on (otherwise keeping the given order) along with
+    what it REQUIRES. A test is skipped when a required result field is absent
+    (None) or a test it depends on did not pass - every other test runs.
+    """
+    def __init__(self, test_classes, alert_func, log_func, alert_window=300, event_func=None):
         self.config = {}
 
+        # repeated alert conditions are coalesced here (see Test.raise_alert)
+        self.config['alert_engine'] = AlertEngine(alert_func, alert_window, event_func)
+
         # pre-build all the objects from the test classes and
         # store them for later use by test() method
         self.tests = list(map(lambda tc: tc(alert_func, log_func, self.config), test_classes))
+        self.plan = self.compile(self.tests)
+
+    @staticmethod
+    def compile(tests):
+        """Return [(test, required fields, plan positions of its dependencies), ...]"""
+        by_name = dict((test.name(), test) for test in tests)
+        for test in tests:
+            for dependency in test.DEPENDS:
+                if dependency not in by_name:
+                    raise ValueError("%s depends on %s, which is not among the tests" % (test.name(), dependency))
+
+        ordered = []
+        visiting = set()
+
+        def visit(test):
+            if test in ordered:
+                return
+            if test in visiting:
+                raise ValueError("%s is part of a dependency cycle" % test.name())
+            visiting.add(test)
+            for dependency in test.DEPENDS:
+                visit(by_name[dependency])
+            visiting.discard(test)
+            ordered.append(test)
+
+        for test in tests:
+            visit(test)
+
+        positions = dict((test.name(), pos) for (pos, test) in enumerate(ordered))
+        return [(test, tuple(test.REQUIRES), tuple(positions[name] for name in test.DEPENDS))
+                for test in ordered]
 
     def test(self, result):
-        for test in self.tests:
-            # TEST TEST TEST TEST TESTITY TEST TEST... yeah...
-            # test = test.test(test={'test':test})  # test!
-            if not test.test(result):
-                break
+        """Run all applicable tests against a result; returns {test name: PASSED/FAILED/SKIPPED}"""
+        return self.test_batch([result])[0]
+
+    def test_batch(self, results):
+        """
+        Run all applicable tests against several results at once (test by test,
+        so that tests can handle the whole batch in one go - see Test.test_batch)
+        """
+        outcomes = [[SKIPPED] * len(self.plan) for result in results]
+        facts = [{} for result in results]
+        for (pos, (test, requires, dependencies)) in enumerate(self.plan):
+            applicable = [i for (i, result) in enumerate(results)
+                          if all(outcomes[i][dep] is PASSED for dep in dependencies)
+                          and all(getattr(result, field) is not None for field in requires)]
+            if not applicable:
+                continue
+
+            ts_start = perf_counter()
+            passed = test.test_batch([results[i] for i in applicable], [facts[i] for i in applicable])
+            COUNTERS.add(test.counter_name, perf_counter() - ts_start)
+            for (i, is_passed) in zip(applicable, passed):
+                outcomes[i][pos] = PASSED if is_passed else FAILED
+
+        return [dict((test.name(), outcome) for ((test, requires, dependencies), outcome) in zip(self.plan, row))
+                for row in outcomes]
 
 
 class Test(object):
     """Generic test"""
+    # result fields that must be present (not None) for this test to run
+    REQUIRES = ()
+
+    # names of the tests that have to pass before this one runs
+    DEPENDS = ()
+
     def __init__(self, alert_func, log_func, config):
         self.alert_func = alert_func
         self.log_func = log_func
         self.config = config
+        self.facts = {}  # what tests found out about the result being tested (see provide/fact)
+        self.counter_name = self.name() + '.test'  # see heimon.profiling.COUNTERS
+
+    @classmethod
+    def name(cls):
+        return cls.__name__
 
     def test(self, result):
         return True
 
+    def test_batch(self, results, facts):
+        """Test several results (each with its own facts); returns a pass/fail flag per result"""
+        passed = []
+        for (result, result_facts) in zip(results, facts):
+            self.facts = result_facts
+            passed.append(self.test(result))
+        return passed
+
+    def provide(self, name, value):
+        """Let the tests depending on this one know something about the result"""
+        self.facts[name] = value
+
+    def fact(self, name, default=None):
+        """Something a test this one depends on found out about the result"""
+        return self.facts.get(name, default)
+
+    def raise_alert(self, message, heimdall=None, component=None):
+        """Report an alert condition identified by this test, heimdall and component"""
+        key = AlertKey(self.__class__.__name__, heimdall, component)
+        self.config['alert_engine'].alert(key, message)
+
+    def clear_alert(self, heimdall=None, component=None):
+        """Report that an alert condition raised by this test is no longer present"""
+        key = AlertKey(self.__class__.__name__, heimdall, component)
+        self.config['alert_engine'].resolve(key)
+
+    def clear_all_alerts(self, heimdall=None):
+        """Report that no alert condition raised by this test (on a heimdall) is present"""
+        self.config['alert_engine'].resolve_matching(self.__class__.__name__, heimdall)
+
 
 class TestNoError(Test):
     """
@@ -46,10 +161,12 @@ class TestNoError(Test):
     unsifficient data for those...
     """
     def test(self, result):
-        if result['is_error']:
-            msg = result['error_msg']
-            self.alert_func("Heimdall check cycle failed: " + msg)
+        if result.is_error:
+            msg = result.error_msg
+            self.raise_alert("Heimdall check cycle failed: " + msg, component=result.error_state)
             return False
+
+        self.clear_all_alerts()
         return Test.test(self, result)
 
 
@@ -60,16 +177,21 @@ class TestUserCountPresent(Test):
     If this test trips, chances are the very first line the server sends us did
     not arrive and therefore, we might've not been able to get as far as AUTH.
     """
+    DEPENDS = ('TestNoError',)
+
     def test(self, result):
-        if not result['usercount']:
-            self.alert_func("User count not available - the server might not be responding!")
+        if result.usercount is None:
+            self.raise_alert("User count not available - the server might not be responding!")
             return False
+
+        self.clear_alert()
         return Test.test(self, result)
 
 
 class TestUserCountAboveThreshold(Test):
     """
-    Test that the current user count is above minimal threshold.
+    Test that the current user count is above minimal threshold (a percentage
+    of the maximum user count the server reports).
 
     If this test trips, there could be a significant amount of disconnections
     on the server.
@@ -77,11 +199,17 @@ class TestUserCountAboveThreshold(Test):
     Requirements:
       'usercount_threshold' configuration must be present!
     """
+    REQUIRES = ('usercount',)
+
     def test(self, result):
         if 'usercount_threshold' in self.config:
             threshold = self.config['usercount_threshold']
-            if result['usercount']['current'] <= threshold:
-                self.alert_func("User count not available - the server might not be responding!")
+            percent = 100.0 * result.usercount / result.usercount_max if result.usercount_max else 100.0
+            if percent <= threshold:
+                data = (result.usercount, result.usercount_max, percent, threshold)
+                self.raise_alert("User count too low: %d/%d (%.1f%% <= %.1f%%) - mass disconnection?" % data)
+            else:
+                self.clear_alert()
         else:
             self.alert_func("%s/BUG: usercount_threshold is not present!" % self.__class__)
 
@@ -93,22 +221,27 @@ class TestAllComponentsPresent(Test):
     Test that all the components (heimdall, horton, tribble) are detected.
     If this test trips, one of them may be disconnected from the system!
     """
+    DEPENDS = ('TestNoError',)
+
     def test(self, result):
         # heimdall should NEVER be missing from result at this stage!
         # if it is, then there's something screwy in the code...
-        if 'heimdall' not in result['which']:
+        if result.heimdall is None:
             self.alert_func("%s/BUG: 'heimdall' component is missing from result!" % self.__class__)
             return False
 
         proceed = True
+        h_id = result.heimdall.id
         for component in ['horton', 'tribble']:
-            if component not in result['which']:
+            if getattr(result, component) is None:
                 data = (component,
-                        result['which']['heimdall']['port'],
-                        result['which']['heimdall']['id'])
+                        result.heimdall.port,
+                        h_id)
 
-                self.alert_func("%s component missing from `which on heimdall %d:%d" % data)
+                self.raise_alert("%s component missing from `which on heimdall %d:%d" % data, h_id, component)
                 proceed = False
+            else:
+                self.clear_alert(h_id, component)
 
         return proceed and Test.test(self, result)
 
@@ -124,19 +257,57 @@ class TestWhichDelayAboveThreshold(Test):
     Requirements:
       'delay_threshold' configuration must be present!
     """
+    REQUIRES = ('heimdall',)
+    DEPENDS = ('TestAllComponentsPresent',)
+
     def test(self, result):
         if 'delay_threshold' in self.config:
             threshold = self.config['delay_threshold']
-            if result['which']['delay'] > threshold:
-                data = (result['which']['delay'], threshold)
-                self.alert_func("`which delay above threshold (%d > %d) - there might be lag!" % data)
+            h_id = result.heimdall.id
+            if result.which_delay > threshold:
+                data = (result.which_delay, threshold)
+                self.raise_alert("`which delay above threshold (%d > %d) - there might be lag!" % data, h_id)
                 return False
+            self.clear_alert(h_id)
         else:
             self.alert_func("%s/BUG: delay_threshold is not present!" % self.__class__)
 
         return Test.test(self, result)
 
 
+class TestNoAnomalies(Test):
+    """
+    Test the result's figures (user count, current/max user ratio, `which
+    delay, component qtemps) against their learned baselines.
+
+    If this test trips, a figure deviates from what is normal for it (at this
+    time of day) - e.g., lag or a mass disconnection.
+
+    Requirements:
+      'baselines' configuration must be present (heimon.baselines.AnomalyDetector)!
+    """
+    def test(self, result):
+        return self.test_batch([result], [self.facts])[0]
+
+    def test_batch(self, results, facts):
+        # scoring the whole batch at once is what the detector is built for
+        if 'baselines' not in self.config:
+            self.alert_func("%s/BUG: baselines is not present!" % self.__class__)
+            return [True] * len(results)
+
+        for scores in self.config['baselines'].check_results(results):
+            for score in scores:
+                if score.is_anomaly:
+                    where = "" if score.heimdall is None else " on heimdall %s" % score.heimdall
+                    data = (score.metric, where, score.value, score.expected, score.z)
+                    self.raise_alert("Anomalous %s%s: %.2f (expected ~%.2f, z=%+.1f)" % data,
+                                     score.heimdall, score.metric)
+                else:
+                    self.clear_alert(score.heimdall, score.metric)
+
+        return [True] * len(results)
+
+
 class TestGlobalIdInSync(Test):
     """
     Test that all the player's global ID values are in sync.
@@ -145,16 +316,21 @@ class TestGlobalIdInSync(Test):
     character among the components involved! This should, theoretically, never
     happen...
     """
+    REQUIRES = ('heimdall',)
+    DEPENDS = ('TestAllComponentsPresent',)
+
     def test(self, result):
-        heimdall = result['which']['heimdall']['my']['global_id']
-        horton = -1 if 'horton' not in result['which'] else result['which']['horton']['my']['global_id']
-        tribble = -1 if 'tribble' not in result['which'] else result['which']['tribble']['my']['global_id']
+        heimdall = result.heimdall.global_id
+        horton = -1 if result.horton is None else result.horton.global_id
+        tribble = -1 if result.tribble is None else result.tribble.global_id
         data = (heimdall, horton, tribble)
 
+        h_id = result.heimdall.id
         if not (data[0] == data[1] == data[2]):
-            self.alert_func("Player global ID desync: heim/%d hort/%d trib/%d" % data)
+            self.raise_alert("Player global ID desync: heim/%d hort/%d trib/%d" % data, h_id)
             return False
 
+        self.clear_alert(h_id)
         return Test.test(self, result)
 
 
@@ -165,67 +341,73 @@ class TestNoHeimdallsAreMissing(Test):
     If this test trips, there is a strong suspicion that said heimdalls are no
     longer handling connection as they should (i.e., frozen/dead)
 
+    Missing heimdalls are raised as separate alert conditions; seeing one again
+    resolves its condition (so there is no need for TestNoLongerMissingHeimdalls
+    alongside this test anymore).
+
     Requirements:
       'heimdall_tracker' configuration must be present!
-      'freshly_missing_threshold' configuration should be present!
+
+    Provides:
+      'missing_heimdalls' fact (the tracker's find_missing() list)
     """
+    REQUIRES = ('heimdall',)
+
     def test(self, result):
+        return self.test_batch([result], [self.facts])[0]
+
+    def test_batch(self, results, facts):
         if 'heimdall_tracker' not in self.config:
             self.alert_func("%s/BUG: heimdall_tracker is not present!" % self.__class__)
-            return False
+            return [False] * len(results)
 
-        if 'freshly_missing_threshold' not in self.config:
-            self.alert_func("%s/BUG: freshly_missing_threshold is not present!" % self.__class__)
-            freshly_missing_threshold = 60
-        else:
-            freshly_missing_threshold = self.config['freshly_missing_threshold']
-
-        # first, update the tracker with this result
+        # first, update the tracker with all the results
         tracker = self.config['heimdall_tracker']
         tracker.update_last_check()
-        tracker.update_heimdall(result['which']['heimdall']['id'])
+        for result in results:
+            tracker.update_heimdall(result.heimdall.id)
+            self.clear_alert(result.heimdall.id)
 
-        # now ask if anything's missing
+        # now ask (once) if anything's missing
         missing_heimdalls = tracker.find_missing()
-        self.config['missing_heimdalls'] = missing_heimdalls
-        for heimdall in missing_heimdalls:
-            h_id = heimdall['id']
-            h_data = tracker.get(h_id)
-
-            ts_reported_missing = heimdall['ts_reported_missing']
-            recently_reported = ts_reported_missing > 0 and \
-                                (time() - ts_reported_missing) < freshly_missing_threshold
-
-            if not recently_reported:
-                data = (h_id, time() - h_data['ts_last_seen'])
-                self.alert_func("Heimdall %s has been missing (last seen %.2f secs ago)" % data)
-            else:
-                self.log_func("Heimdall %s is still missing - still fresh; not re-announcing" % h_id)
+        for h_data in missing_heimdalls:
+            h_id = h_data['id']
+            data = (h_id, time() - max(h_data['ts_added'], h_data['ts_last_seen']))
+            self.raise_alert("Heimdall %s has been missing (last seen %.2f secs ago)" % data, h_id)
 
-        return Test.test(self, result)
+        for result_facts in facts:
+            result_facts['missing_heimdalls'] = missing_heimdalls
+        return [True] * len(results)
 
 
 class TestNoLongerMissingHeimdalls(Test):
     """
     A test that trips only if there are missing heimdalls that came back to life.
 
+    Superseded by the "RESOLVED" alerts TestNoHeimdallsAreMissing raises through
+    the alert engine; kept for setups that still list it.
+
     Requirements:
-      'missing_heimdalls' configuration should be present
-      'missing_heimdalls_old' configuration should be present (maintained by this test)
+      'missing_heimdalls' fact (provided by TestNoHeimdallsAreMissing)
     """
+    DEPENDS = ('TestNoHeimdallsAreMissing',)
+
+    def __init__(self, alert_func, log_func, config):
+        Test.__init__(self, alert_func, log_func, config)
+        self.missing_heimdalls_old = None
+
     def test(self, result):
         # note: we don't actually need the result here
-        if 'missing_heimdalls' in self.config:
-            if 'missing_heimdalls_old' in self.config:
-                currently_missing = self.config['missing_heimdalls']
-                previously_missing = self.config['missing_heimdalls_old']
+        missing_heimdalls = self.fact('missing_heimdalls')
+        if missing_heimdalls is not None:
+            if self.missing_heimdalls_old is not None:
+                currently_missing = [h['id'] for h in missing_heimdalls]
+                previously_missing = [h['id'] for h in self.missing_heimdalls_old]
                 for h_id in previously_missing:
                     if h_id not in currently_missing:
                         self.alert_func("Heimdall %s is no longer missing!" % h_id)
-            else:
-                self.log_func("%s: missing_heimdalls_old not found - skipping" % self.__class__)
 
-            self.config['missing_heimdalls_old'] = self.config['missing_heimdalls']
+            self.missing_heimdalls_old = missing_heimdalls
         else:
             self.log_func("%s: missing_heimdalls not found - test aborted" % self.__class__)
 
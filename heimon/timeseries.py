@@ -0,0 +1,200 @@
+# Time Series Component - Project Heimon
+#
+# A bounded, in-process time series store for HeimdallTest results. Every
+# series keeps its most recent raw samples in a ring buffer plus a few
+# downsampled levels (min/max/mean buckets) for older history, all stored in
+# compact typed arrays rather than lists of dicts.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+from array import array
+from time import time
+
+
+# (bucket width in secs, number of buckets) for each downsampled level
+DEFAULT_LEVELS = [
+    (60, 720),     # 1 min buckets for 12 hours
+    (600, 1008),   # 10 min buckets for a week
+    (3600, 1008),  # 1 hour buckets for 6 weeks
+]
+
+DEFAULT_RAW_CAPACITY = 1024
+
+
+class RingBuffer(object):
+    """Fixed-capacity ring of parallel typed arrays; the oldest rows get overwritten"""
+    def __init__(self, capacity, typecodes):
+        self.capacity = capacity
+        self.columns = [array(tc, [0]) * capacity for tc in typecodes]
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def index(self, i):
+        """Physical index of logical row i (0 = oldest; negative counts from the newest)"""
+        if i < 0:
+            i += self.size
+        return (self.start + i) % self.capacity
+
+    def append(self, *values):
+        if self.size < self.capacity:
+            idx = self.index(self.size)
+            self.size += 1
+        else:
+            idx = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        for (column, value) in zip(self.columns, values):
+            column[idx] = value
+        return idx
+
+    def bisect_left(self, column, value):
+        """Logical index of the first row whose `column` is >= value (column must be sorted)"""
+        data = self.columns[column]
+        (lo, hi) = (0, self.size)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[(self.start + mid) % self.capacity] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, lo, hi):
+        """Return logical rows [lo, hi) as tuples"""
+        return [tuple(column[(self.start + i) % self.capacity] for column in self.columns)
+                for i in range(lo, hi)]
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.columns)
+
+
+class Level(object):
+    """Downsampled history: fixed-width buckets of (start, min, max, sum, count)"""
+    TS, MIN, MAX, SUM, COUNT = range(5)
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.ring = RingBuffer(capacity, 'ddddI')
+
+    def add(self, ts, value):
+        bucket = ts - ts % self.width
+        ring = self.ring
+        if ring.size and ring.columns[self.TS][ring.index(-1)] == bucket:
+            idx = ring.index(-1)
+            columns = ring.columns
+            columns[self.MIN][idx] = min(columns[self.MIN][idx], value)
+            columns[self.MAX][idx] = max(columns[self.MAX][idx], value)
+            columns[self.SUM][idx] += value
+            columns[self.COUNT][idx] += 1
+        else:
+            ring.append(bucket, value, value, value, 1)
+
+    def oldest(self):
+        return self.ring.columns[self.TS][self.ring.index(0)] if self.ring.size else None
+
+    def query(self, ts_from, ts_to):
+        lo = self.ring.bisect_left(self.TS, ts_from - ts_from % self.width)
+        hi = self.ring.bisect_left(self.TS, ts_to)
+        return [(ts, v_min, v_max, v_sum / count)
+                for (ts, v_min, v_max, v_sum, count) in self.ring.rows(lo, hi)]
+
+
+class Series(object):
+    """A single metric: raw samples ring + downsampled levels"""
+    def __init__(self, raw_capacity=DEFAULT_RAW_CAPACITY, levels=DEFAULT_LEVELS):
+        self.raw = RingBuffer(raw_capacity, 'dd')
+        self.levels = [Level(width, capacity) for (width, capacity) in levels]
+
+    def __len__(self):
+        return len(self.raw)
+
+    def add(self, ts, value):
+        # results of concurrent probes may come in slightly out of order
+        if self.raw.size:
+            ts = max(ts, self.raw.columns[0][self.raw.index(-1)])
+
+        self.raw.append(ts, value)
+        for level in self.levels:
+            level.add(ts, value)
+
+    def last(self):
+        """Return the newest (timestamp, value) or None"""
+        if not self.raw.size:
+            return None
+        idx = self.raw.index(-1)
+        return (self.raw.columns[0][idx], self.raw.columns[1][idx])
+
+    def query(self, ts_from, ts_to=None):
+        """
+        Return (bucket width, [(ts, min, max, mean), ...]) for [ts_from, ts_to)
+        using the finest resolution that still covers ts_from (width 0 = raw).
+        """
+        ts_to = time() + 1 if ts_to is None else ts_to
+        raw = self.raw
+        if not raw.size or raw.columns[0][raw.index(0)] <= ts_from or not self.levels:
+            lo = raw.bisect_left(0, ts_from)
+            hi = raw.bisect_left(0, ts_to)
+            return (0, [(ts, value, value, value) for (ts, value) in raw.rows(lo, hi)])
+
+        for level in self.levels:
+            oldest = level.oldest()
+            if oldest is not None and oldest <= ts_from:
+                return (level.width, level.query(ts_from, ts_to))
+
+        level = self.levels[-1]
+        return (level.width, level.query(ts_from, ts_to))
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(level.ring.nbytes() for level in self.levels)
+
+
+class TimeSeriesStore(object):
+    """
+    All the series, keyed by (heimdall ID, metric name). Metrics that are not
+    tied to a single heimdall (e.g., the global usercount) use None as ID.
+    """
+    def __init__(self, raw_capacity=DEFAULT_RAW_CAPACITY, levels=DEFAULT_LEVELS):
+        self.__raw_capacity = raw_capacity
+        self.__levels = levels
+        self.__series = {}
+
+    def __len__(self):
+        return len(self.__series)
+
+    def keys(self):
+        return list(self.__series.keys())
+
+    def get(self, key):
+        return self.__series.get(key, None)
+
+    def add(self, key, value, ts=None):
+        series = self.__series.get(key)
+        if series is None:
+            series = self.__series[key] = Series(self.__raw_capacity, self.__levels)
+        series.add(time() if ts is None else ts, value)
+
+    def query(self, key, ts_from, ts_to=None):
+        series = self.__series.get(key)
+        return (0, []) if series is None else series.query(ts_from, ts_to)
+
+    def nbytes(self):
+        return sum(series.nbytes() for series in self.__series.values())
+
+    def record_result(self, result, ts=None):
+        """Extract all the metrics from a HeimdallTest result and store them"""
+        ts = time() if ts is None else ts
+        if result.usercount is not None:
+            self.add((None, 'usercount.current'), result.usercount, ts)
+            self.add((None, 'usercount.max'), result.usercount_max, ts)
+
+        if result.heimdall is None:
+            return
+
+        h_id = result.heimdall.id
+        self.add((h_id, 'which.delay'), result.which_delay, ts)
+        for component in result.components():
+            self.add((h_id, component.type + '.qtemp'), component.qtemp, ts)
+            self.add((h_id, component.type + '.num_players'), component.num_players, ts)
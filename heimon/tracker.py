@@ -0,0 +1,97 @@
+# Tracker Component - Project Heimon
+#
+# Keeps track of when each heimdall (or any other component ID) was last seen
+# and which of them went missing. Every sighting reschedules the ID's deadline
+# on a priority queue, so finding the missing ones only costs as much as the
+# number of deadlines that expired rather than a scan of everything tracked.
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+
+
+class HeimdallTracklist(object):
+    MISSING_THRESHOLD = 60  # secs
+
+    def __init__(self, heimdall_ids, missing_threshold=None, alert_func=None):
+        if missing_threshold is not None:
+            self.MISSING_THRESHOLD = missing_threshold
+
+        self.__alert_func = alert_func
+        self.__last_check = time()
+        self.__heimdalls = {}
+        self.__deadlines = []  # heap of (deadline, seq, heimdall_id)
+        self.__seq = count()
+        self.__missing = {}    # heimdall_id -> entry (in the order they went missing)
+        for hid in heimdall_ids:
+            self.add(hid)
+
+    def __len__(self):
+        return len(self.__heimdalls)
+
+    def add(self, heimdall_id, ts=None):
+        ts = time() if ts is None else ts
+        self.__heimdalls[heimdall_id] = {
+            'id': heimdall_id,
+            'ts_added': ts,
+            'ts_last_seen': 0,
+            'ts_reported_missing': 0,
+            'deadline': ts + self.MISSING_THRESHOLD
+        }
+        self.__schedule(heimdall_id)
+        return self
+
+    def get(self, heimdall_id):
+        return self.__heimdalls.get(heimdall_id, None)
+
+    def last_seen(self):
+        """Return [(heimdall_id, timestamp), ...] of when each heimdall was last seen (or added)"""
+        return [(h['id'], max(h['ts_added'], h['ts_last_seen'])) for h in list(self.__heimdalls.values())]
+
+    def find_missing(self, ts=None):
+        """Return a snapshot (list of dict copies) of all currently missing heimdalls"""
+        current_time = time() if ts is None else ts
+
+        # move everything whose (still valid) deadline expired to the missing set
+        deadlines = self.__deadlines
+        while deadlines and deadlines[0][0] < current_time:
+            (deadline, seq, h_id) = heappop(deadlines)
+            heimdall = self.__heimdalls.get(h_id)
+            if heimdall is None or heimdall['deadline'] != deadline:
+                continue  # rescheduled (seen) since
+
+            heimdall['ts_reported_missing'] = current_time
+            self.__missing[h_id] = heimdall
+
+        return [dict(heimdall) for heimdall in self.__missing.values()]
+
+    def is_missing(self, heimdall_id):
+        return heimdall_id in self.__missing
+
+    def update_heimdall(self, h_id, ts=None):
+        if h_id not in self.__heimdalls:
+            if self.__alert_func:
+                self.__alert_func("%s/BUG: Unknown heimdall ID detected: %s" % (self.__class__, h_id))
+            self.add(h_id)
+
+        heimdall = self.__heimdalls[h_id]
+        heimdall['ts_reported_missing'] = 0
+        heimdall['ts_last_seen'] = time() if ts is None else ts
+        heimdall['deadline'] = heimdall['ts_last_seen'] + self.MISSING_THRESHOLD
+        self.__missing.pop(h_id, None)
+        self.__schedule(h_id)
+
+    def update_last_check(self):
+        self.__last_check = time()
+
+    def __schedule(self, h_id):
+        heimdall = self.__heimdalls[h_id]
+        heappush(self.__deadlines, (heimdall['deadline'], next(self.__seq), h_id))
+
+        # sightings leave stale entries behind - rebuild once they dominate
+        if len(self.__deadlines) > 4 * len(self.__heimdalls) + 64:
+            self.__deadlines = [(h['deadline'], next(self.__seq), h['id'])
+                                for h in self.__heimdalls.values() if h['id'] not in self.__missing]
+            self.__deadlines.sort()
@@ -15,3 +15,75 @@ def readini(filename):
                 result[key] = value
     return result
 
+
+class LineFramer(object):
+    """
+    Incremental newline framer over a single reusable receive buffer.
+
+    Data is received straight into the buffer (recv_into) or copied in (feed),
+    complete lines are handed out one by one through next_line() and whatever
+    partial line remains is carried over to the next read.
+    """
+    def __init__(self, size=4096):
+        self.__chunk_size = size
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = 0  # start of the first unprocessed line
+        self.__end = 0    # end of the received data
+
+    def __len__(self):
+        return self.__end - self.__start
+
+    def recv_into(self, sock):
+        """Receive more data from a socket directly into the buffer"""
+        self.__reserve(self.__chunk_size)
+        num_bytes = sock.recv_into(self.__view[self.__end:])
+        self.__end += num_bytes
+        return num_bytes
+
+    def feed(self, data):
+        """Append already received data to the buffer"""
+        num_bytes = len(data)
+        self.__reserve(num_bytes)
+        self.__view[self.__end:self.__end + num_bytes] = data
+        self.__end += num_bytes
+
+    def last_received(self, num_bytes):
+        """Return a view of the last num_bytes appended to the buffer"""
+        return self.__view[self.__end - num_bytes:self.__end]
+
+    def next_line(self):
+        """Return the next complete line (without the newline) or None"""
+        idx = self.__buffer.find(b'\n', self.__start, self.__end)
+        if idx < 0:
+            return None
+
+        line = bytes(self.__view[self.__start:idx])
+        self.__start = idx + 1
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+        return line
+
+    def flush(self):
+        """Return whatever partial line is left and empty the buffer"""
+        line = bytes(self.__view[self.__start:self.__end])
+        self.__start = self.__end = 0
+        return line
+
+    def __reserve(self, num_bytes):
+        """Make sure there is room for num_bytes more at the end of the buffer"""
+        if len(self.__buffer) - self.__end >= num_bytes:
+            return
+
+        # move the pending partial line to the front first...
+        pending = self.__end - self.__start
+        if self.__start > 0:
+            self.__view[:pending] = self.__view[self.__start:self.__end]
+            self.__start = 0
+            self.__end = pending
+
+        # ...and only grow if that wasn't enough (a very long line)
+        if len(self.__buffer) - self.__end < num_bytes:
+            self.__view.release()
+            self.__buffer.extend(bytes(max(num_bytes, len(self.__buffer))))
+            self.__view = memoryview(self.__buffer)
@@ -3,41 +3,133 @@
 # Version: 20160409-0000
 # Author:  Artex / IceDragon <artex@furcadia.com>
 
+import os
 import sys
+import asyncio
+import threading
 
 from heimon.tests import *
 from heimon import HeimdallTest
+from heimon.aio import ProbeDriver, SessionPool
+from heimon.mux import ProbeMultiplexer, resolve_address
+from heimon.capture import CaptureWriter
+from heimon.timeseries import TimeSeriesStore
+from heimon.metrics import ProbeMetrics, serve_metrics
+from heimon.latency import LatencyTracker
+from heimon.baselines import AnomalyDetector
+from heimon.profiling import COUNTERS, Profiler, install_signal, serve_control
+from heimon.alerts import *
+from heimon.eventlog import Event, EventLog, EventLogDestination
+from heimon.tracker import HeimdallTracklist
+from heimon.scheduler import CoverageScheduler, RateController, TokenBucket
+from heimon.fleet import Target, FleetSupervisor
+from heimon.aggregation import Aggregator, NodeReporter, default_node_name
+from heimon.creds import CredentialPool
+from heimon.states import WhichLoopState
 from heimon.util import *
 
 from time import *
 from os import path
-from glob import glob
 
 
 # --- Configuration --------------------------------------------------------- #
 
-# Destination logfile to store alerts in
+# Destination logfile to store alerts in (None: no plain text log)
 G_ALERTS_LOGFILE = "alerts.log"
 
+# Directory of the structured, indexed alert event log (None: no event log);
+# query it with `python events.py <directory> ...`
+G_EVENT_LOG_DIR = "events"
+G_EVENT_SEGMENT_BYTES = 16 * 1024 * 1024
+
+# Maximum amount of alerts waiting for delivery (per destination) before
+# further alerts get dropped
+G_ALERT_QUEUE_SIZE = 1000
+
+# Interval between forcing the alerts logfile to disk
+G_ALERTS_FSYNC_INTERVAL = 5.0  # secs
+
 # All the heimdall IDs we are looking for
 G_HEIMDALL_IDS = range(1, 7)  # 1..(7-1) - BE CAREFUL!
 
 # Amount of seconds past which a heimdall should be considered missing
 G_HEIMDALL_ALERT_SECS = 60  # secs
 
-# Amount of seconds to wait before re-announcing that a heimdall is missing
-G_FRESHLY_MISSING_THRESHOLD = 60  # secs
+# Amount of seconds to wait before re-announcing an ongoing alert condition
+# (e.g., a heimdall that is still missing) along with how many times it repeated
+G_ALERT_REPEAT_SECS = 300  # secs
 
 # current/max_seen user count percentage below which an alert is triggered
 G_USERCOUNT_THRESHOLD = 10.0  # percent
 
-# `which obtaining delay past which an alert is triggered
-# used to check for lag in obtaining `which results, or incomplete results
-G_WHICH_DELAY_THRESHOLD = 5  # secs
+# How many standard deviations away from its baseline (for that time of day)
+# a figure - user count, current/max user ratio, `which delay, qtemp - has to
+# be to trigger an alert, and how many samples a baseline needs before that
+G_ANOMALY_Z_THRESHOLD = 4.0
+G_ANOMALY_MIN_SAMPLES = 30
+
+# Optional hard ceiling on the `which obtaining delay: past it an alert is
+# triggered (by TestWhichDelayAboveThreshold) whatever TestNoAnomalies has
+# learned to be normal - a baseline slowly drifting up never reaches past it.
+# None leaves the `which delay to TestNoAnomalies alone
+G_WHICH_DELAY_THRESHOLD = None  # secs
 
-# Interval between each login/check
+# Interval between each login/check (when G_PROBE_SCHEDULER is "fixed")
 G_CHECK_INTERVAL = 2.0  # secs
 
+# How to pace the probes: "fixed" (a probe every G_CHECK_INTERVAL secs) or
+# "coverage" (as fast as needed to see every heimdall within
+# G_COVERAGE_WINDOW secs with G_COVERAGE_CONFIDENCE probability)
+G_PROBE_SCHEDULER = "coverage"
+G_COVERAGE_WINDOW = 60.0  # secs
+G_COVERAGE_CONFIDENCE = 0.99
+
+# Probe rate limits for the "coverage" scheduler
+G_MIN_PROBE_RATE = 0.05  # probes/sec
+G_MAX_PROBE_RATE = 2.0  # probes/sec
+
+# While any test is failing, every result speeds probing up this many times
+# (up to G_MAX_RATE_BOOST) to confirm or clear the incident sooner
+G_FAILURE_RATE_BOOST = 2.0
+G_MAX_RATE_BOOST = 4.0
+
+# Every connect/auth error (hinting at an overloaded server) slows probing down
+# this many times (down to G_MIN_RATE_FACTOR) - and holds off speeding up for
+# G_ERROR_BACKOFF_HOLD secs
+G_ERROR_RATE_BACKOFF = 0.5
+G_MIN_RATE_FACTOR = 0.125
+G_ERROR_BACKOFF_HOLD = 60.0  # secs
+
+# Half-life of the speed-up/slow-down above (towards the scheduler's rate)
+G_RATE_DECAY_HALF_LIFE = 120.0  # secs
+
+# Hard cap on logins (probes and persistent sessions alike), with bursts of up
+# to G_LOGIN_BURST logins
+G_MAX_LOGINS_PER_SEC = 1.0  # logins/sec
+G_LOGIN_BURST = 3
+
+# Log the scheduler's estimates every this many results
+G_SCHEDULER_REPORT_EVERY = 100
+
+# How to run the probes: "blocking" (one at a time), "asyncio" or "selectors"
+G_PROBE_ENGINE = "asyncio"
+
+# Amount of probes in flight at once (asyncio/selectors engines only) - the
+# "coverage" scheduler raises it up to G_MAX_PROBE_CONCURRENCY whenever its
+# probe rate takes more probes in flight (and warns when even that is too few)
+G_PROBE_CONCURRENCY = 4
+G_MAX_PROBE_CONCURRENCY = 16
+
+# Amount of persistent sessions sampling the `which round-trip continuously
+# over an established connection (asyncio engine only; 0 disables them)
+G_SESSION_POOL_SIZE = 0
+
+# Interval between `which requests on each persistent session
+G_SESSION_WHICH_INTERVAL = 1.0  # secs
+
+# `which response time on a persistent session past which it counts as stalled
+G_SESSION_STALL_SECS = 5  # secs
+
 # Data I/O and connection timeout
 # used to limit how long each instance would wait for data before timing out
 G_TIMEOUT_SECS = 6.0
@@ -45,101 +137,147 @@ G_TIMEOUT_SECS = 6.0
 # Furcadia gameserver address
 G_ADDRESS = ("lightbringer.furcadia.com", 6500)
 
+# Targets to monitor at once, each a heimon.fleet.Target with its own address,
+# heimdall IDs and credentials path - plus optional overrides of
+# heimdall_alert_secs, usercount_threshold, which_delay_threshold,
+# metrics_address, aggregator_address and node_name. None monitors just
+# G_ADDRESS (with the settings above).
+G_TARGETS = None
+# e.g.:
+# G_TARGETS = [
+#     Target("main", ("lightbringer.furcadia.com", 6500), range(1, 7), path.join('.', 'ini')),
+#     Target("test", ("127.0.0.1", 6500), [1, 2], path.join('.', 'ini', 'test'), usercount_threshold=0),
+# ]
+
+# Amount of worker processes to shard G_TARGETS across (None: one per CPU core)
+G_FLEET_PROCESSES = None
+
+# Multi-node monitoring: with G_AGGREGATOR_ADDRESS set, this monitor (a node)
+# streams its probe results and alert events there over UDP and only logs its
+# own alerts. The aggregator (`python monitor.py --aggregator`, listening on
+# that address) alerts once G_AGGREGATOR_QUORUM live nodes agree, and on a
+# heimdall only once none of the nodes has seen it for G_HEIMDALL_ALERT_SECS
+G_AGGREGATOR_ADDRESS = None  # e.g. ("127.0.0.1", 9542)
+G_AGGREGATOR_QUORUM = 2
+
+# Name this node reports under (None: <hostname>-<pid>), how often it sends the
+# aggregator its open incidents and how long the aggregator waits to hear from
+# a node before counting it out
+G_NODE_NAME = None
+G_NODE_HEARTBEAT_SECS = 5.0  # secs
+G_NODE_TIMEOUT_SECS = 30.0  # secs
+
+# Optional file to record every probe's raw server stream into (for replay.py)
+G_CAPTURE_FILE = None  # e.g. "capture.bin"
+
+# Optional (host, port) to serve Prometheus metrics on (GET /metrics)
+G_METRICS_ADDRESS = None  # e.g. ("127.0.0.1", 9540)
+
+# Signal that starts/stops capturing cProfile stats and tracemalloc snapshots
+# of the running monitor (None to disable), for how many probe cycles and
+# where to dump them
+G_PROFILE_SIGNAL = "SIGUSR1"
+G_PROFILE_CYCLES = 100
+G_PROFILE_DIR = "profiles"
+
+# Optional (host, port) of the profiling control socket - one command per line:
+# "profile [cycles]", "stop", "counters" or "reset" (e.g., via `nc`)
+G_PROFILE_CONTROL_ADDRESS = None  # e.g. ("127.0.0.1", 9541)
+
 # Path to all the INI files to use in the credentials pool
 G_CREDS_PATH = path.join('.', 'ini')
 
-# All the tests to perform on the HeimdallTest result data in this order
-# (the test classes themselves are stored in heimon/tests.py)
+# Minimum amount of time between two logins of the same character
+G_CHARACTER_COOLDOWN = 10.0  # secs
+
+# A character the server rejects is rested for G_CHARACTER_BACKOFF secs,
+# doubling with every further rejection up to G_CHARACTER_MAX_BACKOFF
+G_CHARACTER_BACKOFF = 30.0  # secs
+G_CHARACTER_MAX_BACKOFF = 3600.0  # secs
+
+# How often G_CREDS_PATH is rescanned for added/changed/removed INI files
+G_CREDS_RESCAN_INTERVAL = 30.0  # secs
+
+# How long to wait before retrying when no character is available
+G_CHARACTER_RETRY_SECS = 1.0  # secs
+
+# All the tests to perform on the HeimdallTest result data (run in this order
+# unless a test DEPENDS on a later one; a test is skipped only when a test it
+# depends on did not pass - see heimon/tests.py)
 G_RESULT_TESTS = [
     TestNoError,
     TestUserCountPresent,
     TestUserCountAboveThreshold,
     TestAllComponentsPresent,
-    TestWhichDelayAboveThreshold,
+    TestNoAnomalies,
     TestGlobalIdInSync,
-    TestNoHeimdallsAreMissing,
-    TestNoLongerMissingHeimdalls
+    TestNoHeimdallsAreMissing
 ]
 
 
-# --- Classes --------------------------------------------------------------- #
-# TODO: Get this thing out of here...
-class HeimdallTracklist(object):
-    MISSING_THRESHOLD = 60 # secs
-
-    def __init__(self, heimdall_ids):
-        self.__last_check = time()
-        self.__heimdalls = {}
-        for hid in heimdall_ids:
-            self.add(hid)
-
-    def add(self, heimdall_id):
-        self.__heimdalls[heimdall_id] = {
-            'id': heimdall_id,
-            'ts_added': time(),
-            'ts_last_seen': 0,
-            'ts_reported_missing': 0
-        }
-        return self
-
-    def get(self, heimdall_id):
-        return self.__heimdalls.get(heimdall_id, None)
-
-    def find_missing(self):
-        current_time = time()
+# --- Functions ------------------------------------------------------------- #
+# Alert delivery (see build_alert_sink() for the destinations)
+G_ALERT_SINK = None
+G_EVENT_SINK = None
 
-        def filter_missing(heimdall):
-            delta = current_time - max(heimdall['ts_added'], heimdall['ts_last_seen'])
-            return delta > self.MISSING_THRESHOLD
+# Within fleet worker processes, each target's thread sends its alerts, log
+# lines and results to the fleet supervisor through G_FLEET_LOCAL.emit
+G_FLEET_LOCAL = threading.local()
 
-        # locate missing heimdalls
-        missing_heimdalls = filter(filter_missing, self.__heimdalls.values())
 
-        # update their "reported missing" timestamp
-        for heimdall in missing_heimdalls:
-            heimdall['ts_reported_missing'] = current_time
+def alert(message):
+    """Queue an alert for delivery to STDERR, the alerts logfile and e-mail"""
+    emit = getattr(G_FLEET_LOCAL, 'emit', None)
+    if emit:
+        emit('alert', message)
+        return
 
-        # return the missing heimdalls
-        return missing_heimdalls
+    data = "[%s][ALERT!] %s" % (asctime(), message)
+    if G_ALERT_SINK:
+        G_ALERT_SINK.put(data)
+    else:
+        sys.stderr.write(data + "\n")
 
-    def update_heimdall(self, h_id):
-        if h_id not in self.__heimdalls:
-            alert("%s/BUG: Unknown heimdall ID detected: %s" % (self.__class__, h_id))
-            self.add(h_id)
 
-        self.__heimdalls[h_id]['ts_reported_missing'] = 0
-        self.__heimdalls[h_id]['ts_last_seen'] = time()
+def record_event(kind, key, message, ts, fields):
+    """Queue an alert event (see AlertEngine) for the event log"""
+    emit = getattr(G_FLEET_LOCAL, 'emit', None)
+    if emit:
+        emit('event', Event(ts, kind, key, message, fields))
+        return
 
-    def update_last_check(self):
-        self.__last_check = time()
+    if G_EVENT_SINK:
+        G_EVENT_SINK.put(Event(ts, kind, key, message, fields))
 
 
-# --- Functions ------------------------------------------------------------- #
-# TODO: Something a bit more dignifying than this...
-G_ALERT_BUFFER = []
+def node_alert(message):
+    """Alert function of a node reporting to an aggregator (which decides what gets alerted)"""
+    log("[NODE ALERT] %s" % message)
 
 
-def alert(message):
-    """Display alert in STDERR and add to buffer for later bulk transmission"""
-    global G_ALERT_BUFFER
-    data = "[%s][ALERT!] %s" % (asctime(), message)
-    sys.stderr.write(data + "\n")
-    sys.stdout.write("\x07")
-    G_ALERT_BUFFER += [data]
+def report_event(reporter):
+    """Event function recording alert events and reporting them to the aggregator"""
+    def on_event(kind, key, message, ts, fields):
+        record_event(kind, key, message, ts, fields)
+        reporter.send_event(kind, key, message, ts)
+    return on_event
 
 
-def flush_alert_buffer():
-    """Flush the alert buffer so far into some sort of destination"""
-    all_alerts = G_ALERT_BUFFER[:] # clone the list
-    G_ALERT_BUFFER.clear()
-    do_save(all_alerts)
-    do_email(all_alerts)
-    return all_alerts
+def build_alert_sink():
+    """Build the alert sink and all of its destinations"""
+    destinations = [StreamDestination(sys.stderr, bell=True)]
+    if G_ALERTS_LOGFILE:
+        destinations.append(FileDestination(G_ALERTS_LOGFILE, G_ALERTS_FSYNC_INTERVAL))
+    destinations.append(CallbackDestination(do_email))
+    return AlertSink(destinations, G_ALERT_QUEUE_SIZE)
 
 
-def do_save(alerts):
-    with open(G_ALERTS_LOGFILE, 'a', encoding='utf-8') as fd:
-        fd.write("\n".join(alerts + ['']))
+def build_event_sink():
+    """Build the sink writing alert events to the event log (None if there is none)"""
+    if not G_EVENT_LOG_DIR:
+        return None
+    event_log = EventLog(G_EVENT_LOG_DIR, G_EVENT_SEGMENT_BYTES)
+    return AlertSink([EventLogDestination(event_log, G_ALERTS_FSYNC_INTERVAL)], G_ALERT_QUEUE_SIZE)
 
 
 def do_email(alerts):
@@ -150,61 +288,446 @@ def do_email(alerts):
 
 
 def log(message):
+    emit = getattr(G_FLEET_LOCAL, 'emit', None)
+    if emit:
+        emit('log', message)
+        return
+
     sys.stdout.write("[%s] %s\n" % (asctime(), message))
 
 
-def read_chars(ini_path):
-    def filter_bad_creds(info):
-        return "name" in info and "password" in info and "password" != "Password"
-    return list(filter(filter_bad_creds, map(readini, glob(path.join(ini_path, '*.ini')))))
+def release_character(test_runner, result):
+    """Return the character a HeimdallTest used to the credentials pool"""
+    if 'credentials' in test_runner.config and result.character is not None:
+        test_runner.config['credentials'].release(result.character, result.is_rejected)
 
 
-def main(argv):
-    HeimdallTest.settimeout(G_TIMEOUT_SECS)
+def handle_result(test_runner, result):
+    """Run all the tests against a single HeimdallTest result"""
+    handle_results(test_runner, [result])
 
-    tracker = HeimdallTracklist(G_HEIMDALL_IDS)
 
-    # prepare factory and all the requirements for the tests within
-    test_runner = TestRunner(G_RESULT_TESTS, alert, log)
-    test_runner.config['heimdall_tracker'] = tracker
-    test_runner.config['usercount_threshold'] = G_USERCOUNT_THRESHOLD
-    test_runner.config['delay_threshold'] = G_WHICH_DELAY_THRESHOLD
-    test_runner.config['freshly_missing_threshold'] = G_FRESHLY_MISSING_THRESHOLD
+def handle_results(test_runner, results):
+    """Run all the tests against a batch of HeimdallTest results (e.g., all that finished at once)"""
+    is_report_due = False
+    for result in results:
+        release_character(test_runner, result)
 
-    print("Reading Furcadia characters...")
-    chars = read_chars(G_CREDS_PATH)
-    if len(chars) == 0:
-        print("NO CHARACTERS FOUND AT %s - ABORTING" % G_CREDS_PATH)
-        return -1
+        if result.heimdall is not None:
+            print("Found heimdall %d" % result.heimdall.id)
+
+        if 'history' in test_runner.config:
+            test_runner.config['history'].record_result(result)
+
+        if 'latency' in test_runner.config:
+            test_runner.config['latency'].observe_result(result)
+
+        if 'metrics' in test_runner.config:
+            test_runner.config['metrics'].observe_result(result)
+
+        test_runner.config['num_results'] = test_runner.config.get('num_results', 0) + 1
+        is_report_due = is_report_due or test_runner.config['num_results'] % G_SCHEDULER_REPORT_EVERY == 0
+        if 'scheduler' in test_runner.config:
+            test_runner.config['scheduler'].observe(result)
+
+        if 'reporter' in test_runner.config:
+            test_runner.config['reporter'].send_result(result)
+
+        emit = getattr(G_FLEET_LOCAL, 'emit', None)
+        if emit:
+            emit('result', result)
+
+    if is_report_due and 'scheduler' in test_runner.config:
+        log_scheduler_report(test_runner.config['scheduler'].report())
+
+    # process results
+    print("Testing %d result(s)..." % len(results))
+    try:
+        test_runner.test_batch(results)
+    except Exception as ex:
+        alert("main()/BUG: Caught exception while executing -> %s" % ex)
+        raise ex
+
+    incidents = test_runner.config['alert_engine'].incidents()
+    if 'reporter' in test_runner.config:
+        test_runner.config['reporter'].heartbeat(incidents)
+
+    rate_control = test_runner.config['rate_control']
+    is_failing = len(incidents) > 0
+    for result in results:
+        rate_control.observe(result, is_failing)
+    if is_report_due:
+        log("Probe rate: %.2f probes/sec (x%.2f)" % (rate_control.rate(), rate_control.factor()))
+
+    if 'profiler' in test_runner.config:
+        test_runner.config['profiler'].cycle(len(results))
+
+
+def batch_results(test_runner, schedule_func):
+    """
+    Result handler collecting the results that arrive together and handing
+    them to handle_results() in one batch, flushed via schedule_func(flush)
+    """
+    pending = []
+
+    def flush():
+        batch = pending[:]
+        del pending[:]
+        handle_results(test_runner, batch)
+
+    def on_result(result):
+        pending.append(result)
+        if len(pending) == 1:
+            schedule_func(flush)
+
+    return on_result
 
-    char_index = 0
+
+def handle_session_sample(test_runner, session, delay):
+    """Record a `which round-trip measured over a persistent session"""
+    h_id = session.heimdall_id
+    if h_id is not None:
+        test_runner.config['heimdall_tracker'].update_heimdall(h_id)
+
+    test_runner.config['history'].add((h_id, 'session.which_rtt'), delay)
+    if 'metrics' in test_runner.config:
+        test_runner.config['metrics'].observe_session_sample(h_id, delay)
+    test_runner.config['alert_engine'].resolve(AlertKey('WhichSession', h_id, None))
+
+
+def handle_session_stall(test_runner, session, elapsed, num_lines):
+    """Alert about a `which that stalled on a persistent session"""
+    h_id = session.heimdall_id
+    if 'metrics' in test_runner.config:
+        test_runner.config['metrics'].observe_session_stall(h_id)
+    test_runner.config['alert_engine'].alert(
+        AlertKey('WhichSession', h_id, None),
+        "`which stalled for %.2f secs (%d/%d lines) on a persistent session (heimdall: %s, character: %s)" % (
+            elapsed, num_lines, WhichLoopState.MAX_WHICH_LINES, "?" if h_id is None else h_id,
+            session.result.character))
+
+
+def handle_session_closed(test_runner, result):
+    release_character(test_runner, result)
+    log("Persistent session closed: %s" % result.error_msg)
+
+
+def log_scheduler_report(report):
+    latency = report['detection_latency']
+    log("Scheduler: %.2f probes/sec (actual %.2f) - every heimdall seen within %s secs with %.1f%% confidence "
+        "(target: %d secs); concurrency needed: %d; suspicious: %s" % (
+            report['rate'], report['actual_rate'],
+            "?" if latency is None else "%.0f" % latency, report['confidence'] * 100,
+            report['target_window'], report['concurrency_needed'], report['suspicious'] or "none"))
+
+
+def next_probe_delay(test_runner):
+    """Secs to wait before starting the next probe"""
+    return test_runner.config['rate_control'].reserve()
+
+
+def probe_concurrency(test_runner):
+    """Amount of probes to keep in flight right now (asyncio/selectors engines)"""
+    if 'scheduler' not in test_runner.config:
+        return G_PROBE_CONCURRENCY
+
+    needed = test_runner.config['scheduler'].concurrency_needed(test_runner.config['rate_control'].rate())
+    is_short = needed > G_MAX_PROBE_CONCURRENCY
+    if is_short and not test_runner.config.get('concurrency_short'):
+        log("WARNING: %d probes in flight needed for the target coverage, but G_MAX_PROBE_CONCURRENCY is %d - "
+            "heimdalls may go unseen for longer than %d secs" % (needed, G_MAX_PROBE_CONCURRENCY, G_COVERAGE_WINDOW))
+    test_runner.config['concurrency_short'] = is_short
+    return max(G_PROBE_CONCURRENCY, min(G_MAX_PROBE_CONCURRENCY, needed))
+
+
+def max_probe_concurrency():
+    """Amount of probe slots the asyncio/selectors engines set up"""
+    return max(G_PROBE_CONCURRENCY, G_MAX_PROBE_CONCURRENCY) if G_PROBE_SCHEDULER == "coverage" else G_PROBE_CONCURRENCY
+
+
+def run_blocking(test_runner, next_character):
     while True:
         try:
-            character = chars[char_index % len(chars)]
-            char_index += 1
+            character = next_character()
+            while character is None:
+                print("No character available - waiting...")
+                sleep(G_CHARACTER_RETRY_SECS)
+                character = next_character()
 
             print("Building HeimdallTest instance... [character: %s]" % character['name'])
-            heimtest = HeimdallTest(G_ADDRESS, character)
+            heimtest = HeimdallTest(test_runner.config['address'], character)
 
             print("Obtaining data from the server...")
             heimtest.connect()
             while heimtest.is_connected():
                 heimtest.process_next()
-
-            if 'heimdall' in heimtest.result['which']:
-                print("Found heimdall %d" % heimtest.result['which']['heimdall']['id'])
-
-            # process results
-            print("Testing result...")
-            test_runner.test(heimtest.result)
         except Exception as ex:
             alert("main()/BUG: Caught exception while executing -> %s" % ex)
             raise ex
 
+        handle_result(test_runner, heimtest.result)
+
         # sleep until the next time
-        print("Sleeping (%d secs)" % G_CHECK_INTERVAL)
-        sleep(G_CHECK_INTERVAL)
-        flush_alert_buffer()
+        delay = next_probe_delay(test_runner)
+        print("Sleeping (%.2f secs)" % delay)
+        sleep(delay)
+
+
+def run_asyncio(test_runner, next_character):
+    print("Running up to %d probes at once..." % max_probe_concurrency())
+    # results finishing within the same loop iteration are tested together
+    on_result = batch_results(test_runner, lambda flush: asyncio.get_running_loop().call_soon(flush))
+    driver = ProbeDriver(test_runner.config['address'], next_character, on_result,
+                         concurrency=max_probe_concurrency(),
+                         delay_func=lambda: next_probe_delay(test_runner),
+                         concurrency_func=lambda: probe_concurrency(test_runner))
+    tasks = [driver.run()]
+
+    if G_SESSION_POOL_SIZE > 0:
+        print("Keeping %d persistent session(s) open..." % G_SESSION_POOL_SIZE)
+        pool = SessionPool(test_runner.config['address'], next_character,
+                           lambda session, delay: handle_session_sample(test_runner, session, delay),
+                           lambda session, elapsed, num_lines: handle_session_stall(
+                               test_runner, session, elapsed, num_lines),
+                           lambda result: handle_session_closed(test_runner, result),
+                           size=G_SESSION_POOL_SIZE,
+                           interval=G_SESSION_WHICH_INTERVAL,
+                           stall_secs=G_SESSION_STALL_SECS,
+                           reconnect_delay=G_CHECK_INTERVAL,
+                           delay_func=test_runner.config['login_bucket'].reserve)
+        tasks.append(pool.run())
+
+    async def run_all():
+        await asyncio.gather(*tasks)
+    asyncio.run(run_all())
+
+
+def run_selectors(test_runner, next_character):
+    # resolved once: the multiplexer's thread must never wait for DNS
+    try:
+        address = resolve_address(test_runner.config['address'])
+    except OSError as ex:
+        alert("run_selectors(): Cannot resolve %s:%d -> %s" % (tuple(test_runner.config['address']) + (ex,)))
+        return
+
+    print("Running up to %d probes at once..." % max_probe_concurrency())
+    mux = ProbeMultiplexer()
+    on_result = batch_results(test_runner, lambda flush: mux.call_later(0, flush))
+
+    def start(slot):
+        # slots past the current concurrency idle until they are needed
+        if slot >= probe_concurrency(test_runner):
+            mux.call_later(ProbeDriver.SLOT_CHECK_SECS, lambda: start(slot))
+            return
+        mux.call_later(next_probe_delay(test_runner), lambda: launch(slot))
+
+    def launch(slot):
+        character = next_character()
+        if character is None:
+            mux.call_later(G_CHARACTER_RETRY_SECS, lambda: launch(slot))
+            return
+        mux.add(HeimdallTest(address, character), lambda heimtest: on_done(slot, heimtest))
+
+    def on_done(slot, heimtest):
+        on_result(heimtest.result)
+        start(slot)
+
+    for slot in range(max_probe_concurrency()):
+        start(slot)
+    mux.run()
+
+
+def main(argv):
+    global G_ALERT_SINK, G_EVENT_SINK
+    G_ALERT_SINK = build_alert_sink()
+    G_EVENT_SINK = build_event_sink()
+    try:
+        return run_monitor(argv)
+    finally:
+        G_ALERT_SINK.close()
+        if G_ALERT_SINK.num_dropped() > 0:
+            sys.stderr.write("%d alert(s) were dropped (queue full)\n" % G_ALERT_SINK.num_dropped())
+        G_ALERT_SINK = None
+        if G_EVENT_SINK:
+            G_EVENT_SINK.close()
+            if G_EVENT_SINK.num_dropped() > 0:
+                sys.stderr.write("%d event(s) were dropped (queue full)\n" % G_EVENT_SINK.num_dropped())
+            G_EVENT_SINK = None
+
+
+def run_monitor(argv):
+    if "--aggregator" in argv[1:]:
+        return run_aggregator()
+
+    if G_TARGETS is None:
+        HeimdallTest.settimeout(G_TIMEOUT_SECS)
+        if G_CAPTURE_FILE:
+            HeimdallTest.setcapture(CaptureWriter(G_CAPTURE_FILE))
+        return run_target(Target("default", G_ADDRESS, G_HEIMDALL_IDS, G_CREDS_PATH,
+                                 metrics_address=G_METRICS_ADDRESS,
+                                 profile_control_address=G_PROFILE_CONTROL_ADDRESS,
+                                 aggregator_address=G_AGGREGATOR_ADDRESS,
+                                 node_name=G_NODE_NAME))
+    return run_fleet(G_TARGETS)
+
+
+def run_fleet(targets):
+    """Monitor all targets sharded across worker processes, merging what they report"""
+    def on_event(kind, name, payload):
+        if kind == 'alert':
+            alert(payload if name is None else "[%s] %s" % (name, payload))
+        elif kind == 'log':
+            log("[%s] %s" % (name, payload))
+        elif kind == 'result':
+            log("[%s] %s" % (name, describe_result(payload)))
+        elif kind == 'event':
+            fields = dict(payload.fields, target=name)
+            record_event(payload.kind, payload.key, "[%s] %s" % (name, payload.message), payload.ts, fields)
+
+    supervisor = FleetSupervisor(targets, run_fleet_target, on_event, G_FLEET_PROCESSES)
+    for (shard_id, names) in enumerate(supervisor.shards()):
+        print("Shard %d: %s" % (shard_id, ", ".join(names)))
+
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+
+    print("DONE")
+    return 0
+
+
+def run_aggregator():
+    """Merge what the monitor nodes report, alerting on what a quorum of them agrees on"""
+    if not G_AGGREGATOR_ADDRESS:
+        print("G_AGGREGATOR_ADDRESS IS NOT SET - ABORTING")
+        return -1
+
+    tracker = HeimdallTracklist(G_HEIMDALL_IDS, G_HEIMDALL_ALERT_SECS, alert)
+    alert_engine = AlertEngine(alert, G_ALERT_REPEAT_SECS, record_event)
+    aggregator = Aggregator(tracker, alert_engine, G_AGGREGATOR_QUORUM, G_NODE_TIMEOUT_SECS, log)
+    print("Aggregating node reports at %s:%d (quorum: %d)" % (tuple(G_AGGREGATOR_ADDRESS) + (G_AGGREGATOR_QUORUM,)))
+    try:
+        aggregator.run(G_AGGREGATOR_ADDRESS)
+    except KeyboardInterrupt:
+        pass
+
+    if aggregator.num_malformed > 0:
+        sys.stderr.write("%d malformed report(s) were ignored\n" % aggregator.num_malformed)
+    print("DONE")
+    return 0
+
+
+def describe_result(result):
+    """One-line summary of a HeimdallTest result"""
+    if result.is_error:
+        return "error in %s: %s" % (result.error_state, result.error_msg)
+    if result.heimdall is None:
+        return "no heimdall reported"
+    return "heimdall %d, `which took %.3f secs" % (result.heimdall.id, result.which_delay)
+
+
+G_FLEET_CAPTURE_LOCK = threading.Lock()
+
+
+def run_fleet_target(target, emit):
+    """Entry point of each target's thread in a fleet worker process"""
+    G_FLEET_LOCAL.emit = emit
+    HeimdallTest.settimeout(G_TIMEOUT_SECS)
+    with G_FLEET_CAPTURE_LOCK:
+        # one capture file per worker process (its targets' sessions interleave)
+        if G_CAPTURE_FILE and HeimdallTest.CAPTURE is None:
+            HeimdallTest.setcapture(CaptureWriter("%s.%d" % (G_CAPTURE_FILE, os.getpid())))
+    run_target(target)
+
+
+def run_target(target):
+    """Monitor a single target until its probe engine stops"""
+    (alert_func, event_func, reporter) = (alert, record_event, None)
+    aggregator_address = target.get('aggregator_address')
+    if aggregator_address:
+        reporter = NodeReporter(aggregator_address, target.get('node_name') or default_node_name(),
+                                G_NODE_HEARTBEAT_SECS)
+        (alert_func, event_func) = (node_alert, report_event(reporter))
+        print("Reporting to the aggregator at %s:%d as %s" % (tuple(aggregator_address) + (reporter.node,)))
+
+    tracker = HeimdallTracklist(target.heimdall_ids, target.get('heimdall_alert_secs', G_HEIMDALL_ALERT_SECS),
+                                alert_func)
+
+    # prepare factory and all the requirements for the tests within
+    tests = list(G_RESULT_TESTS)
+    delay_threshold = target.get('which_delay_threshold', G_WHICH_DELAY_THRESHOLD)
+    if delay_threshold is not None:
+        tests.append(TestWhichDelayAboveThreshold)
+    test_runner = TestRunner(tests, alert_func, log, G_ALERT_REPEAT_SECS, event_func)
+    if reporter:
+        test_runner.config['reporter'] = reporter
+    test_runner.config['address'] = target.address
+    test_runner.config['heimdall_tracker'] = tracker
+    test_runner.config['usercount_threshold'] = target.get('usercount_threshold', G_USERCOUNT_THRESHOLD)
+    if delay_threshold is not None:
+        test_runner.config['delay_threshold'] = delay_threshold
+    test_runner.config['history'] = TimeSeriesStore()
+    test_runner.config['latency'] = LatencyTracker()
+    test_runner.config['baselines'] = AnomalyDetector(G_ANOMALY_Z_THRESHOLD, G_ANOMALY_MIN_SAMPLES)
+
+    if G_PROBE_SCHEDULER == "coverage":
+        test_runner.config['scheduler'] = CoverageScheduler(
+            target.heimdall_ids, G_COVERAGE_WINDOW, G_COVERAGE_CONFIDENCE, G_MIN_PROBE_RATE, G_MAX_PROBE_RATE)
+        base_rate_func = test_runner.config['scheduler'].rate
+    else:
+        base_rate_func = lambda: 1.0 / G_CHECK_INTERVAL if G_CHECK_INTERVAL > 0 else float('inf')
+
+    test_runner.config['login_bucket'] = TokenBucket(G_MAX_LOGINS_PER_SEC, G_LOGIN_BURST)
+    test_runner.config['rate_control'] = RateController(
+        base_rate_func, test_runner.config['login_bucket'], G_FAILURE_RATE_BOOST, G_MAX_RATE_BOOST,
+        G_ERROR_RATE_BACKOFF, G_MIN_RATE_FACTOR, G_RATE_DECAY_HALF_LIFE, G_ERROR_BACKOFF_HOLD)
+
+    metrics_address = target.get('metrics_address')
+    if metrics_address:
+        metrics = ProbeMetrics()
+        metrics.track_last_seen(tracker.last_seen)
+        metrics.track_latency(test_runner.config['latency'])
+        metrics.track_counters(COUNTERS)
+        test_runner.config['metrics'] = metrics
+        serve_metrics(metrics.registry, metrics_address)
+        print("Serving metrics at http://%s:%d/metrics" % metrics_address)
+
+    profiler = Profiler(G_PROFILE_DIR, G_PROFILE_CYCLES, log)
+    test_runner.config['profiler'] = profiler
+    if G_PROFILE_SIGNAL and threading.current_thread() is threading.main_thread():
+        install_signal(profiler, G_PROFILE_SIGNAL)
+        print("Send %s to start/stop profiling (pid %d)" % (G_PROFILE_SIGNAL, os.getpid()))
+
+    control_address = target.get('profile_control_address')
+    if control_address:
+        serve_control(profiler, control_address)
+        print("Accepting profiling commands at %s:%d" % control_address)
+
+    print("Reading Furcadia characters...")
+    credentials = CredentialPool(target.creds_path, G_CHARACTER_COOLDOWN, G_CHARACTER_BACKOFF,
+                                 G_CHARACTER_MAX_BACKOFF, G_CREDS_RESCAN_INTERVAL)
+    if len(credentials) == 0:
+        print("NO CHARACTERS FOUND AT %s - ABORTING" % target.creds_path)
+        return -1
+
+    test_runner.config['credentials'] = credentials
+    next_character = credentials.lease
+
+    engines = {
+        'blocking': run_blocking,
+        'asyncio': run_asyncio,
+        'selectors': run_selectors,
+    }
+
+    if G_PROBE_ENGINE not in engines:
+        print("UNKNOWN PROBE ENGINE: %s - ABORTING" % G_PROBE_ENGINE)
+        return -1
+
+    if G_SESSION_POOL_SIZE > 0 and G_PROBE_ENGINE != 'asyncio':
+        print("Persistent sessions need the asyncio probe engine - not starting any")
+
+    engines[G_PROBE_ENGINE](test_runner, next_character)
 
     print("DONE")
     return 0
@@ -0,0 +1,65 @@
+# Replay Component - Project Heimon
+#
+# Plays captured probe sessions (see G_CAPTURE_FILE in monitor.py) back
+# through the HeimdallTest state machine, either at full speed or at the
+# original pace, and summarizes what came out of them.
+#
+# Usage: python replay.py <capture file> [--paced] [--verbose] [--repeat N]
+#
+# Author:  Artex / IceDragon <artex@furcadia.com>
+
+import os
+import sys
+import argparse
+
+from collections import Counter
+from contextlib import redirect_stdout
+from time import perf_counter
+from heimon.capture import ReplayTest, read_sessions
+
+
+def replay(sessions, paced=False):
+    """Replay all the sessions and return their results"""
+    return [ReplayTest(session).run(paced) for session in sessions]
+
+
+def summarize(results):
+    errors = Counter(r.error_msg for r in results if r.is_error)
+    heimdalls = Counter(r.heimdall.id for r in results if r.heimdall is not None)
+    incomplete = sum(1 for r in results if not r.is_error and not r.is_which_complete())
+
+    print("Sessions:   %d (%d errors, %d incomplete `which)" % (len(results), sum(errors.values()), incomplete))
+    for (msg, num) in errors.most_common():
+        print("  error:    %5d x %s" % (num, msg))
+    for (h_id, num) in sorted(heimdalls.items()):
+        print("  heimdall: %5d x %d" % (num, h_id))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay captured Heimon probe sessions")
+    parser.add_argument('filename', help="capture file written by monitor.py")
+    parser.add_argument('--paced', action='store_true', help="replay at the original pace")
+    parser.add_argument('--verbose', action='store_true', help="show state transitions")
+    parser.add_argument('--repeat', type=int, default=1, help="replay everything N times")
+    args = parser.parse_args(argv[1:])
+
+    sessions = read_sessions(args.filename)
+    print("Read %d sessions from %s" % (len(sessions), args.filename))
+
+    ts_start = perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        output = sys.stdout if args.verbose else devnull
+        with redirect_stdout(output):
+            for i in range(args.repeat):
+                results = replay(sessions, args.paced)
+    elapsed = perf_counter() - ts_start
+
+    summarize(results)
+    num_replayed = len(sessions) * args.repeat
+    print("Replayed %d sessions in %.3f secs (%.0f sessions/sec)" % (
+        num_replayed, elapsed, num_replayed / elapsed if elapsed > 0 else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))